@@ -3,8 +3,7 @@
 
 import os
 import sys
-sys.path.insert(0, '/home/runw/Project/feature-3dgs/scene')
-from colmap_loader import read_extrinsics_binary
+from colmap_reader import count_registered_images
 
 robust_dir = '/home/runw/Project/LSM/data/scannet_test_colmap_robust'
 original_dir = '/home/runw/Project/data/colmap/data/scannet_test_feature3dgs'
@@ -34,12 +33,10 @@ for scene in scenes:
     original_count = 0
     
     if os.path.exists(robust_path):
-        robust_extr = read_extrinsics_binary(robust_path)
-        robust_count = len(robust_extr)
+        robust_count = count_registered_images(robust_path)
     
     if os.path.exists(original_path):
-        original_extr = read_extrinsics_binary(original_path)
-        original_count = len(original_extr)
+        original_count = count_registered_images(original_path)
     
     if robust_count == 0:
         failed_scenes.append((scene, original_count, robust_count))
@@ -0,0 +1,138 @@
+"""
+Run the demo on many scenes with a single model load (see demo.py for one scene)
+
+The stages of consecutive scenes overlap: the next scene is decoded while the current one runs inference
+and the previous one renders and encodes its videos. Scenes whose gaussians.ply (written last) already exists are skipped.
+
+Manifest: one scene per line, '<scene_name> <image or directory> [<image> ...]', blank lines and # comments are ignored
+
+Usage:
+    python batch_demo.py --manifest scenes.txt --model_path checkpoints/pretrained_models/checkpoint-final.pth --output_root outputs
+"""
+import os
+import time
+import shlex
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import torch
+
+from large_spatial_model.utils.path_manager import init_all_submodules
+init_all_submodules()
+
+from large_spatial_model.model import LSM_Dust3R
+from large_spatial_model.utils.visualization_utils import load_images, transfer_images_to_device, predict_scene, render_scene_videos
+
+
+def read_manifest(manifest_path):
+    scenes = []
+    with open(manifest_path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            fields = shlex.split(line, comments=True)
+            if not fields:
+                continue
+            if len(fields) < 2:
+                raise ValueError(f"{manifest_path}:{line_number}: expected '<scene_name> <image or directory> [<image> ...]'")
+            scene_name, file_list = fields[0], fields[1:]
+            # a single directory is passed as is, load_images lists it
+            scenes.append((scene_name, file_list[0] if len(file_list) == 1 and os.path.isdir(file_list[0]) else file_list))
+    return scenes
+
+
+def synchronize(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def main(args):
+    scenes = read_manifest(args.manifest)
+    todo = [(name, file_list) for name, file_list in scenes
+            if args.overwrite or not os.path.isfile(os.path.join(args.output_root, name, 'gaussians.ply'))]
+    print(f"{len(scenes)} scenes in {args.manifest}, {len(scenes) - len(todo)} already done, {len(todo)} to process")
+    if not todo:
+        return
+
+    start = time.time()
+    model = LSM_Dust3R.from_pretrained(args.model_path, device=args.device)
+    model.eval()
+    print(f"Loaded model in {time.time() - start:.1f}s")
+
+    timings = {}
+    failed = []
+
+    def decode(scene):
+        name, file_list = scene
+        decode_start = time.time()
+        images = load_images(file_list, args.resolution, verbose=False, cache_dir=args.image_cache_dir,
+                             save_dir=os.path.join(args.output_root, name, 'processed_images'))
+        timings[name] = {'decode': time.time() - decode_start}
+        return images
+
+    def render(name, gaussians, extrinsics, intrinsics, image_shape):
+        render_start = time.time()
+        render_scene_videos(gaussians, extrinsics, intrinsics, image_shape, model, os.path.join(args.output_root, name),
+                            args.device, args.n_interp, args.fps, args.semantic_mode)
+        synchronize(args.device)
+        timings[name]['render'] = time.time() - render_start
+        scene_timings = timings[name]
+        print(f"[{name}] decode {scene_timings['decode']:.1f}s, inference {scene_timings['inference']:.1f}s, "
+              f"render + encode {scene_timings['render']:.1f}s")
+
+    def wait(future, name):
+        try:
+            future.result()
+        except Exception as e:
+            print(f"[{name}] failed: {e!r}")
+            failed.append(name)
+
+    run_start = time.time()
+    with ThreadPoolExecutor(max_workers=1) as decode_pool, ThreadPoolExecutor(max_workers=1) as render_pool:
+        next_images = decode_pool.submit(decode, todo[0])
+        pending_render = None
+        for i, (name, file_list) in enumerate(todo):
+            images_future = next_images
+            if i + 1 < len(todo):
+                next_images = decode_pool.submit(decode, todo[i + 1])
+            try:
+                images = transfer_images_to_device(images_future.result(), args.device)
+                inference_start = time.time()
+                gaussians, extrinsics, intrinsics = predict_scene(images, model, args.device, args.pose_mode)
+                synchronize(args.device)
+                timings[name]['inference'] = time.time() - inference_start
+            except Exception as e:
+                print(f"[{name}] failed: {e!r}")
+                failed.append(name)
+                continue
+            # at most one scene rendering at a time, it overlaps with the inference of the next one
+            if pending_render is not None:
+                wait(*pending_render)
+            pending_render = (render_pool.submit(render, name, gaussians, extrinsics, intrinsics, images[0]['true_shape'][0]), name)
+            print(f"[{i + 1}/{len(todo)}] {name} inferred, {time.time() - run_start:.1f}s elapsed")
+        if pending_render is not None:
+            wait(*pending_render)
+
+    total = time.time() - run_start
+    done = len(todo) - len(failed)
+    print(f"\nProcessed {done}/{len(todo)} scenes in {total:.1f}s ({total / max(done, 1):.1f}s per scene)")
+    if failed:
+        print(f"Failed scenes: {' '.join(failed)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest', type=str, required=True,
+                        help="text file, one '<scene_name> <image or directory> [<image> ...]' per line")
+    parser.add_argument('--model_path', type=str, required=True)
+    parser.add_argument('--output_root', type=str, required=True, help='outputs of every scene go to output_root/scene_name')
+    parser.add_argument('--device', type=str, default='cuda')
+    parser.add_argument('--resolution', type=int, default=256)
+    parser.add_argument('--n_interp', type=int, default=90)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--semantic_mode', type=str, default='feature', choices=['feature', 'logits'],
+                        help='feature: decode the 512-d feature map per frame, logits: rasterize per-Gaussian class logits')
+    parser.add_argument('--image_cache_dir', type=str, default=None,
+                        help='persistent cache of preprocessed input images, reused across runs')
+    parser.add_argument('--pose_mode', type=str, default='pairviewer', choices=['forward', 'pairviewer'],
+                        help='forward: cameras from the LSM pointmaps, pairviewer: extra dust3r inference and global aligner')
+    parser.add_argument('--overwrite', action='store_true', help='also process scenes that already have outputs')
+    args = parser.parse_args()
+    main(args)
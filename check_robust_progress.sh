@@ -10,28 +10,8 @@ echo "========================================="
 echo "Time: $(date)"
 echo ""
 
-# Count completed scenes
-if [ -d "$ROBUST_DIR" ]; then
-    total_scenes=$(ls -d "$ROBUST_DIR"/scene* 2>/dev/null | wc -l)
-    successful=0
-    failed=0
-    
-    for scene_dir in "$ROBUST_DIR"/scene*; do
-        scene=$(basename "$scene_dir")
-        
-        if [ -f "$scene_dir/sparse/0/images.bin" ]; then
-            successful=$((successful + 1))
-        else
-            failed=$((failed + 1))
-        fi
-    done
-    
-    echo "Processed: $total_scenes / 40 scenes"
-    echo "  ✅ Successful: $successful"
-    echo "  ❌ Failed: $failed"
-else
-    echo "No output directory yet. Processing may be starting..."
-fi
+# Per-scene state, timings and exit codes from the batch manifest
+python /home/runw/Project/LSM/colmap_batch.py status --output_path "$ROBUST_DIR"
 
 echo ""
 echo "========================================="
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Parallel, resumable COLMAP batch runner for the ScanNet test scenes.
+- Runs colmap_scannet_test.py (or the robust variant) on several scenes at once under a CPU thread budget
+- Skips scenes that already have a reconstruction
+- Records per-scene and per-step timings and exit codes in a JSON manifest
+- `status` summarizes a running or finished batch from the manifest
+
+Usage:
+    python colmap_batch.py run --source_path ... --output_path ... --threads_per_job 4 --no_gpu
+    python colmap_batch.py status --output_path ...
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+import threading
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SCRIPTS = {
+    'standard': 'colmap_scannet_test.py',
+    'robust': 'colmap_scannet_test_robust.py',
+}
+MANIFEST_FILE = 'colmap_manifest.json'
+STEPS_FILE = 'colmap_steps.json'  # written by the per-scene scripts
+MATCHING_FILE = 'colmap_matching.json'  # matching decisions of the robust script
+
+
+class StepLog:
+    """
+    Wall time and exit code of each COLMAP step of one scene, kept in colmap_steps.json for the batch runner
+    """
+    def __init__(self, scene_output):
+        self.path = os.path.join(scene_output, STEPS_FILE)
+        self.steps = []
+        # a run that fails before its first step must not leave the previous run's steps behind
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def run(self, name, cmd):
+        """Run one COLMAP step and return its exit code"""
+        start = time.time()
+        exit_code = os.waitstatus_to_exitcode(os.system(cmd))
+        self.steps.append({'step': name, 'seconds': round(time.time() - start, 2), 'exit_code': exit_code})
+        with open(self.path, 'w') as f:
+            json.dump(self.steps, f, indent=2)
+        return exit_code
+
+
+def is_scene_complete(output_path, scene):
+    return os.path.isfile(os.path.join(output_path, scene, 'sparse', '0', 'images.bin'))
+
+
+def load_json(path, default):
+    if not os.path.isfile(path):
+        return default
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def matching_summary(scenes):
+    """
+    Escalation statistics of the adaptive matching mode over manifest entries
+    """
+    adaptive = [entry for entry in scenes.values()
+                if entry.get('matching') and entry['matching'].get('mode') == 'adaptive']
+    if not adaptive:
+        return None
+    escalated = [entry for entry in adaptive if entry['matching'].get('escalated')]
+    escalation_seconds = [sum(step['seconds'] for step in entry.get('steps', [])
+                              if step['step'].endswith('_matcher') and step['step'] != 'sequential_matcher')
+                          for entry in escalated]
+    summary = f"Adaptive matching: {len(adaptive) - len(escalated)} scenes skipped escalation, {len(escalated)} escalated"
+    if escalation_seconds:
+        # skipped scenes would have paid roughly the same escalation cost
+        mean_seconds = sum(escalation_seconds) / len(escalation_seconds)
+        summary += (f" ({mean_seconds / 60:.1f} min of escalation matching per escalated scene, "
+                    f"~{mean_seconds * (len(adaptive) - len(escalated)) / 60:.1f} min saved)")
+    return summary
+
+
+class Manifest:
+    """Thread-safe JSON manifest, rewritten atomically on every update"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {'scenes': {}}
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.data = json.load(f)
+
+    def update(self, scene=None, **fields):
+        with self.lock:
+            if scene is None:
+                self.data.update(fields)
+            else:
+                self.data['scenes'].setdefault(scene, {}).update(fields)
+            tmp_path = f"{self.path}.tmp{os.getpid()}"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.data, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def run_scene(scene, args, manifest):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), SCRIPTS[args.mode])
+    scene_output = os.path.join(args.output_path, scene)
+    os.makedirs(scene_output, exist_ok=True)
+    cmd = [sys.executable, script,
+           '--scene', scene,
+           '--source_path', args.source_path,
+           '--output_path', args.output_path,
+           '--colmap_executable', args.colmap_executable,
+           '--num_threads', str(args.threads_per_job)]
+    if args.no_gpu:
+        cmd.append('--no_gpu')
+    if args.mode == 'robust':
+        cmd += ['--matching', args.matching, '--escalation', args.escalation,
+                '--min_registered_ratio', str(args.min_registered_ratio)]
+        if args.vocab_tree_path:
+            cmd += ['--vocab_tree_path', args.vocab_tree_path]
+
+    # records of a previous run are not read back as this run's
+    for name in (STEPS_FILE, MATCHING_FILE):
+        if os.path.exists(os.path.join(scene_output, name)):
+            os.remove(os.path.join(scene_output, name))
+
+    manifest.update(scene, status='running', started=time.time(), threads=args.threads_per_job)
+    start = time.time()
+    # each scene logs to its own file, so concurrent outputs don't interleave
+    with open(os.path.join(scene_output, 'colmap.log'), 'w') as log:
+        exit_code = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT).returncode
+    elapsed = time.time() - start
+
+    steps = load_json(os.path.join(scene_output, STEPS_FILE), [])
+    matching = load_json(os.path.join(scene_output, MATCHING_FILE), None) if args.mode == 'robust' else None
+    ok = exit_code == 0 and is_scene_complete(args.output_path, scene)
+    manifest.update(scene, status='done' if ok else 'failed', exit_code=exit_code,
+                    seconds=round(elapsed, 2), steps=steps, matching=matching, finished=time.time())
+    return scene, ok, elapsed
+
+
+def run(args):
+    scenes = args.scenes or sorted(d for d in os.listdir(args.source_path)
+                                   if d.startswith('scene') and os.path.isdir(os.path.join(args.source_path, d)))
+    os.makedirs(args.output_path, exist_ok=True)
+    manifest = Manifest(os.path.join(args.output_path, MANIFEST_FILE))
+
+    todo = []
+    for scene in scenes:
+        if not args.force and is_scene_complete(args.output_path, scene):
+            if manifest.data['scenes'].get(scene, {}).get('status') != 'done':
+                manifest.update(scene, status='done')
+            continue
+        todo.append(scene)
+    print(f"Found {len(scenes)} scenes, {len(scenes) - len(todo)} already complete, {len(todo)} to process")
+    if not todo:
+        return
+
+    cpu_budget = args.cpu_budget or os.cpu_count()
+    num_jobs = args.jobs or max(1, cpu_budget // args.threads_per_job)
+    print(f"Running {num_jobs} concurrent jobs x {args.threads_per_job} threads (budget {cpu_budget} threads), "
+          f"mode {args.mode}")
+    manifest.update(mode=args.mode, source_path=args.source_path, jobs=num_jobs,
+                    threads_per_job=args.threads_per_job, started=time.time())
+
+    start = time.time()
+    success_count, fail_count, scene_seconds = 0, 0, 0.0
+    with ThreadPoolExecutor(max_workers=num_jobs) as executor:
+        futures = [executor.submit(run_scene, scene, args, manifest) for scene in todo]
+        for i, future in enumerate(as_completed(futures), 1):
+            scene, ok, elapsed = future.result()
+            scene_seconds += elapsed
+            if ok:
+                success_count += 1
+                print(f"[{i}/{len(todo)}] ✓ {scene} completed in {elapsed / 60:.1f} min")
+            else:
+                fail_count += 1
+                print(f"[{i}/{len(todo)}] ✗ {scene} failed after {elapsed / 60:.1f} min "
+                      f"(see {os.path.join(args.output_path, scene, 'colmap.log')})")
+
+    wall = time.time() - start
+    manifest.update(finished=time.time(), wall_seconds=round(wall, 2))
+    print("=" * 64)
+    print(f"  ✅ Successful: {success_count} / {len(todo)}")
+    print(f"  ❌ Failed: {fail_count} / {len(todo)}")
+    print(f"  Wall time {wall / 60:.1f} min for {scene_seconds / 60:.1f} min of scene time "
+          f"({scene_seconds / max(wall, 1e-6):.1f}x)")
+    summary = matching_summary(manifest.data['scenes'])
+    if summary:
+        print(f"  {summary}")
+    print(f"  Manifest: {manifest.path}")
+    print("=" * 64)
+
+
+def status(args):
+    manifest_path = os.path.join(args.output_path, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        print(f"No manifest at {manifest_path}, the batch has not started yet")
+        return
+    with open(manifest_path, 'r') as f:
+        data = json.load(f)
+
+    scenes = data['scenes']
+    counts = {}
+    for entry in scenes.values():
+        counts[entry.get('status', 'unknown')] = counts.get(entry.get('status', 'unknown'), 0) + 1
+    source_path = data.get('source_path', '')
+    total = len([d for d in os.listdir(source_path) if d.startswith('scene')]) if os.path.isdir(source_path) else len(scenes)
+    print(f"Mode {data.get('mode')}, {data.get('jobs')} jobs x {data.get('threads_per_job')} threads")
+    print(f"Scenes: {total} total, " + ", ".join(f"{n} {s}" for s, n in sorted(counts.items())))
+
+    now = time.time()
+    for scene, entry in sorted(scenes.items()):
+        state = entry.get('status')
+        if state == 'running':
+            detail = f"running for {(now - entry['started']) / 60:.1f} min"
+        elif 'seconds' in entry:
+            steps = ', '.join(f"{s['step']} {s['seconds']:.0f}s" + (f" (exit {s['exit_code']})" if s['exit_code'] else '')
+                              for s in entry.get('steps', []))
+            detail = f"{entry['seconds'] / 60:.1f} min, exit {entry.get('exit_code')}" + (f" [{steps}]" if steps else '')
+            matching = entry.get('matching')
+            if matching and matching.get('mode') == 'adaptive':
+                detail += f", {matching.get('registered')}/{matching.get('num_images')} registered"
+                detail += ", escalated" if matching.get('escalated') else ""
+        else:
+            detail = 'found complete on disk'
+        if args.verbose or state != 'done':
+            print(f"  {scene:<16} {state:<8} {detail}")
+    summary = matching_summary(scenes)
+    if summary:
+        print(summary)
+    if 'wall_seconds' in data:
+        print(f"Last run wall time: {data['wall_seconds'] / 60:.1f} min")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser("Parallel COLMAP batch runner")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='process all scenes')
+    run_parser.add_argument("--source_path", "-s", type=str,
+                            default="/home/runw/Project/data/colmap/data/scannet_test_preprocessed")
+    run_parser.add_argument("--output_path", "-o", type=str,
+                            default="/home/runw/Project/LSM/data/scannet_test_colmap")
+    run_parser.add_argument("--mode", choices=sorted(SCRIPTS), default='standard', help="per-scene COLMAP script")
+    run_parser.add_argument("--scenes", nargs='+', default=None, help="scenes to process (default: all)")
+    run_parser.add_argument("--cpu_budget", type=int, default=None, help="total COLMAP threads (default: all cores)")
+    run_parser.add_argument("--threads_per_job", type=int, default=4, help="COLMAP threads of each scene")
+    run_parser.add_argument("--jobs", type=int, default=None, help="concurrent scenes (default: cpu_budget // threads_per_job)")
+    run_parser.add_argument("--colmap_executable", default="colmap", type=str)
+    run_parser.add_argument("--no_gpu", action='store_true', help="Disable GPU")
+    run_parser.add_argument("--force", action='store_true', help="reprocess scenes that already have sparse/0/images.bin")
+    run_parser.add_argument("--matching", choices=["adaptive", "both"], default="adaptive",
+                            help="robust mode: escalate beyond sequential matching only when needed, or always")
+    run_parser.add_argument("--escalation", choices=["exhaustive", "vocab_tree"], default="exhaustive",
+                            help="robust mode: matcher run on top of sequential matching")
+    run_parser.add_argument("--vocab_tree_path", type=str, default=None)
+    run_parser.add_argument("--min_registered_ratio", type=float, default=0.9,
+                            help="robust mode: escalate when fewer than this fraction of the images register")
+
+    status_parser = subparsers.add_parser('status', help='summarize the manifest of a batch')
+    status_parser.add_argument("--output_path", "-o", type=str,
+                               default="/home/runw/Project/LSM/data/scannet_test_colmap")
+    status_parser.add_argument("--verbose", "-v", action='store_true', help="also list completed scenes")
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        status(args)
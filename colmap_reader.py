@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Reader for COLMAP binary models (cameras.bin, images.bin, points3D.bin).
+- Records are parsed into NumPy arrays in bulk, per-point data is never turned into Python objects,
+  fixed-size fields are viewed in place in the file buffer instead of being gathered byte by byte
+- count_* functions only read the 8 byte headers, for scripts that just need registration counts
+- read_extrinsics_binary / read_intrinsics_binary keep the dict of namedtuples interface of colmap_loader
+"""
+
+import os
+import struct
+import collections
+import numpy as np
+
+CameraModel = collections.namedtuple("CameraModel", ["model_id", "model_name", "num_params"])
+Camera = collections.namedtuple("Camera", ["id", "model", "width", "height", "params"])
+Image = collections.namedtuple("Image", ["id", "qvec", "tvec", "camera_id", "name", "xys", "point3D_ids"])
+
+CAMERA_MODELS = {
+    0: CameraModel(0, "SIMPLE_PINHOLE", 3),
+    1: CameraModel(1, "PINHOLE", 4),
+    2: CameraModel(2, "SIMPLE_RADIAL", 4),
+    3: CameraModel(3, "RADIAL", 5),
+    4: CameraModel(4, "OPENCV", 8),
+    5: CameraModel(5, "OPENCV_FISHEYE", 8),
+    6: CameraModel(6, "FULL_OPENCV", 12),
+    7: CameraModel(7, "FOV", 5),
+    8: CameraModel(8, "SIMPLE_RADIAL_FISHEYE", 4),
+    9: CameraModel(9, "RADIAL_FISHEYE", 5),
+    10: CameraModel(10, "THIN_PRISM_FISHEYE", 12),
+}
+
+# fixed-size parts of the records, little endian and packed as written by COLMAP
+IMAGE_HEADER = np.dtype([('image_id', '<i4'), ('qvec', '<f8', 4), ('tvec', '<f8', 3), ('camera_id', '<i4')])
+POINT2D = np.dtype([('xy', '<f8', 2), ('point3D_id', '<i8')])
+POINT3D_HEADER = np.dtype([('point3D_id', '<u8'), ('xyz', '<f8', 3), ('rgb', 'u1', 3), ('error', '<f8'),
+                           ('track_length', '<u8')])
+TRACK_ELEMENT = np.dtype([('image_id', '<i4'), ('point2D_idx', '<i4')])
+
+
+def _read_count(path):
+    with open(path, 'rb') as f:
+        return struct.unpack('<Q', f.read(8))[0]
+
+
+def count_registered_images(images_bin_path):
+    """
+    Number of registered images of a model, from the images.bin header only (0 if the file is missing)
+    """
+    if not os.path.isfile(images_bin_path):
+        return 0
+    return _read_count(images_bin_path)
+
+
+def count_points3D(points3D_bin_path):
+    """
+    Number of 3D points of a model, from the points3D.bin header only (0 if the file is missing)
+    """
+    if not os.path.isfile(points3D_bin_path):
+        return 0
+    return _read_count(points3D_bin_path)
+
+
+def read_model_counts(model_dir):
+    """
+    Header-only summary of a model directory (e.g. scene/sparse/0)
+    Returns:
+        dict: num_cameras, num_images, num_points3D, all 0 when the files are missing
+    """
+    cameras_path = os.path.join(model_dir, 'cameras.bin')
+    return {
+        'num_cameras': _read_count(cameras_path) if os.path.isfile(cameras_path) else 0,
+        'num_images': count_registered_images(os.path.join(model_dir, 'images.bin')),
+        'num_points3D': count_points3D(os.path.join(model_dir, 'points3D.bin')),
+    }
+
+
+def read_cameras_binary(path):
+    """
+    Returns:
+        dict: camera_id -> Camera
+    """
+    buf = np.fromfile(path, dtype=np.uint8)
+    num_cameras = int(buf[:8].view('<u8')[0])
+    cameras = {}
+    offset = 8
+    for _ in range(num_cameras):
+        camera_id, model_id = buf[offset:offset + 8].view('<i4')
+        width, height = buf[offset + 8:offset + 24].view('<u8')
+        model = CAMERA_MODELS[int(model_id)]
+        offset += 24
+        params = buf[offset:offset + 8 * model.num_params].view('<f8').copy()
+        offset += 8 * model.num_params
+        cameras[int(camera_id)] = Camera(id=int(camera_id), model=model.model_name,
+                                         width=int(width), height=int(height), params=params)
+    return cameras
+
+
+def _read_file(path):
+    # a single copy of the file, numpy arrays are views into it
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def read_images_arrays(path, with_points2D=True):
+    """
+    Parse images.bin into arrays
+    Args:
+        with_points2D: also gather the 2D observations, skip them when only poses are needed
+    Returns:
+        dict: image_ids (N,), qvecs (N, 4), tvecs (N, 3), camera_ids (N,), names (list of N str),
+              and with_points2D: point2D_offsets (N+1,), xys (M, 2), point3D_ids (M,), the observations of
+              image i being xys[point2D_offsets[i]:point2D_offsets[i+1]]
+    """
+    data = _read_file(path)
+    num_images = struct.unpack_from('<Q', data, 0)[0]
+
+    # records have a variable length (name, observations): one pass over the images, the fixed-size
+    # header and the contiguous observation block of every image are viewed in place
+    headers = []
+    names = []
+    points = []
+    num_points2D = np.empty(num_images, dtype=np.int64)
+    offset = 8
+    for i in range(num_images):
+        headers.append(np.frombuffer(data, IMAGE_HEADER, count=1, offset=offset))
+        name_end = data.index(b'\x00', offset + IMAGE_HEADER.itemsize)
+        names.append(data[offset + IMAGE_HEADER.itemsize:name_end].decode('utf-8'))
+        num_points2D[i] = struct.unpack_from('<Q', data, name_end + 1)[0]
+        offset = name_end + 9
+        if with_points2D:
+            points.append(np.frombuffer(data, POINT2D, count=num_points2D[i], offset=offset))
+        offset += num_points2D[i] * POINT2D.itemsize
+
+    headers = np.concatenate(headers) if headers else np.empty(0, dtype=IMAGE_HEADER)
+    result = {
+        'image_ids': headers['image_id'].copy(),
+        'qvecs': headers['qvec'].copy(),
+        'tvecs': headers['tvec'].copy(),
+        'camera_ids': headers['camera_id'].copy(),
+        'names': names,
+    }
+    if with_points2D:
+        point2D_offsets = np.concatenate([[0], np.cumsum(num_points2D)])
+        # fill the outputs block by block, without an intermediate concatenated copy
+        xys = np.empty((point2D_offsets[-1], 2), dtype=np.float64)
+        point3D_ids = np.empty(point2D_offsets[-1], dtype=np.int64)
+        for i, block in enumerate(points):
+            xys[point2D_offsets[i]:point2D_offsets[i + 1]] = block['xy']
+            point3D_ids[point2D_offsets[i]:point2D_offsets[i + 1]] = block['point3D_id']
+        result.update(point2D_offsets=point2D_offsets, xys=xys, point3D_ids=point3D_ids)
+    return result
+
+
+def read_points3D_arrays(path):
+    """
+    Parse points3D.bin into arrays
+    Returns:
+        dict: point3D_ids (P,), xyz (P, 3), rgb (P, 3) uint8, errors (P,), and the tracks concatenated over points:
+              track_offsets (P+1,), track_image_ids (T,), track_point2D_idxs (T,)
+    """
+    data = _read_file(path)
+    num_points = struct.unpack_from('<Q', data, 0)[0]
+
+    # the track length is the only variable field and gives the start of the next record, so it has to be
+    # walked record by record; everything else is located from the cumulative lengths
+    track_length_pos = POINT3D_HEADER.fields['track_length'][1]
+    unpack_from = struct.Struct('<Q').unpack_from
+    track_lengths = []
+    offset = 8 + track_length_pos
+    for _ in range(num_points):
+        track_length = unpack_from(data, offset)[0]
+        track_lengths.append(track_length)
+        offset += POINT3D_HEADER.itemsize + track_length * TRACK_ELEMENT.itemsize
+    track_lengths = np.array(track_lengths, dtype=np.int64)
+
+    # records alternate header / track bytes: a byte mask splits them with one copy each, without a per-byte index
+    body = np.frombuffer(data, np.uint8, offset=8)
+    sizes = np.empty(2 * num_points, dtype=np.int64)
+    sizes[0::2] = POINT3D_HEADER.itemsize
+    sizes[1::2] = track_lengths * TRACK_ELEMENT.itemsize
+    is_header = np.repeat(np.tile(np.array([True, False]), num_points), sizes)
+    headers = body[:len(is_header)][is_header].view(POINT3D_HEADER)
+    np.logical_not(is_header, out=is_header)
+    tracks = body[:len(is_header)][is_header].view(TRACK_ELEMENT)
+    del is_header
+    return {
+        'point3D_ids': headers['point3D_id'].copy(),
+        'xyz': headers['xyz'].copy(),
+        'rgb': headers['rgb'].copy(),
+        'errors': headers['error'].copy(),
+        'track_offsets': np.concatenate([[0], np.cumsum(track_lengths)]),
+        'track_image_ids': tracks['image_id'].copy(),
+        'track_point2D_idxs': tracks['point2D_idx'].copy(),
+    }
+
+
+def read_extrinsics_binary(path):
+    """
+    Drop-in replacement of colmap_loader.read_extrinsics_binary
+    Returns:
+        dict: image_id -> Image
+    """
+    arrays = read_images_arrays(path)
+    offsets = arrays['point2D_offsets']
+    return {
+        int(image_id): Image(id=int(image_id), qvec=arrays['qvecs'][i], tvec=arrays['tvecs'][i],
+                             camera_id=int(arrays['camera_ids'][i]), name=arrays['names'][i],
+                             xys=arrays['xys'][offsets[i]:offsets[i + 1]],
+                             point3D_ids=arrays['point3D_ids'][offsets[i]:offsets[i + 1]])
+        for i, image_id in enumerate(arrays['image_ids'])
+    }
+
+
+def read_intrinsics_binary(path):
+    """
+    Drop-in replacement of colmap_loader.read_intrinsics_binary
+    """
+    return read_cameras_binary(path)
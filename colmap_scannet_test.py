@@ -11,6 +11,8 @@ import logging
 from argparse import ArgumentParser
 import shutil
 
+from colmap_batch import StepLog
+
 # Set environment for headless COLMAP (no GUI)
 os.environ['QT_QPA_PLATFORM'] = 'offscreen'
 
@@ -26,6 +28,7 @@ parser.add_argument("--output_path", "-o", type=str,
 parser.add_argument("--camera", default="SIMPLE_RADIAL", type=str,
                     help="Camera model (SIMPLE_RADIAL for preprocessed images)")
 parser.add_argument("--colmap_executable", default="colmap", type=str)
+parser.add_argument("--num_threads", default=-1, type=int, help="COLMAP threads per step (-1: all cores)")
 args = parser.parse_args()
 
 colmap_command = '"{}"'.format(args.colmap_executable) if len(args.colmap_executable) > 0 else "colmap"
@@ -44,6 +47,8 @@ if not os.path.isdir(scene_input):
 os.makedirs(scene_output, exist_ok=True)
 os.makedirs(os.path.join(scene_output, "sparse"), exist_ok=True)
 
+run_step = StepLog(scene_output).run
+
 print(f"Processing scene: {args.scene}")
 print(f"Input images: {scene_input}")
 print(f"Output path: {scene_output}")
@@ -57,9 +62,10 @@ feat_extraction_cmd = colmap_command + f''' feature_extractor \
     --image_path {scene_input} \
     --ImageReader.single_camera 1 \
     --ImageReader.camera_model {args.camera} \
-    --SiftExtraction.use_gpu {use_gpu}'''
+    --SiftExtraction.use_gpu {use_gpu} \
+    --SiftExtraction.num_threads {args.num_threads}'''
 
-exit_code = os.system(feat_extraction_cmd)
+exit_code = run_step("feature_extractor", feat_extraction_cmd)
 if exit_code != 0:
     logging.error(f"Feature extraction failed with code {exit_code}. Exiting.")
     exit(exit_code)
@@ -68,9 +74,10 @@ if exit_code != 0:
 print("Step 2/3: Feature matching...")
 feat_matching_cmd = colmap_command + f''' exhaustive_matcher \
     --database_path {scene_output}/database.db \
-    --SiftMatching.use_gpu {use_gpu}'''
+    --SiftMatching.use_gpu {use_gpu} \
+    --SiftMatching.num_threads {args.num_threads}'''
 
-exit_code = os.system(feat_matching_cmd)
+exit_code = run_step("exhaustive_matcher", feat_matching_cmd)
 if exit_code != 0:
     logging.error(f"Feature matching failed with code {exit_code}. Exiting.")
     exit(exit_code)
@@ -81,9 +88,10 @@ mapper_cmd = colmap_command + f''' mapper \
     --database_path {scene_output}/database.db \
     --image_path {scene_input} \
     --output_path {scene_output}/sparse \
+    --Mapper.num_threads {args.num_threads} \
     --Mapper.ba_global_function_tolerance=0.000001'''
 
-exit_code = os.system(mapper_cmd)
+exit_code = run_step("mapper", mapper_cmd)
 if exit_code != 0:
     logging.error(f"Mapper failed with code {exit_code}. Exiting.")
     exit(exit_code)
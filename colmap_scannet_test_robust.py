@@ -2,15 +2,20 @@
 """
 Modified COLMAP script for ScanNet test dataset with ROBUST settings.
 - More lenient matching thresholds
-- Sequential matcher instead of exhaustive
+- Sequential matcher, escalating to exhaustive/vocab tree matching only when too few images register (adaptive)
 - Lower BA tolerance
 """
 
 import os
 import logging
+import math
+import json
 from argparse import ArgumentParser
 import shutil
 
+from colmap_reader import count_registered_images
+from colmap_batch import StepLog
+
 os.environ['QT_QPA_PLATFORM'] = 'offscreen'
 
 parser = ArgumentParser("COLMAP for ScanNet preprocessed images")
@@ -22,7 +27,18 @@ parser.add_argument("--output_path", "-o", type=str,
                     default="/home/runw/Project/LSM/data/scannet_test_colmap_robust")
 parser.add_argument("--camera", default="SIMPLE_RADIAL", type=str)
 parser.add_argument("--colmap_executable", default="colmap", type=str)
+parser.add_argument("--num_threads", default=-1, type=int, help="COLMAP threads per step (-1: all cores)")
+parser.add_argument("--matching", choices=["adaptive", "both"], default="adaptive",
+                    help="adaptive: escalate beyond sequential matching only when too few images register, "
+                         "both: always run sequential and escalation matching before mapping")
+parser.add_argument("--escalation", choices=["exhaustive", "vocab_tree"], default="exhaustive",
+                    help="matcher run on top of sequential matching")
+parser.add_argument("--vocab_tree_path", type=str, default=None, help="vocabulary tree for --escalation vocab_tree")
+parser.add_argument("--min_registered_ratio", default=0.9, type=float,
+                    help="adaptive mode escalates when fewer than this fraction of the images register")
 args = parser.parse_args()
+if args.escalation == 'vocab_tree' and args.vocab_tree_path is None:
+    parser.error("--escalation vocab_tree requires --vocab_tree_path")
 
 colmap_command = '"{}"'.format(args.colmap_executable) if len(args.colmap_executable) > 0 else "colmap"
 use_gpu = 1 if not args.no_gpu else 0
@@ -37,6 +53,8 @@ if not os.path.isdir(scene_input):
 os.makedirs(scene_output, exist_ok=True)
 os.makedirs(os.path.join(scene_output, "sparse"), exist_ok=True)
 
+run_step = StepLog(scene_output).run
+
 print(f"Processing scene: {args.scene} (ROBUST MODE)")
 print(f"Input images: {scene_input}")
 print(f"Output path: {scene_output}")
@@ -50,10 +68,11 @@ feat_extraction_cmd = colmap_command + f''' feature_extractor \
     --ImageReader.single_camera 1 \
     --ImageReader.camera_model {args.camera} \
     --SiftExtraction.use_gpu {use_gpu} \
+    --SiftExtraction.num_threads {args.num_threads} \
     --SiftExtraction.max_num_features 16384 \
     --SiftExtraction.first_octave -1'''
 
-exit_code = os.system(feat_extraction_cmd)
+exit_code = run_step("feature_extractor", feat_extraction_cmd)
 if exit_code != 0:
     logging.error(f"Feature extraction failed. Exiting.")
     exit(exit_code)
@@ -63,64 +82,115 @@ print("Step 2/4: Sequential matching...")
 seq_matching_cmd = colmap_command + f''' sequential_matcher \
     --database_path {scene_output}/database.db \
     --SiftMatching.use_gpu {use_gpu} \
+    --SiftMatching.num_threads {args.num_threads} \
     --SequentialMatching.overlap 15 \
     --SequentialMatching.loop_detection 0'''
 
-exit_code = os.system(seq_matching_cmd)
+exit_code = run_step("sequential_matcher", seq_matching_cmd)
 if exit_code != 0:
-    logging.warning(f"Sequential matching failed with code {exit_code}. Trying exhaustive...")
+    logging.warning(f"Sequential matching failed with code {exit_code}. Trying {args.escalation}...")
 
-## Also try exhaustive for safety (or as fallback)
-print("Step 3/4: Exhaustive matching...")
-exh_matching_cmd = colmap_command + f''' exhaustive_matcher \
+if args.escalation == 'vocab_tree':
+    escalation_cmd = colmap_command + f''' vocab_tree_matcher \
+    --database_path {scene_output}/database.db \
+    --SiftMatching.use_gpu {use_gpu} \
+    --SiftMatching.num_threads {args.num_threads} \
+    --VocabTreeMatching.vocab_tree_path {args.vocab_tree_path}'''
+else:
+    escalation_cmd = colmap_command + f''' exhaustive_matcher \
     --database_path {scene_output}/database.db \
-    --SiftMatching.use_gpu {use_gpu}'''
+    --SiftMatching.use_gpu {use_gpu} \
+    --SiftMatching.num_threads {args.num_threads}'''
+
+
+def organize_sparse(sparse_dir):
+    # Mapper created files directly in sparse/, move to sparse/0
+    files = os.listdir(sparse_dir) if os.path.exists(sparse_dir) else []
+    if '0' not in files and len(files) > 0:
+        os.makedirs(os.path.join(sparse_dir, "0"), exist_ok=True)
+        for file in files:
+            if file == '0':
+                continue
+            source_file = os.path.join(sparse_dir, file)
+            destination_file = os.path.join(sparse_dir, "0", file)
+            if os.path.isfile(source_file):
+                shutil.move(source_file, destination_file)
 
-exit_code_exh = os.system(exh_matching_cmd)
-if exit_code_exh != 0 and exit_code != 0:
-    logging.error(f"Both sequential and exhaustive matching failed. Cannot proceed.")
-    exit(1)
 
 ## Mapping with lenient parameters
-print("Step 4/4: Sparse reconstruction (lenient mode)...")
-mapper_cmd = colmap_command + f''' mapper \
+def run_mapper(sparse_dir, step_name):
+    os.makedirs(sparse_dir, exist_ok=True)
+    mapper_cmd = colmap_command + f''' mapper \
     --database_path {scene_output}/database.db \
     --image_path {scene_input} \
-    --output_path {scene_output}/sparse \
+    --output_path {sparse_dir} \
+    --Mapper.num_threads {args.num_threads} \
     --Mapper.ba_global_function_tolerance=0.00001 \
     --Mapper.min_num_matches=10 \
     --Mapper.init_min_num_inliers=50 \
     --Mapper.abs_pose_min_num_inliers=10'''
 
-exit_code = os.system(mapper_cmd)
-if exit_code != 0:
-    logging.warning(f"Mapper returned non-zero exit code {exit_code}")
+    exit_code = run_step(step_name, mapper_cmd)
+    if exit_code != 0:
+        logging.warning(f"Mapper returned non-zero exit code {exit_code}")
+    organize_sparse(sparse_dir)
+    return count_registered_images(os.path.join(sparse_dir, "0", "images.bin"))
 
-# Organize output
-sparse_dir = os.path.join(scene_output, "sparse")
-files = os.listdir(sparse_dir) if os.path.exists(sparse_dir) else []
 
-if '0' not in files and len(files) > 0:
-    # Mapper created files directly in sparse/, move to sparse/0
-    os.makedirs(os.path.join(sparse_dir, "0"), exist_ok=True)
-    for file in files:
-        if file == '0':
-            continue
-        source_file = os.path.join(sparse_dir, file)
-        destination_file = os.path.join(sparse_dir, "0", file)
-        if os.path.isfile(source_file):
-            shutil.move(source_file, destination_file)
+sparse_dir = os.path.join(scene_output, "sparse")
+num_images = len([f for f in os.listdir(scene_input) if not f.startswith('.')])
+matching = {'mode': args.matching, 'escalation': args.escalation, 'num_images': num_images}
+
+if args.matching == 'both':
+    ## Also try exhaustive for safety (or as fallback)
+    print(f"Step 3/4: {args.escalation} matching...")
+    exit_code_exh = run_step(f"{args.escalation}_matcher", escalation_cmd)
+    if exit_code_exh != 0 and exit_code != 0:
+        logging.error(f"Both sequential and {args.escalation} matching failed. Cannot proceed.")
+        exit(1)
+
+    print("Step 4/4: Sparse reconstruction (lenient mode)...")
+    matching['registered'] = run_mapper(sparse_dir, "mapper")
+    matching['escalated'] = True
+else:
+    # Adaptive: map the sequential matches first, only pay for the expensive matcher when too few images register
+    print("Step 3/4: Sparse reconstruction from sequential matches (lenient mode)...")
+    registered = run_mapper(sparse_dir, "mapper") if exit_code == 0 else 0
+    threshold = math.ceil(args.min_registered_ratio * num_images)
+    matching.update(registered_sequential=registered, threshold=threshold)
+
+    if registered >= threshold:
+        print(f"Registered {registered}/{num_images} images with sequential matching "
+              f"(threshold {threshold}), skipping {args.escalation} matching")
+        matching['escalated'] = False
+    else:
+        print(f"Step 4/4: Registered only {registered}/{num_images} images (threshold {threshold}), "
+              f"escalating to {args.escalation} matching...")
+        matching['escalated'] = True
+        exit_code_exh = run_step(f"{args.escalation}_matcher", escalation_cmd)
+        if exit_code_exh != 0 and exit_code != 0:
+            logging.error(f"Both sequential and {args.escalation} matching failed. Cannot proceed.")
+            exit(1)
+
+        # map again from the augmented database, keep whichever model registers more images
+        escalated_dir = os.path.join(scene_output, "sparse_escalated")
+        shutil.rmtree(escalated_dir, ignore_errors=True)
+        registered_escalated = run_mapper(escalated_dir, "mapper_escalated")
+        matching['registered_escalated'] = registered_escalated
+        if registered_escalated > registered:
+            shutil.rmtree(os.path.join(sparse_dir, "0"), ignore_errors=True)
+            shutil.move(os.path.join(escalated_dir, "0"), os.path.join(sparse_dir, "0"))
+        shutil.rmtree(escalated_dir, ignore_errors=True)
+    matching['registered'] = max(registered, matching.get('registered_escalated', 0))
+
+with open(os.path.join(scene_output, "colmap_matching.json"), 'w') as f:
+    json.dump(matching, f, indent=2)
 
 # Check if reconstruction succeeded
 images_bin_path = os.path.join(sparse_dir, "0", "images.bin")
 if os.path.exists(images_bin_path):
     # Count registered images
-    import sys
-    sys.path.append('/home/runw/Project/feature-3dgs/scene')
-    from colmap_loader import read_extrinsics_binary
-    
-    extrinsics = read_extrinsics_binary(images_bin_path)
-    num_registered = len(extrinsics)
+    num_registered = count_registered_images(images_bin_path)
     
     print()
     print("=" * 60)
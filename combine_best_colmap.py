@@ -1,16 +1,117 @@
 #!/usr/bin/env python3
-"""Combine best COLMAP results from original and robust runs"""
+"""
+Combine best COLMAP results from original and robust runs
+- copy mode (default) copies the whole winning scene directory as before,
+  hardlink / symlink modes only expose the winning sparse/0 model and images/
+- Every scene is built under a temporary name and swapped into place, reruns skip scenes that are up to date
+- combine_manifest.json records which run won each scene
+"""
 
 import os
-import sys
+import json
+import time
 import shutil
-sys.path.insert(0, '/home/runw/Project/feature-3dgs/scene')
-from colmap_loader import read_extrinsics_binary
+from argparse import ArgumentParser
+from colmap_reader import count_registered_images
+
+MANIFEST_FILE = 'combine_manifest.json'
+
+parser = ArgumentParser("Combine best COLMAP results")
+parser.add_argument("--original_dir", type=str, default='/home/runw/Project/data/colmap/data/scannet_test_feature3dgs')
+parser.add_argument("--robust_dir", type=str, default='/home/runw/Project/LSM/data/scannet_test_colmap_robust')
+parser.add_argument("--best_dir", type=str, default='/home/runw/Project/data/colmap/data/scannet_test_feature3dgs_BEST_COMBINED')
+parser.add_argument("--mode", choices=["copy", "hardlink", "symlink"], default="copy",
+                    help="copy: copy the whole scene directory including database.db, "
+                         "hardlink/symlink: link sparse/0 and images/ only (hardlinks fall back to symlinks across filesystems)")
+parser.add_argument("--no_link_images", dest="link_images", action='store_false',
+                    help="link modes: only link sparse/0, without the images of the winning run")
+parser.add_argument("--images_root", type=str, default=None,
+                    help="fallback image source <images_root>/<scene>/color when the winning run has no images/")
+parser.add_argument("--good_scenes_file", type=str, default='/home/runw/Project/feature-3dgs/good_scenes_combined.txt')
+args = parser.parse_args()
+
+original_dir = args.original_dir
+robust_dir = args.robust_dir
+best_dir = args.best_dir
+
+
+def link_file(src, dst, mode):
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass  # e.g. across filesystems
+    os.symlink(os.path.abspath(src), dst)
+
+
+def link_tree(src, dst, mode):
+    """Mirror a directory with hardlinks (files) or a single directory symlink"""
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+        return
+    os.makedirs(dst)
+    for name in sorted(os.listdir(src)):
+        src_path = os.path.join(src, name)
+        if os.path.isdir(src_path):
+            link_tree(src_path, os.path.join(dst, name), mode)
+        else:
+            link_file(src_path, os.path.join(dst, name), mode)
+
+
+def images_source(src_scene_dir, scene):
+    if os.path.isdir(os.path.join(src_scene_dir, 'images')):
+        return os.path.join(src_scene_dir, 'images')
+    if args.images_root and os.path.isdir(os.path.join(args.images_root, scene, 'color')):
+        return os.path.join(args.images_root, scene, 'color')
+    return None
+
+
+def is_up_to_date(entry, dst_scene_dir, src_scene_dir):
+    # same choice and settings as the manifest, and the linked model still points at the source files
+    if entry is None or entry.get('source') != src_scene_dir or entry.get('mode') != args.mode \
+            or entry.get('link_images') != args.link_images:
+        return False
+    src_model = os.path.join(src_scene_dir, 'sparse', '0', 'images.bin')
+    dst_model = os.path.join(dst_scene_dir, 'sparse', '0', 'images.bin')
+    if not os.path.isfile(dst_model) or not os.path.isfile(src_model):
+        return False
+    if args.mode == 'copy':
+        return os.path.getmtime(dst_model) >= os.path.getmtime(src_model)
+    return os.path.samefile(src_model, dst_model)
+
+
+def remove_scene(dst_scene_dir, scene):
+    """Remove a combined scene (directory or symlink), renamed away first so it never appears half deleted"""
+    if not os.path.lexists(dst_scene_dir):
+        return
+    old_dir = os.path.join(best_dir, f'.{scene}.old{os.getpid()}')
+    os.rename(dst_scene_dir, old_dir)
+    if os.path.islink(old_dir):
+        os.unlink(old_dir)
+    else:
+        shutil.rmtree(old_dir)
+
+
+def build_scene(src_scene_dir, dst_scene_dir, scene):
+    """Build the combined scene next to its final location, then swap it in"""
+    tmp_dir = os.path.join(best_dir, f'.{scene}.tmp{os.getpid()}')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    if args.mode == 'copy':
+        shutil.copytree(src_scene_dir, tmp_dir)
+    else:
+        os.makedirs(os.path.join(tmp_dir, 'sparse'))
+        link_tree(os.path.join(src_scene_dir, 'sparse', '0'), os.path.join(tmp_dir, 'sparse', '0'), args.mode)
+        if args.link_images:
+            image_dir = images_source(src_scene_dir, scene)
+            if image_dir is None:
+                print(f"  ⚠️  no images found for {scene}, linking sparse/0 only")
+            else:
+                link_tree(image_dir, os.path.join(tmp_dir, 'images'), args.mode)
+
+    remove_scene(dst_scene_dir, scene)
+    os.rename(tmp_dir, dst_scene_dir)
 
-# Paths
-original_dir = '/home/runw/Project/data/colmap/data/scannet_test_feature3dgs'
-robust_dir = '/home/runw/Project/LSM/data/scannet_test_colmap_robust'
-best_dir = '/home/runw/Project/data/colmap/data/scannet_test_feature3dgs_BEST_COMBINED'
 
 print("=" * 80)
 print("Combining BEST COLMAP Results (Original + Robust)")
@@ -18,31 +119,36 @@ print("=" * 80)
 
 # Get all scenes
 scenes = sorted([d for d in os.listdir(robust_dir) if d.startswith('scene')])
-print(f"\nProcessing {len(scenes)} scenes...\n")
+print(f"\nProcessing {len(scenes)} scenes (mode {args.mode})...\n")
 
 os.makedirs(best_dir, exist_ok=True)
+manifest_path = os.path.join(best_dir, MANIFEST_FILE)
+manifest = {'scenes': {}}
+if os.path.isfile(manifest_path):
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
 
 good_scenes = []
 used_original = 0
 used_robust = 0
+unchanged = 0
+start = time.time()
 
 for scene in scenes:
     orig_path = f'{original_dir}/{scene}/sparse/0/images.bin'
     robust_path = f'{robust_dir}/{scene}/sparse/0/images.bin'
-    
+
     orig_count = 0
     robust_count = 0
-    
+
     # Count frames in original
     if os.path.exists(orig_path):
-        orig_extr = read_extrinsics_binary(orig_path)
-        orig_count = len(orig_extr)
-    
+        orig_count = count_registered_images(orig_path)
+
     # Count frames in robust
     if os.path.exists(robust_path):
-        robust_extr = read_extrinsics_binary(robust_path)
-        robust_count = len(robust_extr)
-    
+        robust_count = count_registered_images(robust_path)
+
     # Choose the better one
     if orig_count >= robust_count:
         source = original_dir
@@ -54,7 +160,7 @@ for scene in scenes:
         count = robust_count
         choice = "ROBUST"
         used_robust += 1
-    
+
     # Determine quality
     if count >= 25:
         status = "✅ GOOD"
@@ -63,32 +169,54 @@ for scene in scenes:
         status = "⚠️  OK"
     else:
         status = "❌ BAD"
-    
+
     print(f"{scene}: {count} frames ({choice:6s}) {status}")
-    
-    # Copy the better result
+
+    # Link or copy the better result
     src_scene_dir = f'{source}/{scene}'
     dst_scene_dir = f'{best_dir}/{scene}'
-    
-    if os.path.exists(src_scene_dir):
-        if os.path.exists(dst_scene_dir):
-            shutil.rmtree(dst_scene_dir)
-        shutil.copytree(src_scene_dir, dst_scene_dir)
+
+    if os.path.isfile(f'{src_scene_dir}/sparse/0/images.bin'):
+        if is_up_to_date(manifest['scenes'].get(scene), dst_scene_dir, src_scene_dir):
+            unchanged += 1
+        else:
+            build_scene(src_scene_dir, dst_scene_dir, scene)
+        manifest['scenes'][scene] = {'choice': choice, 'source': src_scene_dir, 'registered': count,
+                                     'original_registered': orig_count, 'robust_registered': robust_count,
+                                     'mode': args.mode, 'link_images': args.link_images}
+    elif os.path.exists(src_scene_dir) and args.mode == 'copy':
+        # no model at all, keep the previous behaviour of copying the scene for inspection
+        build_scene(src_scene_dir, dst_scene_dir, scene)
+        manifest['scenes'].pop(scene, None)
+    else:
+        # nothing to link: drop what an earlier run left for this scene so reruns stay idempotent
+        if os.path.lexists(dst_scene_dir):
+            print(f"  removing stale {dst_scene_dir}")
+        remove_scene(dst_scene_dir, scene)
+        manifest['scenes'].pop(scene, None)
+
+# manifest last, through a temporary file
+tmp_path = f'{manifest_path}.tmp{os.getpid()}'
+with open(tmp_path, 'w') as f:
+    json.dump(manifest, f, indent=2)
+os.replace(tmp_path, manifest_path)
 
 print()
 print("=" * 80)
 print(f"\n📊 Summary:")
 print(f"  Used original: {used_original}")
 print(f"  Used robust: {used_robust}")
+print(f"  Unchanged since last run: {unchanged}")
 print(f"  ✅ Good scenes (25+ frames): {len(good_scenes)}")
+print(f"  Took {time.time() - start:.1f}s")
 
 # Save good scenes list
-good_scenes_file = '/home/runw/Project/feature-3dgs/good_scenes_combined.txt'
+good_scenes_file = args.good_scenes_file
 with open(good_scenes_file, 'w') as f:
     for scene in sorted(good_scenes):
         f.write(f"{scene}\n")
 
 print(f"\n💾 Results saved to: {best_dir}")
+print(f"💾 Manifest: {manifest_path}")
 print(f"💾 Good scenes list: {good_scenes_file}")
 print(f"\nTotal good scenes: {len(good_scenes)}")
-
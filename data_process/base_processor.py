@@ -5,14 +5,71 @@ import numpy as np
 import os
 import json
 from torchvision.utils import save_image
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import tqdm
 import multiprocessing as mp
 import random
 import cv2
+import time
+from data_process.frame_writer import FrameWriter, save_npz_atomic
+
+POSES_FILE = 'poses.npz'  # consolidated camera poses of a processed scene
+DEFAULT_WRITER_THREADS = 8  # background encoding threads of a GPU worker
+
+def _init_cpu_worker(num_threads: int):
+    # pin intra-op threads so that pool workers don't oversubscribe the cores
+    torch.set_num_threads(num_threads)
+    cv2.setNumThreads(num_threads)
+
+def compute_resize_params(original_h: int, original_w: int, target_height: int, target_width: int) -> dict:
+    """
+    Scale so that the target size is covered, then center crop
+    Args:
+        original_h, original_w: size of the input frames
+        target_height, target_width: size of the output frames
+    Returns:
+        dict: ratio, resized size new_h/new_w and crop offsets start_x/start_y
+    """
+    h_ratio = target_height / original_h
+    w_ratio = target_width / original_w
+    ratio = max(h_ratio, w_ratio)
+    # float rounding can leave the scaled side one pixel short of the target
+    new_h, new_w = max(int(original_h * ratio), target_height), max(int(original_w * ratio), target_width)
+    return {
+        'ratio': ratio,
+        'new_h': new_h,
+        'new_w': new_w,
+        'start_x': (new_w - target_width) // 2,
+        'start_y': (new_h - target_height) // 2,
+    }
+
+def resize_and_crop_frames(color_data: torch.Tensor, depth_data: torch.Tensor, resize_params: dict,
+                           target_height: int, target_width: int):
+    """
+    Resize and center crop a batch of frames, shared by the scene processors and the test preprocessing
+    Args:
+        color_data: (n, h, w, 3) float tensor
+        depth_data: (n, h, w) float tensor
+        resize_params: output of compute_resize_params
+    Returns:
+        color_data (n, 3, target_height, target_width), depth_data (n, 1, target_height, target_width)
+    """
+    new_h, new_w = resize_params['new_h'], resize_params['new_w']
+    start_x, start_y = resize_params['start_x'], resize_params['start_y']
+
+    # Resize images
+    depth_data = torch.nn.functional.interpolate(depth_data.unsqueeze(1), size=(new_h, new_w), mode='nearest')
+    color_data = torch.nn.functional.interpolate(color_data.permute(0, 3, 1, 2), size=(new_h, new_w), mode='bilinear')
+
+    # Crop images
+    depth_data = depth_data[:, :, start_y:start_y + target_height, start_x:start_x + target_width]
+    color_data = color_data[:, :, start_y:start_y + target_height, start_x:start_x + target_width]
+    return color_data, depth_data
 
 class BaseSceneProcessorConfig:
-    def __init__(self, root_dir: str, save_dir: str, device: torch.device, num_workers: int = 16):
+    def __init__(self, root_dir: str, save_dir: str, device: torch.device, num_workers: int = 16, chunk_size: int = 64,
+                 writer_threads: int = None, color_png_compression: int = None, depth_png_compression: int = None,
+                 per_frame_poses: bool = True, cpu_threads_per_worker: int = 1):
         self.root_dir = root_dir
         self.save_dir = save_dir
         self.device = device
@@ -20,6 +77,17 @@ class BaseSceneProcessorConfig:
         self.target_height = 480
         self.target_width = 640
         self.num_workers = num_workers
+        # frames loaded, resized and written at once, bounds the memory of a worker independently of the scene length
+        self.chunk_size = chunk_size
+        # background PNG encoding threads per worker, None: DEFAULT_WRITER_THREADS on GPU and cores // workers in the CPU pool
+        self.writer_threads = writer_threads
+        # PNG compression levels, None keeps the OpenCV default (0-9)
+        self.color_png_compression = color_png_compression
+        self.depth_png_compression = depth_png_compression
+        # poses are always consolidated in poses.npz, per-frame pose/*.npz files are optional
+        self.per_frame_poses = per_frame_poses
+        # CPU backend: torch intra-op threads of every worker process, the pool is sized to the available cores
+        self.cpu_threads_per_worker = cpu_threads_per_worker
 
         # create dirs
         os.makedirs(self.save_dir, exist_ok=True)
@@ -59,71 +127,109 @@ class BaseSceneProcessor:
             scene_path: str, path to the scene
         Returns:
             scene_data: dict, including processed frames, instance_id_to_class_map
+        Note:
+            holds every frame of the scene in memory, process_single_scene streams chunks instead
         """
-        # 1. Get frame paths and instance mapping
-        frame_paths = self.get_all_frame_paths(scene_path)
-        intrinsics = self.get_intrinsics(scene_path)
-        
-        # 2. Load all frames
-        frames_data = {}
-        for frame_idx, frame_path in frame_paths.items():
-            frames_data[frame_idx] = self.load_single_frame(frame_path)
-
-        # 3. Stack and process frames
-        depth_data = torch.stack([frame_data['depth_data'] for frame_data in frames_data.values()], axis=0)
-        color_data = torch.stack([frame_data['color_data'] for frame_data in frames_data.values()], axis=0)
-        pose_data = torch.stack([frame_data['pose_data'] for frame_data in frames_data.values()], axis=0)
-
-        # Filter out invalid frames
-        valid_mask = self._get_valid_frame_mask(scene_path, depth_data, color_data, pose_data)
-        if not valid_mask.any():
-            print(f"No valid frames found in scene {scene_path}")
+        chunks = list(self.iter_scene_chunks(scene_path))
+        if not chunks:
             return None
+        return {
+            "frames": {
+                key: torch.cat([chunk[key] for chunk in chunks], dim=0)
+                for key in ('color_data', 'depth_data', 'pose_data')
+            },
+            "intrinsics": chunks[0]['intrinsics'],
+            "frame_num": sum(len(chunk['pose_data']) for chunk in chunks),
+            "scene_name": chunks[0]['scene_name']
+        }
 
-        depth_data = depth_data[valid_mask]
-        color_data = color_data[valid_mask]
-        pose_data = pose_data[valid_mask]
+    def iter_scene_chunks(self, scene_path: str):
+        """
+        Load and process a scene in chunks of config.chunk_size frames
+        Args:
+            scene_path: str, path to the scene
+        Yields:
+            dict: color_data (n, 3, h, w), depth_data (n, 1, h, w), pose_data (n, 4, 4) of the valid frames
+                  of the chunk, the adjusted intrinsics and the scene name
+        """
+        # 1. Get frame paths and intrinsics
+        frame_paths = list(self.get_all_frame_paths(scene_path).values())
+        intrinsics = self.get_intrinsics(scene_path)
+        scene_name = scene_path.split('/')[-1]
 
-        # Validate intrinsics separately
+        # Validate intrinsics before touching any frame
         if not self._validate_intrinsics(scene_path, intrinsics):
-            return None
+            return
 
-        # 4. Process image size and resize
-        batch_size, original_h, original_w = depth_data.shape
-        h_ratio = self.config.target_height / original_h
-        w_ratio = self.config.target_width / original_w
-        ratio = max(h_ratio, w_ratio)
-        new_h, new_w = int(original_h * ratio), int(original_w * ratio)
-        
-        # Calculate adjusted intrinsics first
-        new_intrinsic = torch.clone(intrinsics)
-        new_intrinsic[0, 0] *= ratio
-        new_intrinsic[1, 1] *= ratio
-        start_x = (new_w - self.config.target_width) // 2
-        start_y = (new_h - self.config.target_height) // 2
-        new_intrinsic[0, 2] = (intrinsics[0, 2] * ratio) - start_x
-        new_intrinsic[1, 2] = (intrinsics[1, 2] * ratio) - start_y
-        
-        # Resize images
-        depth_data = torch.nn.functional.interpolate(depth_data.unsqueeze(1), size=(new_h, new_w), mode='nearest')
-        color_data = torch.nn.functional.interpolate(color_data.permute(0, 3, 1, 2), size=(new_h, new_w), mode='bilinear')
-        
-        # Crop images
-        depth_data = depth_data[:, :, start_y:start_y + self.config.target_height, start_x:start_x + self.config.target_width]
-        color_data = color_data[:, :, start_y:start_y + self.config.target_height, start_x:start_x + self.config.target_width]
-        
-        torch.cuda.empty_cache()
-        
-        return {
-            "frames": {
+        new_intrinsic = None
+        num_valid = 0
+        for chunk_start in range(0, len(frame_paths), self.config.chunk_size):
+            # 2. Load the frames of this chunk
+            frames_data = [self.load_single_frame(frame_path)
+                           for frame_path in frame_paths[chunk_start:chunk_start + self.config.chunk_size]]
+
+            # 3. Stack and process frames
+            depth_data = torch.stack([frame_data['depth_data'] for frame_data in frames_data], axis=0)
+            color_data = torch.stack([frame_data['color_data'] for frame_data in frames_data], axis=0)
+            pose_data = torch.stack([frame_data['pose_data'] for frame_data in frames_data], axis=0)
+            del frames_data
+
+            # Filter out invalid frames
+            valid_mask = self._get_valid_frame_mask(scene_path, depth_data, color_data, pose_data, frame_offset=chunk_start)
+            if not valid_mask.any():
+                continue
+            depth_data = depth_data[valid_mask]
+            color_data = color_data[valid_mask]
+            pose_data = pose_data[valid_mask]
+
+            # 4. Process image size and resize, all frames of a scene share the same size
+            if new_intrinsic is None:
+                _, original_h, original_w = depth_data.shape
+                resize_params = self.get_resize_params(original_h, original_w)
+                new_intrinsic = self.adjust_intrinsics(intrinsics, resize_params)
+            color_data, depth_data = self.resize_and_crop(color_data, depth_data, resize_params)
+
+            num_valid += len(pose_data)
+            yield {
                 'color_data': color_data,
                 'depth_data': depth_data,
                 'pose_data': pose_data,
-            },
-            "intrinsics": new_intrinsic,
-            "frame_num": batch_size,
-            "scene_name": scene_path.split('/')[-1]
-        }
+                'intrinsics': new_intrinsic,
+                'scene_name': scene_name,
+            }
+
+        if num_valid == 0:
+            print(f"No valid frames found in scene {scene_path}")
+
+    def get_resize_params(self, original_h: int, original_w: int) -> dict:
+        """
+        Scale so that the target size is covered, then center crop
+        """
+        return compute_resize_params(original_h, original_w, self.config.target_height, self.config.target_width)
+
+    def adjust_intrinsics(self, intrinsics: torch.Tensor, resize_params: dict) -> torch.Tensor:
+        """
+        Intrinsics of the resized and cropped frames
+        """
+        ratio = resize_params['ratio']
+        new_intrinsic = torch.clone(intrinsics)
+        new_intrinsic[0, 0] *= ratio
+        new_intrinsic[1, 1] *= ratio
+        new_intrinsic[0, 2] = (intrinsics[0, 2] * ratio) - resize_params['start_x']
+        new_intrinsic[1, 2] = (intrinsics[1, 2] * ratio) - resize_params['start_y']
+        return new_intrinsic
+
+    def resize_and_crop(self, color_data: torch.Tensor, depth_data: torch.Tensor, resize_params: dict):
+        """
+        Resize and crop a batch of frames
+        Args:
+            color_data: (n, h, w, 3) float tensor
+            depth_data: (n, h, w) float tensor
+        Returns:
+            color_data (n, 3, target_h, target_w), depth_data (n, 1, target_h, target_w)
+        """
+        return resize_and_crop_frames(color_data, depth_data, resize_params,
+                                      self.config.target_height, self.config.target_width)
     
     @abstractmethod
     def get_intrinsics(self, scene_path: str) -> dict:
@@ -159,46 +265,52 @@ class BaseSceneProcessor:
         pass
 
     def process_single_scene(self, scene_path: str) -> dict:
-        # Load and process scene data
-        scene_data = self.load_and_process_scene(scene_path)
-        if scene_data is None:
-            return False
-        # save scene data
-        scene_name = scene_data['scene_name']
-        scene_save_path = os.path.join(self.config.save_dir, scene_name)
-        scene_color_save_path = os.path.join(scene_save_path, 'color')
-        scene_depth_save_path = os.path.join(scene_save_path, 'depth')
-        scene_pose_save_path = os.path.join(scene_save_path, 'pose')
-        os.makedirs(scene_color_save_path, exist_ok=True)
-        os.makedirs(scene_depth_save_path, exist_ok=True)
-        os.makedirs(scene_pose_save_path, exist_ok=True)
-        # save color data
-        for frame_idx, color_data in enumerate(scene_data['frames']['color_data']):
-            color_save_path = os.path.join(scene_color_save_path, f'{frame_idx:06d}.png')
-            # Convert to uint8 range [0, 255] if needed
-            color_data = color_data.cpu().numpy()
-            color_data = color_data.transpose(1, 2, 0).astype(np.uint8)
-            # Save as JPG for color images
-            cv2.imwrite(color_save_path, color_data)
-
-        # save depth data
-        for frame_idx, depth_data in enumerate(scene_data['frames']['depth_data']):
-            depth_save_path = os.path.join(scene_depth_save_path, f'{frame_idx:06d}.png')
-            # ScanNet depth is in millimeters, stored as 16-bit PNG
-            # Ensure depth is in uint16 format with proper scaling
-            depth_data = depth_data.cpu().numpy()
-            depth_data = depth_data.transpose(1, 2, 0).astype(np.uint16)
-            # Save as 16-bit PNG for depth images
-            cv2.imwrite(depth_save_path, depth_data)
-        # save meta data
-        for frame_idx, pose_data in enumerate(scene_data['frames']['pose_data']):
-            pose_save_path = os.path.join(scene_pose_save_path, f'{frame_idx:06d}.npz')
-            meta_data = {
-                'camera_intrinsics': scene_data['intrinsics'].cpu().numpy(),
-                'camera_pose': pose_data.cpu().numpy()
-            }
-            np.savez(pose_save_path, **meta_data)
+        # Load and process the scene chunk by chunk, frames are written in the background
+        start_time = time.time()
+        scene_save_path = None
+        frame_idx = 0
+        frame_ids, poses = [], []
+        writer = FrameWriter(num_threads=self.config.writer_threads or DEFAULT_WRITER_THREADS, max_pending=2 * self.config.chunk_size,
+                             color_png_compression=self.config.color_png_compression,
+                             depth_png_compression=self.config.depth_png_compression)
+        with writer:
+            for chunk in self.iter_scene_chunks(scene_path):
+                if scene_save_path is None:
+                    scene_save_path = os.path.join(self.config.save_dir, chunk['scene_name'])
+                    scene_color_save_path = os.path.join(scene_save_path, 'color')
+                    scene_depth_save_path = os.path.join(scene_save_path, 'depth')
+                    scene_pose_save_path = os.path.join(scene_save_path, 'pose')
+                    os.makedirs(scene_color_save_path, exist_ok=True)
+                    os.makedirs(scene_depth_save_path, exist_ok=True)
+                    if self.config.per_frame_poses:
+                        os.makedirs(scene_pose_save_path, exist_ok=True)
+                    intrinsics = chunk['intrinsics'].cpu().numpy()
+
+                # One device to host copy per chunk
+                # Convert to uint8 range [0, 255], ScanNet depth is in millimeters, stored as 16-bit PNG
+                color_data = chunk['color_data'].to(torch.uint8).permute(0, 2, 3, 1).contiguous().cpu().numpy()
+                depth_data = chunk['depth_data'].permute(0, 2, 3, 1).contiguous().cpu().numpy().astype(np.uint16)
+                pose_data = chunk['pose_data'].cpu().numpy()
 
+                for color, depth, pose in zip(color_data, depth_data, pose_data):
+                    frame_name = f'{frame_idx:06d}'
+                    writer.write_color(os.path.join(scene_color_save_path, f'{frame_name}.png'), color)
+                    writer.write_depth(os.path.join(scene_depth_save_path, f'{frame_name}.png'), depth)
+                    if self.config.per_frame_poses:
+                        writer.write_npz(os.path.join(scene_pose_save_path, f'{frame_name}.npz'),
+                                         camera_intrinsics=intrinsics, camera_pose=pose)
+                    frame_ids.append(frame_name)
+                    poses.append(pose)
+                    frame_idx += 1
+
+        if scene_save_path is None:
+            return False
+        # All poses of the scene in one file, written last
+        save_npz_atomic(os.path.join(scene_save_path, POSES_FILE),
+                        frame_ids=np.array(frame_ids), camera_poses=np.stack(poses), camera_intrinsics=intrinsics)
+        elapsed = time.time() - start_time
+        print(f"Processed {frame_idx} frames of {os.path.basename(scene_save_path)} in {elapsed:.1f}s "
+              f"({frame_idx / max(elapsed, 1e-6):.1f} frames/s, chunk size {self.config.chunk_size})")
         return True
     
     def _process_scene_with_gpu(self, scene_path: str, gpu_id: int) -> dict:
@@ -223,6 +335,23 @@ class BaseSceneProcessor:
             torch.cuda.empty_cache()
             return None
 
+    def _process_scene_with_cpu(self, scene_path: str, writer_threads: int) -> dict:
+        """
+        Process a single scene on the CPU of a pool worker
+        Args:
+            scene_path: str, path to the scene
+            writer_threads: int, background encoding threads of this worker
+        Returns:
+            bool: whether the scene was saved
+        """
+        self.config.device = 'cpu'
+        self.config.writer_threads = writer_threads
+        try:
+            return self.process_single_scene(scene_path)
+        except Exception as e:
+            print(f"Error processing scene {scene_path} on CPU: {e}")
+            return None
+
     def process_all_scenes_serial(self):
         """
         Process all scenes in serial
@@ -232,7 +361,8 @@ class BaseSceneProcessor:
         
     def process_all_scenes_parallel(self):
         """
-        Process all scenes in parallel with tasks distributed across available GPUs
+        Process all scenes in parallel with tasks distributed across available GPUs,
+        or across a CPU process pool when config.device is 'cpu' or no GPU is visible
         """
         # Filter out processed scenes
         unprocessed_scenes = []
@@ -252,8 +382,11 @@ class BaseSceneProcessor:
         
         # Get number of available GPUs
         num_gpus = torch.cuda.device_count()
-        if num_gpus == 0:
-            raise RuntimeError("No GPU available for processing")
+        if str(self.config.device).startswith('cpu') or num_gpus == 0:
+            if not str(self.config.device).startswith('cpu'):
+                print("No GPU available, falling back to CPU processing")
+            self._process_scenes_on_cpu_pool(unprocessed_scenes)
+            return
         
         # Calculate workers per GPU
         workers_per_gpu = max(1, self.config.num_workers // num_gpus)
@@ -280,6 +413,31 @@ class BaseSceneProcessor:
                     print(f"Error in processing scene: {e}")
                     continue
 
+    def _process_scenes_on_cpu_pool(self, scene_paths: List[str]):
+        """
+        Process scenes across a process pool sized to the available cores
+        """
+        num_cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        num_threads = max(1, self.config.cpu_threads_per_worker)
+        total_workers = max(1, min(len(scene_paths), num_cores // num_threads))
+        # encoders are CPU-bound too, share the cores between the workers instead of 8 threads each
+        writer_threads = self.config.writer_threads or max(1, num_cores // total_workers)
+
+        print(f"Processing {len(scene_paths)} scenes with {total_workers} CPU workers "
+              f"({num_threads} torch threads, {writer_threads} writer threads per worker)...")
+
+        with ProcessPoolExecutor(max_workers=total_workers, initializer=_init_cpu_worker,
+                                 initargs=(num_threads,)) as executor:
+            futures = [executor.submit(self._process_scene_with_cpu, scene_path, writer_threads) for scene_path in scene_paths]
+
+            # Process results with progress bar, in completion order
+            for future in tqdm.tqdm(as_completed(futures), total=len(scene_paths)):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error in processing scene: {e}")
+                    continue
+
     def is_scene_processed(self, scene_save_path):
         """Check if a scene has been fully processed"""
         # Check required directories and their contents
@@ -289,6 +447,12 @@ class BaseSceneProcessor:
             'pose': '.npz'
         }
         
+        # poses.npz is written last, it is the only pose file when per-frame poses are disabled
+        if not self.config.per_frame_poses:
+            if not os.path.isfile(os.path.join(scene_save_path, POSES_FILE)):
+                return False
+            del required_dirs['pose']
+
         for dir_name, file_ext in required_dirs.items():
             dir_path = os.path.join(scene_save_path, dir_name)
             # Check if directory exists
@@ -314,7 +478,7 @@ class BaseSceneProcessor:
         return True
 
     def _get_valid_frame_mask(self, scene_path: str, depth_data: torch.Tensor, 
-                            color_data: torch.Tensor, pose_data: torch.Tensor) -> torch.Tensor:
+                            color_data: torch.Tensor, pose_data: torch.Tensor, frame_offset: int = 0) -> torch.Tensor:
         """
         Get mask of valid frames
         Args:
@@ -322,6 +486,7 @@ class BaseSceneProcessor:
             depth_data: depth tensor data
             color_data: color tensor data
             pose_data: pose tensor data
+            frame_offset: index of the first frame in the scene, for error reporting
         Returns:
             torch.Tensor: boolean mask indicating valid frames
         """
@@ -339,7 +504,7 @@ class BaseSceneProcessor:
 
             for name, tensor in tensors_to_check.items():
                 if torch.isnan(tensor).any() or torch.isinf(tensor).any():
-                    print(f"Invalid {name} data found in frame {i} of scene {scene_path}")
+                    print(f"Invalid {name} data found in frame {frame_offset + i} of scene {scene_path}")
                     frame_valid = False
                     break
 
@@ -0,0 +1,82 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+
+class FrameWriter:
+    """
+    Thread pool writing encoded frames in the background
+    cv2 releases the GIL while encoding PNGs, so the writes of one chunk overlap with loading and resizing
+    the next one. At most max_pending frames are queued, submit blocks beyond that to bound memory.
+    """
+    def __init__(self, num_threads: int = 8, max_pending: int = 128,
+                 color_png_compression: int = None, depth_png_compression: int = None):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, num_threads))
+        self.slots = threading.BoundedSemaphore(max(1, max_pending))
+        # None keeps the OpenCV default level
+        self.color_params = [] if color_png_compression is None else [cv2.IMWRITE_PNG_COMPRESSION, color_png_compression]
+        self.depth_params = [] if depth_png_compression is None else [cv2.IMWRITE_PNG_COMPRESSION, depth_png_compression]
+        self.futures = []
+        self.num_written = 0
+
+    def _write(self, path, image, params):
+        try:
+            if not cv2.imwrite(path, image, params):
+                raise IOError(f"Failed to write {path}")
+        finally:
+            self.slots.release()
+
+    def _submit(self, fn, *args):
+        self.slots.acquire()
+        self.futures.append(self.executor.submit(fn, *args))
+
+    def write_color(self, path: str, image: np.ndarray):
+        self._submit(self._write, path, image, self.color_params)
+
+    def write_depth(self, path: str, depth: np.ndarray):
+        self._submit(self._write, path, depth, self.depth_params)
+
+    def write_npz(self, path: str, **arrays):
+        def _save():
+            try:
+                np.savez(path, **arrays)
+            finally:
+                self.slots.release()
+        self._submit(_save)
+
+    def flush(self):
+        """
+        Wait for all pending writes, re-raising the first error
+        """
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+        self.num_written += len(futures)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't mask the original error with a secondary write failure
+            self.executor.shutdown(wait=True)
+        return False
+
+
+def save_npz_atomic(path: str, **arrays):
+    """
+    Write an npz file under a temporary name and rename it into place
+    """
+    tmp_path = f"{path[:-len('.npz')]}.tmp{os.getpid()}.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
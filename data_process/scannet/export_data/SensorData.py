@@ -1,13 +1,14 @@
 import os, struct
+import mmap
 import numpy as np
 import zlib
 import imageio
 import cv2
-import png
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from PIL import Image
 import io
 import multiprocessing
+import time
 from tqdm import tqdm
 
 COMPRESSION_TYPE_COLOR = {-1:'unknown', 0:'raw', 1:'png', 2:'jpeg'}
@@ -47,31 +48,172 @@ class RGBDFrame():
     return imageio.imread(self.color_data)
 
 
+def write_depth_png(path, depth, compression=None):
+  """
+  Write a uint16 depth map as a 16-bit grayscale PNG in one vectorized encode
+  compression: zlib level 0-9, None keeps the OpenCV default (1)
+  """
+  params = [] if compression is None else [cv2.IMWRITE_PNG_COMPRESSION, compression]
+  if not cv2.imwrite(path, np.ascontiguousarray(depth, dtype=np.uint16), params):
+    raise IOError('failed to write ' + path)
+
+
+FRAME_HEADER = struct.Struct('<16f4Q')  # camera_to_world, timestamp_color, timestamp_depth, color_size_bytes, depth_size_bytes
+
+
+class SensFrameIndex:
+    """
+    Byte offsets and poses of every frame of a .sens file, built with one pass over the frame headers
+    and persisted next to the file as <filename>.index.npz
+    """
+    def __init__(self, camera_to_world, timestamps, color_offsets, color_sizes, depth_offsets, depth_sizes):
+        self.camera_to_world = camera_to_world
+        self.timestamps = timestamps
+        self.color_offsets = color_offsets
+        self.color_sizes = color_sizes
+        self.depth_offsets = depth_offsets
+        self.depth_sizes = depth_sizes
+
+    def __len__(self):
+        return len(self.color_offsets)
+
+    @staticmethod
+    def index_path(filename):
+        return filename + '.index.npz'
+
+    @classmethod
+    def build(cls, file_handle, num_frames):
+        # file_handle is positioned at the first frame, only headers are read, payloads are skipped
+        camera_to_world = np.empty((num_frames, 4, 4), dtype=np.float32)
+        timestamps = np.empty((num_frames, 2), dtype=np.uint64)
+        offsets = np.empty((num_frames, 2), dtype=np.uint64)
+        sizes = np.empty((num_frames, 2), dtype=np.uint64)
+        for i in range(num_frames):
+            header = FRAME_HEADER.unpack(file_handle.read(FRAME_HEADER.size))
+            camera_to_world[i] = np.asarray(header[:16], dtype=np.float32).reshape(4, 4)
+            timestamps[i] = header[16:18]
+            sizes[i] = header[18:20]
+            offsets[i, 0] = file_handle.tell()
+            offsets[i, 1] = offsets[i, 0] + sizes[i, 0]
+            file_handle.seek(int(sizes[i, 0] + sizes[i, 1]), os.SEEK_CUR)
+        return cls(camera_to_world, timestamps, offsets[:, 0], sizes[:, 0], offsets[:, 1], sizes[:, 1])
+
+    def save(self, path, file_stat):
+        tmp_path = f'{path[:-len(".npz")]}.tmp{os.getpid()}.npz'
+        np.savez(tmp_path, camera_to_world=self.camera_to_world, timestamps=self.timestamps,
+                 color_offsets=self.color_offsets, color_sizes=self.color_sizes,
+                 depth_offsets=self.depth_offsets, depth_sizes=self.depth_sizes,
+                 file_size=file_stat.st_size, file_mtime_ns=file_stat.st_mtime_ns)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_or_build(cls, filename, file_handle, num_frames):
+        """
+        Reuse the persisted index if it matches the size and mtime of the file, rebuild it otherwise
+        """
+        path = cls.index_path(filename)
+        file_stat = os.stat(filename)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if (int(data['file_size']) == file_stat.st_size and int(data['file_mtime_ns']) == file_stat.st_mtime_ns
+                        and len(data['color_offsets']) == num_frames):
+                    return cls(data['camera_to_world'], data['timestamps'], data['color_offsets'],
+                               data['color_sizes'], data['depth_offsets'], data['depth_sizes'])
+        index = cls.build(file_handle, num_frames)
+        try:
+            index.save(path, file_stat)
+        except OSError as e:
+            print(f'Could not persist frame index {path}: {e}')
+        return index
+
+
+class LazyRGBDFrame(RGBDFrame):
+  """RGBDFrame whose compressed color and depth bytes are read from the memory-mapped file on access"""
+
+  def __init__(self, buffer, index, i):
+    self._buffer = buffer
+    self._index = index
+    self._i = i
+    self.camera_to_world = index.camera_to_world[i]
+    self.timestamp_color = int(index.timestamps[i, 0])
+    self.timestamp_depth = int(index.timestamps[i, 1])
+    self.color_size_bytes = int(index.color_sizes[i])
+    self.depth_size_bytes = int(index.depth_sizes[i])
+
+  @property
+  def color_data(self):
+    offset = int(self._index.color_offsets[self._i])
+    return self._buffer[offset:offset + self.color_size_bytes]
+
+  @property
+  def depth_data(self):
+    offset = int(self._index.depth_offsets[self._i])
+    return self._buffer[offset:offset + self.depth_size_bytes]
+
+
+class LazyFrameList:
+  """Sequence of LazyRGBDFrame over a memory map of a .sens file, only the accessed frames are ever read"""
+
+  def __init__(self, filename, index):
+    self.filename = filename
+    self.index = index
+    self._file = open(filename, 'rb')
+    self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def __len__(self):
+    return len(self.index)
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return [self[j] for j in range(*i.indices(len(self)))]
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError(i)
+    return LazyRGBDFrame(self._buffer, self.index, i)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def close(self):
+    self._buffer.close()
+    self._file.close()
+
+
 class SensorData:
 
-  def __init__(self, filename):
+  def __init__(self, filename, indexed=False):
     self.version = 4
-    self.load(filename)
+    if indexed:
+      self.load_indexed(filename)
+    else:
+      self.load(filename)
+
+
+  def load_header(self, f):
+    version = struct.unpack('I', f.read(4))[0]
+    assert self.version == version
+    strlen = struct.unpack('Q', f.read(8))[0]
+    self.sensor_name = f.read(strlen).decode('utf-8')
+    self.intrinsic_color = np.asarray(struct.unpack('f'*16, f.read(16*4)), dtype=np.float32).reshape(4, 4)
+    self.extrinsic_color = np.asarray(struct.unpack('f'*16, f.read(16*4)), dtype=np.float32).reshape(4, 4)
+    self.intrinsic_depth = np.asarray(struct.unpack('f'*16, f.read(16*4)), dtype=np.float32).reshape(4, 4)
+    self.extrinsic_depth = np.asarray(struct.unpack('f'*16, f.read(16*4)), dtype=np.float32).reshape(4, 4)
+    self.color_compression_type = COMPRESSION_TYPE_COLOR[struct.unpack('i', f.read(4))[0]]
+    self.depth_compression_type = COMPRESSION_TYPE_DEPTH[struct.unpack('i', f.read(4))[0]]
+    self.color_width = struct.unpack('I', f.read(4))[0]
+    self.color_height =  struct.unpack('I', f.read(4))[0]
+    self.depth_width = struct.unpack('I', f.read(4))[0]
+    self.depth_height =  struct.unpack('I', f.read(4))[0]
+    self.depth_shift =  struct.unpack('f', f.read(4))[0]
+    num_frames =  struct.unpack('Q', f.read(8))[0]
+    return num_frames
 
 
   def load(self, filename):
     with open(filename, 'rb') as f:
-      version = struct.unpack('I', f.read(4))[0]
-      assert self.version == version
-      strlen = struct.unpack('Q', f.read(8))[0]
-      self.sensor_name = f.read(strlen).decode('utf-8')
-      self.intrinsic_color = np.asarray(struct.unpack('f'*16, f.read(16*4)), dtype=np.float32).reshape(4, 4)
-      self.extrinsic_color = np.asarray(struct.unpack('f'*16, f.read(16*4)), dtype=np.float32).reshape(4, 4)
-      self.intrinsic_depth = np.asarray(struct.unpack('f'*16, f.read(16*4)), dtype=np.float32).reshape(4, 4)
-      self.extrinsic_depth = np.asarray(struct.unpack('f'*16, f.read(16*4)), dtype=np.float32).reshape(4, 4)
-      self.color_compression_type = COMPRESSION_TYPE_COLOR[struct.unpack('i', f.read(4))[0]]
-      self.depth_compression_type = COMPRESSION_TYPE_DEPTH[struct.unpack('i', f.read(4))[0]]
-      self.color_width = struct.unpack('I', f.read(4))[0]
-      self.color_height =  struct.unpack('I', f.read(4))[0]
-      self.depth_width = struct.unpack('I', f.read(4))[0]
-      self.depth_height =  struct.unpack('I', f.read(4))[0]
-      self.depth_shift =  struct.unpack('f', f.read(4))[0]
-      num_frames =  struct.unpack('Q', f.read(8))[0]
+      num_frames = self.load_header(f)
       self.frames = []
       for i in range(num_frames):
         frame = RGBDFrame()
@@ -79,26 +221,38 @@ class SensorData:
         self.frames.append(frame)
 
 
-  def export_depth_images(self, output_path, image_size=None, frame_skip=1):
+  def load_indexed(self, filename):
+    # frames are decoded on access from a memory map of the file, using a persisted frame offset index
+    with open(filename, 'rb') as f:
+      num_frames = self.load_header(f)
+      self.frame_index = SensFrameIndex.load_or_build(filename, f, num_frames)
+    self.frames = LazyFrameList(filename, self.frame_index)
+
+
+  def frames_to_export(self, frame_skip=1, frame_ids=None):
+    if frame_ids is not None:
+      return [f for f in frame_ids if 0 <= f < len(self.frames)]
+    return range(0, len(self.frames), frame_skip)
+
+
+  def export_depth_images(self, output_path, image_size=None, frame_skip=1, frame_ids=None, png_compression=None):
     if not os.path.exists(output_path):
       os.makedirs(output_path)
-    print('exporting', len(self.frames)//frame_skip, ' depth frames to', output_path)
-    for f in range(0, len(self.frames), frame_skip):
+    frames = self.frames_to_export(frame_skip, frame_ids)
+    print('exporting', len(frames), ' depth frames to', output_path)
+    for f in frames:
       depth_data = self.frames[f].decompress_depth(self.depth_compression_type)
-      depth = np.fromstring(depth_data, dtype=np.uint16).reshape(self.depth_height, self.depth_width)
+      depth = np.frombuffer(depth_data, dtype=np.uint16).reshape(self.depth_height, self.depth_width)
       if image_size is not None:
         depth = cv2.resize(depth, (image_size[1], image_size[0]), interpolation=cv2.INTER_NEAREST)
-      #imageio.imwrite(os.path.join(output_path, str(f) + '.png'), depth)
-      with open(os.path.join(output_path, str(f) + '.png'), 'wb') as f: # write 16-bit
-        writer = png.Writer(width=depth.shape[1], height=depth.shape[0], bitdepth=16)
-        depth = depth.reshape(-1, depth.shape[1]).tolist()
-        writer.write(f, depth)
+      write_depth_png(os.path.join(output_path, str(f) + '.png'), depth, png_compression) # write 16-bit
 
-  def export_color_images(self, output_path, image_size=None, frame_skip=1):
+  def export_color_images(self, output_path, image_size=None, frame_skip=1, frame_ids=None):
     if not os.path.exists(output_path):
       os.makedirs(output_path)
-    print('exporting', len(self.frames)//frame_skip, 'color frames to', output_path)
-    for f in range(0, len(self.frames), frame_skip):
+    frames = self.frames_to_export(frame_skip, frame_ids)
+    print('exporting', len(frames), 'color frames to', output_path)
+    for f in frames:
       color = self.frames[f].decompress_color(self.color_compression_type)
       if image_size is not None:
         color = cv2.resize(color, (image_size[1], image_size[0]), interpolation=cv2.INTER_NEAREST)
@@ -111,11 +265,12 @@ class SensorData:
         np.savetxt(f, line[np.newaxis], fmt='%f')
 
 
-  def export_poses(self, output_path, frame_skip=1):
+  def export_poses(self, output_path, frame_skip=1, frame_ids=None):
     if not os.path.exists(output_path):
       os.makedirs(output_path)
-    print('exporting', len(self.frames)//frame_skip, 'camera poses to', output_path)
-    for f in range(0, len(self.frames), frame_skip):
+    frames = self.frames_to_export(frame_skip, frame_ids)
+    print('exporting', len(frames), 'camera poses to', output_path)
+    for f in frames:
       self.save_mat_to_file(self.frames[f].camera_to_world, os.path.join(output_path, str(f) + '.txt'))
 
 
@@ -128,10 +283,72 @@ class SensorData:
     self.save_mat_to_file(self.intrinsic_depth, os.path.join(output_path, 'intrinsic_depth.txt'))
     self.save_mat_to_file(self.extrinsic_depth, os.path.join(output_path, 'extrinsic_depth.txt'))
 
+def save_depth_frame(frame, output_file, depth_format, image_size=None, png_compression=None):
+    # depth_format: (compression_type, height, width)
+    compression_type, depth_height, depth_width = depth_format
+    depth_data = frame.decompress_depth(compression_type)
+    depth = np.frombuffer(depth_data, dtype=np.uint16).reshape(depth_height, depth_width)
+
+    if image_size is not None:
+        depth = cv2.resize(depth, (image_size[1], image_size[0]), interpolation=cv2.INTER_NEAREST)
+
+    write_depth_png(output_file, depth, png_compression)
+
+
+def save_color_frame(frame, output_file, compression_type, image_size=None):
+    color = frame.decompress_color(compression_type)
+
+    # Convert to PIL Image for faster processing
+    if isinstance(color, np.ndarray):
+        color = Image.fromarray(color)
+
+    if image_size is not None:
+        color = color.resize((image_size[1], image_size[0]), Image.NEAREST)
+
+    color.save(output_file, 'JPEG', quality=95, optimize=True)
+
+
+# Process pool workers map the .sens file once and receive only byte ranges of the frames they decode
+_worker_buffer = None
+
+
+def _init_decode_worker(filename):
+    global _worker_buffer
+    # the pool provides the parallelism, keep OpenCV single threaded in each worker
+    cv2.setNumThreads(1)
+    with open(filename, 'rb') as f:
+        _worker_buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _frame_from_byte_range(byte_range):
+    color_offset, color_size, depth_offset, depth_size = byte_range
+    frame = RGBDFrame()
+    frame.color_data = _worker_buffer[color_offset:color_offset + color_size]
+    frame.depth_data = _worker_buffer[depth_offset:depth_offset + depth_size]
+    return frame
+
+
+def _decode_depth_worker(args):
+    f, byte_range, output_path, depth_format, image_size, png_compression = args
+    save_depth_frame(_frame_from_byte_range(byte_range), os.path.join(output_path, f"{f}.png"),
+                     depth_format, image_size, png_compression)
+    return f
+
+
+def _decode_color_worker(args):
+    f, byte_range, output_path, compression_type, image_size = args
+    save_color_frame(_frame_from_byte_range(byte_range), os.path.join(output_path, f"{f}.jpg"),
+                     compression_type, image_size)
+    return f
+
+
 class OptimizedSensorData(SensorData):
-    def __init__(self, filename):
-        super().__init__(filename)
+    def __init__(self, filename, indexed=False, use_processes=False):
+        super().__init__(filename, indexed)
+        self.filename = filename
         self._num_workers = max(1, multiprocessing.cpu_count() - 1)  # 默认值
+        # decode in worker processes instead of threads, JPEG decode and re-encode hold the GIL
+        self.use_processes = use_processes
         
     @property
     def num_workers(self):
@@ -142,68 +359,82 @@ class OptimizedSensorData(SensorData):
         self._num_workers = max(1, value)  # 确保至少有1个线程
 
     def _process_depth_frame(self, args):
-        f, output_path, image_size = args
-        depth_data = self.frames[f].decompress_depth(self.depth_compression_type)
-        depth = np.fromstring(depth_data, dtype=np.uint16).reshape(self.depth_height, self.depth_width)
-        
-        if image_size is not None:
-            depth = cv2.resize(depth, (image_size[1], image_size[0]), interpolation=cv2.INTER_NEAREST)
-            
-        output_file = os.path.join(output_path, f"{f}.png")
-        with open(output_file, 'wb') as fp:
-            writer = png.Writer(width=depth.shape[1], height=depth.shape[0], bitdepth=16)
-            depth = depth.reshape(-1, depth.shape[1]).tolist()
-            writer.write(fp, depth)
+        f, output_path, image_size, png_compression = args
+        save_depth_frame(self.frames[f], os.path.join(output_path, f"{f}.png"),
+                         (self.depth_compression_type, self.depth_height, self.depth_width), image_size, png_compression)
         return f
 
     def _process_color_frame(self, args):
         f, output_path, image_size = args
-        color = self.frames[f].decompress_color(self.color_compression_type)
-        
-        # Convert to PIL Image for faster processing
-        if isinstance(color, np.ndarray):
-            color = Image.fromarray(color)
-            
-        if image_size is not None:
-            color = color.resize((image_size[1], image_size[0]), Image.NEAREST)
-            
-        output_file = os.path.join(output_path, f"{f}.jpg")
-        color.save(output_file, 'JPEG', quality=95, optimize=True)
+        save_color_frame(self.frames[f], os.path.join(output_path, f"{f}.jpg"), self.color_compression_type, image_size)
         return f
 
-    def export_depth_images_parallel(self, output_path, image_size=None, frame_skip=1):
+    def _frame_byte_ranges(self, frames_to_process):
+        """
+        (color_offset, color_size, depth_offset, depth_size) of each frame, from the frame index
+        """
+        index = getattr(self, 'frame_index', None)
+        if index is None:
+            with open(self.filename, 'rb') as f:
+                num_frames = self.load_header(f)
+                index = self.frame_index = SensFrameIndex.load_or_build(self.filename, f, num_frames)
+        return [(int(index.color_offsets[f]), int(index.color_sizes[f]),
+                 int(index.depth_offsets[f]), int(index.depth_sizes[f])) for f in frames_to_process]
+
+    def _run_parallel(self, thread_fn, worker_fn, args_list, frames_to_process, desc):
+        start = time.time()
+        if self.use_processes:
+            # workers get (frame, byte range, ...) tuples, never the SensorData object
+            byte_ranges = self._frame_byte_ranges(frames_to_process)
+            worker_args = [(args[0], byte_range) + args[1:] for args, byte_range in zip(args_list, byte_ranges)]
+            chunksize = max(1, len(worker_args) // (4 * self.num_workers))
+            with ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_decode_worker,
+                                     initargs=(self.filename,)) as executor:
+                for _ in tqdm(executor.map(worker_fn, worker_args, chunksize=chunksize), total=len(worker_args), desc=desc):
+                    pass
+        else:
+            with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+                futures = [executor.submit(thread_fn, args) for args in args_list]
+
+                for _ in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                    pass
+        elapsed = time.time() - start
+        print(f'{desc}: {len(args_list) / max(elapsed, 1e-6):.1f} frames/s with {self.num_workers} '
+              f'{"processes" if self.use_processes else "threads"}')
+
+    def export_depth_images_parallel(self, output_path, image_size=None, frame_skip=1, frame_ids=None, png_compression=None):
         if not os.path.exists(output_path):
             os.makedirs(output_path)
             
-        frames_to_process = range(0, len(self.frames), frame_skip)
-        args_list = [(f, output_path, image_size) for f in frames_to_process]
-        
+        frames_to_process = self.frames_to_export(frame_skip, frame_ids)
         print(f'Exporting {len(frames_to_process)} depth frames to {output_path} using {self.num_workers} workers')
-        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
-            futures = [executor.submit(self._process_depth_frame, args) for args in args_list]
-            
-            for _ in tqdm(as_completed(futures), total=len(futures), desc="Processing depth frames"):
-                pass
+        if self.use_processes:
+            depth_format = (self.depth_compression_type, self.depth_height, self.depth_width)
+            args_list = [(f, output_path, depth_format, image_size, png_compression) for f in frames_to_process]
+        else:
+            args_list = [(f, output_path, image_size, png_compression) for f in frames_to_process]
+        self._run_parallel(self._process_depth_frame, _decode_depth_worker, args_list, frames_to_process,
+                           "Processing depth frames")
 
-    def export_color_images_parallel(self, output_path, image_size=None, frame_skip=1):
+    def export_color_images_parallel(self, output_path, image_size=None, frame_skip=1, frame_ids=None):
         if not os.path.exists(output_path):
             os.makedirs(output_path)
             
-        frames_to_process = range(0, len(self.frames), frame_skip)
-        args_list = [(f, output_path, image_size) for f in frames_to_process]
-        
+        frames_to_process = self.frames_to_export(frame_skip, frame_ids)
         print(f'Exporting {len(frames_to_process)} color frames to {output_path} using {self.num_workers} workers')
-        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
-            futures = [executor.submit(self._process_color_frame, args) for args in args_list]
-            
-            for _ in tqdm(as_completed(futures), total=len(futures), desc="Processing color frames"):
-                pass
+        if self.use_processes:
+            args_list = [(f, output_path, self.color_compression_type, image_size) for f in frames_to_process]
+        else:
+            args_list = [(f, output_path, image_size) for f in frames_to_process]
+        self._run_parallel(self._process_color_frame, _decode_color_worker, args_list, frames_to_process,
+                           "Processing color frames")
 
-    def export_poses_parallel(self, output_path, frame_skip=1):
+    def export_poses_parallel(self, output_path, frame_skip=1, frame_ids=None):
         if not os.path.exists(output_path):
             os.makedirs(output_path)
             
-        print(f'Exporting {len(self.frames)//frame_skip} camera poses to {output_path}')
+        frames_to_process = self.frames_to_export(frame_skip, frame_ids)
+        print(f'Exporting {len(frames_to_process)} camera poses to {output_path}')
         
         def save_pose(f):
             self.save_mat_to_file(self.frames[f].camera_to_world, 
@@ -211,8 +442,7 @@ class OptimizedSensorData(SensorData):
             return f
             
         with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
-            futures = [executor.submit(save_pose, f) 
-                      for f in range(0, len(self.frames), frame_skip)]
+            futures = [executor.submit(save_pose, f) for f in frames_to_process]
             
             for _ in tqdm(as_completed(futures), total=len(futures), desc="Processing poses"):
                 pass
\ No newline at end of file
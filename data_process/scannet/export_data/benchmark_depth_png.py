@@ -0,0 +1,55 @@
+import argparse
+import io
+import time
+import numpy as np
+import cv2
+import png
+
+from SensorData import SensorData
+
+# Compares the legacy pypng depth encoder with the vectorized OpenCV one on frames of a sample .sens file
+parser = argparse.ArgumentParser()
+parser.add_argument('--filename', required=True, help='path to sens file to read')
+parser.add_argument('--num_frames', type=int, default=100, help='number of frames to encode')
+parser.add_argument('--levels', nargs='+', type=int, default=[1, 3, 6, 9], help='PNG compression levels to benchmark')
+opt = parser.parse_args()
+
+
+def encode_pypng(depth):
+    buf = io.BytesIO()
+    writer = png.Writer(width=depth.shape[1], height=depth.shape[0], bitdepth=16)
+    writer.write(buf, depth.reshape(-1, depth.shape[1]).tolist())
+    return buf.getvalue()
+
+
+def encode_cv2(depth, level):
+    ok, buf = cv2.imencode('.png', depth, [cv2.IMWRITE_PNG_COMPRESSION, level])
+    assert ok
+    return buf.tobytes()
+
+
+def bench(name, encode, depths):
+    start = time.time()
+    encoded = [encode(depth) for depth in depths]
+    elapsed = time.time() - start
+    # decoded values must match the source depth exactly
+    for depth, data in zip(depths, encoded):
+        decoded = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        assert decoded.dtype == np.uint16 and np.array_equal(decoded, depth), f'{name}: depth values differ'
+    size = sum(len(data) for data in encoded) / len(encoded)
+    print(f'{name:<12} {elapsed / len(depths) * 1000:8.2f} ms/frame {len(depths) / elapsed:8.1f} frames/s {size / 1024:8.1f} KiB/frame')
+
+
+def main():
+    sd = SensorData(opt.filename, indexed=True)
+    frame_ids = np.linspace(0, len(sd.frames) - 1, min(opt.num_frames, len(sd.frames))).astype(int)
+    depths = [np.frombuffer(sd.frames[f].decompress_depth(sd.depth_compression_type), dtype=np.uint16)
+              .reshape(sd.depth_height, sd.depth_width) for f in frame_ids]
+    print(f'encoding {len(depths)} depth frames of {sd.depth_width}x{sd.depth_height}')
+    bench('pypng', encode_pypng, depths)
+    for level in opt.levels:
+        bench(f'cv2 level {level}', lambda depth: encode_cv2(depth, level), depths)
+
+
+if __name__ == '__main__':
+    main()
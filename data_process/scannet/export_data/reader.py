@@ -13,9 +13,14 @@ parser.add_argument('--export_color_images', dest='export_color_images', action=
 parser.add_argument('--export_poses', dest='export_poses', action='store_true')
 parser.add_argument('--export_intrinsics', dest='export_intrinsics', action='store_true')
 parser.add_argument('--use_parallel', dest='use_parallel', action='store_true', help='use parallel processing for faster export')
+parser.add_argument('--use_processes', dest='use_processes', action='store_true', help='with --use_parallel, decode frames in worker processes instead of threads')
+parser.add_argument('--num_workers', type=int, default=None, help='parallel workers (default: cpu count - 1)')
 parser.add_argument('--frame_skip', type=int, default=1, help='process every nth frame (default: 1)')
 parser.add_argument('--image_size', nargs=2, type=int, help='resize images to this size (height width)')
-parser.set_defaults(export_depth_images=False, export_color_images=False, export_poses=False, export_intrinsics=False, use_parallel=False)
+parser.add_argument('--frame_ids', nargs='+', type=int, help='export only these frames (overrides --frame_skip)')
+parser.add_argument('--depth_png_compression', type=int, default=None, help='zlib level 0-9 of the depth PNGs (default: OpenCV default)')
+parser.add_argument('--load_all', dest='load_all', action='store_true', help='read every frame into memory instead of decoding frames on demand through the frame index')
+parser.set_defaults(load_all=False, export_depth_images=False, export_color_images=False, export_poses=False, export_intrinsics=False, use_parallel=False, use_processes=False)
 
 opt = parser.parse_args()
 print(opt)
@@ -30,12 +35,14 @@ def main():
     
     # Choose which class to use based on parallel processing option
     if opt.use_parallel:
-        sd = OptimizedSensorData(opt.filename)
+        sd = OptimizedSensorData(opt.filename, indexed=not opt.load_all, use_processes=opt.use_processes)
+        if opt.num_workers is not None:
+            sd.num_workers = opt.num_workers
         export_depth = sd.export_depth_images_parallel
         export_color = sd.export_color_images_parallel
         export_poses = sd.export_poses_parallel
     else:
-        sd = SensorData(opt.filename)
+        sd = SensorData(opt.filename, indexed=not opt.load_all)
         export_depth = sd.export_depth_images
         export_color = sd.export_color_images
         export_poses = sd.export_poses
@@ -48,11 +55,12 @@ def main():
         image_size = tuple(opt.image_size)  # (height, width)
     
     if opt.export_depth_images:
-        export_depth(os.path.join(opt.output_path, 'depth'), image_size=image_size, frame_skip=opt.frame_skip)
+        export_depth(os.path.join(opt.output_path, 'depth'), image_size=image_size, frame_skip=opt.frame_skip, frame_ids=opt.frame_ids,
+                     png_compression=opt.depth_png_compression)
     if opt.export_color_images:
-        export_color(os.path.join(opt.output_path, 'color'), image_size=image_size, frame_skip=opt.frame_skip)
+        export_color(os.path.join(opt.output_path, 'color'), image_size=image_size, frame_skip=opt.frame_skip, frame_ids=opt.frame_ids)
     if opt.export_poses:
-        export_poses(os.path.join(opt.output_path, 'pose'), frame_skip=opt.frame_skip)
+        export_poses(os.path.join(opt.output_path, 'pose'), frame_skip=opt.frame_skip, frame_ids=opt.frame_ids)
     if opt.export_intrinsics:
         sd.export_intrinsics(os.path.join(opt.output_path, 'intrinsic'))
 
@@ -10,8 +10,9 @@ import argparse
 
 
 class ScanNetConfig(BaseSceneProcessorConfig):
-    def __init__(self, root_dir: str, save_dir: str, device: torch.device, num_workers: int = 16):
-        super().__init__(root_dir, save_dir, device, num_workers)
+    def __init__(self, root_dir: str, save_dir: str, device: torch.device, num_workers: int = 16, chunk_size: int = 64,
+                 **kwargs):
+        super().__init__(root_dir, save_dir, device, num_workers, chunk_size, **kwargs)
 
 class ScanNetProcessor(BaseSceneProcessor):
     def __init__(self, config: ScanNetConfig = None):
@@ -100,8 +101,20 @@ if __name__ == "__main__":
     parser.add_argument("--save_dir", type=str, default="data/scannet_processed")
     parser.add_argument("--device", type=str, default="cuda")
     parser.add_argument("--num_workers", type=int, default=8)
+    parser.add_argument("--chunk_size", type=int, default=64, help="frames processed at once per worker")
+    parser.add_argument("--writer_threads", type=int, default=None,
+                        help="threads encoding and writing frames per worker (default: 8 on GPU, cores // workers on CPU)")
+    parser.add_argument("--color_png_compression", type=int, default=None, help="PNG compression level 0-9 of color frames")
+    parser.add_argument("--depth_png_compression", type=int, default=None, help="PNG compression level 0-9 of depth frames")
+    parser.add_argument("--no_per_frame_poses", dest="per_frame_poses", action="store_false",
+                        help="only write the consolidated poses.npz of each scene")
+    parser.add_argument("--cpu_threads_per_worker", type=int, default=1,
+                        help="torch threads per worker of the CPU backend (--device cpu or no GPU)")
     args = parser.parse_args()
-    config = ScanNetConfig(args.root_dir, args.save_dir, args.device, args.num_workers)
+    config = ScanNetConfig(args.root_dir, args.save_dir, args.device, args.num_workers, args.chunk_size,
+                           writer_threads=args.writer_threads, color_png_compression=args.color_png_compression,
+                           depth_png_compression=args.depth_png_compression, per_frame_poses=args.per_frame_poses,
+                           cpu_threads_per_worker=args.cpu_threads_per_worker)
     processor = ScanNetProcessor(config)
     processor.process_all_scenes_parallel()
         
\ No newline at end of file
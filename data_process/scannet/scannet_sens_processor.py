@@ -0,0 +1,219 @@
+from data_process.base_processor import POSES_FILE, DEFAULT_WRITER_THREADS
+from data_process.scannet.scannet_processor import ScanNetConfig, ScanNetProcessor
+from data_process.scannet.export_data.SensorData import SensorData
+from data_process.frame_writer import save_npz_atomic
+from concurrent.futures import ThreadPoolExecutor
+import os
+import numpy as np
+import cv2
+import time
+import torch
+from typing import Dict, List
+import argparse
+
+SHARDS_DIR = 'shards'  # packed output, one npz per chunk of frames
+
+
+class ScanNetSensConfig(ScanNetConfig):
+    def __init__(self, root_dir: str, save_dir: str, device: torch.device, num_workers: int = 16, chunk_size: int = 64,
+                 frame_skip: int = 10, output_format: str = 'frames', **kwargs):
+        super().__init__(root_dir, save_dir, device, num_workers, chunk_size, **kwargs)
+        # same subsampling as export.py
+        self.frame_skip = frame_skip
+        # 'frames': color/depth/pose layout of ScanNetProcessor, 'shards': packed npz shards
+        if output_format not in ('frames', 'shards'):
+            raise ValueError(f"Unknown output format {output_format}")
+        self.output_format = output_format
+
+
+class ScanNetSensProcessor(ScanNetProcessor):
+    """
+    Fused export and processing of ScanNet scenes
+    Frames are decoded straight from the .sens file through its frame index and go through the same
+    chunked resize/crop/validation as ScanNetProcessor, without the intermediate JPG/PNG/TXT extraction.
+    """
+    def __init__(self, config: ScanNetSensConfig = None):
+        self._sens = None
+        super().__init__(config)
+
+    def __getstate__(self):
+        # the memory map of the open scene is not picklable, workers reopen it
+        state = self.__dict__.copy()
+        state['_sens'] = None
+        return state
+
+    def get_all_scene_paths(self) -> List[str]:
+        scans_dir = os.path.join(self.config.root_dir, 'scans')
+        return [os.path.join(scans_dir, scene_name) for scene_name in sorted(os.listdir(scans_dir))
+                if os.path.isfile(os.path.join(scans_dir, scene_name, scene_name + '.sens'))]
+
+    def get_sensor_data(self, scene_path: str) -> SensorData:
+        """
+        Indexed SensorData of the scene, kept open while the scene is processed
+        """
+        sens_path = os.path.join(scene_path, os.path.basename(scene_path) + '.sens')
+        if self._sens is None or self._sens[0] != sens_path:
+            self._close_sensor_data()
+            self._sens = (sens_path, SensorData(sens_path, indexed=True))
+        return self._sens[1]
+
+    def _close_sensor_data(self):
+        if self._sens is not None:
+            self._sens[1].frames.close()
+            self._sens = None
+
+    def get_all_frame_paths(self, scene_path: str) -> Dict[int, tuple]:
+        sd = self.get_sensor_data(scene_path)
+        return {frame: (scene_path, frame) for frame in sd.frames_to_export(self.config.frame_skip)}
+
+    def get_intrinsics(self, scene_path: str) -> torch.Tensor:
+        sd = self.get_sensor_data(scene_path)
+        intrinsic = torch.from_numpy(sd.intrinsic_depth.copy()).float().to(self.config.device)
+        return intrinsic[:3, :3]
+
+    def load_single_frame(self, frame_path: tuple) -> dict:
+        """
+        Decode one frame from the .sens file
+        input:
+            frame_path: Tuple of (scene_path, frame_idx)
+        return:
+            dict: Frame data including depth, color (BGR, resized to the depth resolution) and pose data
+        """
+        scene_path, frame = frame_path
+        sd = self.get_sensor_data(scene_path)
+        frame_data = sd.frames[frame]
+        depth_data = np.frombuffer(frame_data.decompress_depth(sd.depth_compression_type), dtype=np.uint16)
+        depth_data = depth_data.reshape(sd.depth_height, sd.depth_width)
+        color_data = cv2.imdecode(np.frombuffer(frame_data.color_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        # the extracted dataset stores color at the depth resolution, matching intrinsic_depth
+        if color_data.shape[:2] != depth_data.shape:
+            color_data = cv2.resize(color_data, (sd.depth_width, sd.depth_height), interpolation=cv2.INTER_NEAREST)
+
+        return {
+            'depth_data': torch.from_numpy(depth_data.astype(np.float32)).to(self.config.device),
+            'color_data': torch.from_numpy(color_data.astype(np.float32)).to(self.config.device),
+            'pose_data': torch.from_numpy(frame_data.camera_to_world.copy()).float().to(self.config.device)
+        }
+
+    def process_single_scene(self, scene_path: str) -> dict:
+        try:
+            if self.config.output_format == 'shards':
+                return self._process_scene_to_shards(scene_path)
+            return super().process_single_scene(scene_path)
+        finally:
+            self._close_sensor_data()
+
+    def _process_scene_to_shards(self, scene_path: str) -> bool:
+        """
+        Write every chunk of the scene as one shard npz holding the PNG encoded frames
+        Shard layout:
+            frame_ids: (n,) frame names, consistent with the frames layout
+            color, depth: concatenated PNG bytes, frame i is color[color_offsets[i]:color_offsets[i+1]]
+            color_offsets, depth_offsets: (n+1,) int64
+            camera_poses: (n, 4, 4), camera_intrinsics: (3, 3)
+        """
+        start_time = time.time()
+        scene_save_path = None
+        frame_idx = 0
+        frame_ids, poses = [], []
+        color_params = [] if self.config.color_png_compression is None else [cv2.IMWRITE_PNG_COMPRESSION, self.config.color_png_compression]
+        depth_params = [] if self.config.depth_png_compression is None else [cv2.IMWRITE_PNG_COMPRESSION, self.config.depth_png_compression]
+
+        def encode(image, params):
+            ok, buf = cv2.imencode('.png', image, params)
+            if not ok:
+                raise IOError("Failed to encode frame")
+            return buf
+
+        with ThreadPoolExecutor(max_workers=max(1, self.config.writer_threads or DEFAULT_WRITER_THREADS)) as executor:
+            for shard_idx, chunk in enumerate(self.iter_scene_chunks(scene_path)):
+                if scene_save_path is None:
+                    scene_save_path = os.path.join(self.config.save_dir, chunk['scene_name'])
+                    shards_save_path = os.path.join(scene_save_path, SHARDS_DIR)
+                    os.makedirs(shards_save_path, exist_ok=True)
+                    intrinsics = chunk['intrinsics'].cpu().numpy()
+
+                color_data = chunk['color_data'].to(torch.uint8).permute(0, 2, 3, 1).contiguous().cpu().numpy()
+                depth_data = chunk['depth_data'].permute(0, 2, 3, 1).contiguous().cpu().numpy().astype(np.uint16)
+                pose_data = chunk['pose_data'].cpu().numpy()
+
+                color_png = list(executor.map(encode, color_data, [color_params] * len(color_data)))
+                depth_png = list(executor.map(encode, depth_data, [depth_params] * len(depth_data)))
+                shard_frame_ids = [f'{frame_idx + i:06d}' for i in range(len(pose_data))]
+                save_npz_atomic(os.path.join(shards_save_path, f'{shard_idx:06d}.npz'),
+                                frame_ids=np.array(shard_frame_ids),
+                                color=np.concatenate(color_png).ravel(),
+                                color_offsets=np.cumsum([0] + [len(buf) for buf in color_png], dtype=np.int64),
+                                depth=np.concatenate(depth_png).ravel(),
+                                depth_offsets=np.cumsum([0] + [len(buf) for buf in depth_png], dtype=np.int64),
+                                camera_poses=pose_data, camera_intrinsics=intrinsics)
+                frame_ids.extend(shard_frame_ids)
+                poses.extend(pose_data)
+                frame_idx += len(pose_data)
+
+        if scene_save_path is None:
+            return False
+        # All poses of the scene in one file, written last
+        save_npz_atomic(os.path.join(scene_save_path, POSES_FILE),
+                        frame_ids=np.array(frame_ids), camera_poses=np.stack(poses), camera_intrinsics=intrinsics)
+        elapsed = time.time() - start_time
+        print(f"Processed {frame_idx} frames of {os.path.basename(scene_save_path)} into shards in {elapsed:.1f}s "
+              f"({frame_idx / max(elapsed, 1e-6):.1f} frames/s, chunk size {self.config.chunk_size})")
+        return True
+
+    def is_scene_processed(self, scene_save_path):
+        if self.config.output_format == 'shards':
+            # poses.npz is written after the last shard
+            shards_path = os.path.join(scene_save_path, SHARDS_DIR)
+            return (os.path.isfile(os.path.join(scene_save_path, POSES_FILE)) and os.path.isdir(shards_path)
+                    and any(f.endswith('.npz') for f in os.listdir(shards_path)))
+        return super().is_scene_processed(scene_save_path)
+
+
+def load_shard(shard_path: str) -> dict:
+    """
+    Decode a shard written by ScanNetSensProcessor
+    Returns:
+        dict: frame_ids (n,), color (n, h, w, 3) uint8 BGR, depth (n, h, w) uint16, camera_poses (n, 4, 4),
+              camera_intrinsics (3, 3)
+    """
+    with np.load(shard_path) as data:
+        color, color_offsets = data['color'], data['color_offsets']
+        depth, depth_offsets = data['depth'], data['depth_offsets']
+        return {
+            'frame_ids': data['frame_ids'],
+            'color': np.stack([cv2.imdecode(color[color_offsets[i]:color_offsets[i + 1]], cv2.IMREAD_COLOR)
+                               for i in range(len(color_offsets) - 1)]),
+            'depth': np.stack([cv2.imdecode(depth[depth_offsets[i]:depth_offsets[i + 1]], cv2.IMREAD_UNCHANGED)
+                               for i in range(len(depth_offsets) - 1)]),
+            'camera_poses': data['camera_poses'],
+            'camera_intrinsics': data['camera_intrinsics'],
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root_dir", type=str, default="data/scannet", help="ScanNet download with scans/<scene>/<scene>.sens")
+    parser.add_argument("--save_dir", type=str, default="data/scannet_processed")
+    parser.add_argument("--device", type=str, default="cuda")
+    parser.add_argument("--num_workers", type=int, default=8)
+    parser.add_argument("--chunk_size", type=int, default=64, help="frames processed at once per worker")
+    parser.add_argument("--frame_skip", type=int, default=10, help="process every nth frame of the .sens file")
+    parser.add_argument("--output_format", type=str, default="frames", choices=["frames", "shards"],
+                        help="color/depth/pose files, or packed npz shards of chunk_size frames")
+    parser.add_argument("--writer_threads", type=int, default=None,
+                        help="threads encoding and writing frames per worker (default: 8 on GPU, cores // workers on CPU)")
+    parser.add_argument("--color_png_compression", type=int, default=None, help="PNG compression level 0-9 of color frames")
+    parser.add_argument("--depth_png_compression", type=int, default=None, help="PNG compression level 0-9 of depth frames")
+    parser.add_argument("--no_per_frame_poses", dest="per_frame_poses", action="store_false",
+                        help="only write the consolidated poses.npz of each scene")
+    parser.add_argument("--cpu_threads_per_worker", type=int, default=1,
+                        help="torch threads per worker of the CPU backend (--device cpu or no GPU)")
+    args = parser.parse_args()
+    config = ScanNetSensConfig(args.root_dir, args.save_dir, args.device, args.num_workers, args.chunk_size,
+                               frame_skip=args.frame_skip, output_format=args.output_format,
+                               writer_threads=args.writer_threads, color_png_compression=args.color_png_compression,
+                               depth_png_compression=args.depth_png_compression, per_frame_poses=args.per_frame_poses,
+                               cpu_threads_per_worker=args.cpu_threads_per_worker)
+    processor = ScanNetSensProcessor(config)
+    processor.process_all_scenes_parallel()
@@ -15,6 +15,13 @@ if __name__ == '__main__':
     parser.add_argument('--resolution', type=int, default=256)
     parser.add_argument('--n_interp', type=int, default=90)
     parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--semantic_mode', type=str, default='feature', choices=['feature', 'logits'],
+                        help='feature: decode the 512-d feature map per frame, logits: rasterize per-Gaussian class logits')
+
+    parser.add_argument('--image_cache_dir', type=str, default=None,
+                        help='persistent cache of preprocessed input images, reused across runs')
+    parser.add_argument('--pose_mode', type=str, default='pairviewer', choices=['forward', 'pairviewer'],
+                        help='forward: cameras from the LSM pointmaps, pairviewer: extra dust3r inference and global aligner')
 
     args = parser.parse_args()
     
@@ -23,4 +30,5 @@ if __name__ == '__main__':
     model.eval()
 
     # 2. render video
-    render_video_from_file(args.file_list, model, args.output_path, resolution=args.resolution, n_interp=args.n_interp, fps=args.fps)
\ No newline at end of file
+    render_video_from_file(args.file_list, model, args.output_path, resolution=args.resolution, n_interp=args.n_interp, fps=args.fps,
+                           semantic_mode=args.semantic_mode, image_cache_dir=args.image_cache_dir, pose_mode=args.pose_mode)
\ No newline at end of file
@@ -0,0 +1,168 @@
+import os
+import os.path as osp
+import json
+import numpy as np
+
+SCENE_PAIRS_FILE = 'scene_data.npz'  # written per scene by datasets_preprocess
+PAIR_INDEX_PREFIX = 'pair_index'
+PAIR_SOURCES = ('gap', 'iou')  # pair_source of the datasets: fixed index-gap pairs or the IoU pairs below
+PAIR_DTYPE = np.dtype([('scene', np.int32), ('idx1', np.int32), ('idx2', np.int32), ('iou', np.float32)])
+
+
+def build_pair_index(root, scene_names=None, index_prefix=None):
+    """
+    Merge the per-scene IoU pairs written by datasets_preprocess into a single index
+    Args:
+        root: dataset root containing one folder per scene
+        scene_names: scenes to include, defaults to every scene with a pairs file
+        index_prefix: output path prefix, defaults to root/pair_index
+    Returns:
+        str: the index prefix
+    Layout (files next to the scene folders, so scene listings are unaffected):
+        {prefix}_pairs.npy: (N,) PAIR_DTYPE, sorted by scene
+        {prefix}_pair_offsets.npy: (S+1,) int64, pairs of scene s are pairs[pair_offsets[s]:pair_offsets[s+1]]
+        {prefix}_images.npy: (M,) fixed width unicode image ids, concatenated over scenes
+        {prefix}_image_offsets.npy: (S+1,) int64, same convention as pair_offsets
+        {prefix}_meta.json: scene names and pair counts
+    """
+    index_prefix = index_prefix or osp.join(root, PAIR_INDEX_PREFIX)
+    if scene_names is None:
+        scene_names = [folder for folder in os.listdir(root)
+                       if osp.isfile(osp.join(root, folder, SCENE_PAIRS_FILE))]
+    scene_names = sorted(scene_names)
+
+    all_pairs, all_images = [], []
+    pair_offsets, image_offsets = [0], [0]
+    kept_scenes = []
+    for scene_name in scene_names:
+        scene_path = osp.join(root, scene_name, SCENE_PAIRS_FILE)
+        if not osp.isfile(scene_path):
+            print(f"No pairs file for scene {scene_name}, skipping")
+            continue
+        data = np.load(scene_path)
+        pairs = np.asarray(data['pairs'], dtype=np.float64).reshape(-1, 3)
+        images = np.asarray(data['images']).astype(str)
+
+        scene_pairs = np.empty(len(pairs), dtype=PAIR_DTYPE)
+        scene_pairs['scene'] = len(kept_scenes)
+        scene_pairs['idx1'] = pairs[:, 0]
+        scene_pairs['idx2'] = pairs[:, 1]
+        scene_pairs['iou'] = pairs[:, 2]
+
+        all_pairs.append(scene_pairs)
+        all_images.append(images)
+        pair_offsets.append(pair_offsets[-1] + len(scene_pairs))
+        image_offsets.append(image_offsets[-1] + len(images))
+        kept_scenes.append(scene_name)
+
+    if not kept_scenes:
+        # an empty index would be reused as is by every later run
+        raise ValueError(f"No {SCENE_PAIRS_FILE} found in the {len(scene_names)} scenes of {root}, "
+                         f"run large_spatial_model/datasets_preprocess on this root first")
+    pairs = np.concatenate(all_pairs)
+    images = np.concatenate(all_images)
+    meta = {'scenes': kept_scenes, 'num_pairs': int(len(pairs)), 'num_images': int(len(images))}
+
+    # every file is written under a private name and renamed into place, meta last, so concurrent
+    # builders (e.g. one per DDP rank) never expose a partial index to readers
+    def publish(name, write):
+        tmp_path = f"{index_prefix}_{name}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, f"{index_prefix}_{name}")
+    publish('pairs.npy', lambda f: np.save(f, pairs))
+    publish('pair_offsets.npy', lambda f: np.save(f, np.asarray(pair_offsets, dtype=np.int64)))
+    publish('images.npy', lambda f: np.save(f, images))
+    publish('image_offsets.npy', lambda f: np.save(f, np.asarray(image_offsets, dtype=np.int64)))
+    publish('meta.json', lambda f: f.write(json.dumps(meta).encode('utf-8')))
+    print(f"Pair index with {len(pairs)} pairs over {len(kept_scenes)} scenes written to {index_prefix}_*")
+    return index_prefix
+
+
+class SceneImages:
+    """Read-only scene_name -> image ids mapping backed by the memory-mapped index"""
+    def __init__(self, scene_to_id, images, image_offsets):
+        self.scene_to_id = scene_to_id
+        self.images = images
+        self.image_offsets = image_offsets
+
+    def __getitem__(self, scene_name):
+        scene_id = self.scene_to_id[scene_name]
+        return self.images[self.image_offsets[scene_id]:self.image_offsets[scene_id + 1]]
+
+    def __contains__(self, scene_name):
+        return scene_name in self.scene_to_id
+
+    def __len__(self):
+        return len(self.scene_to_id)
+
+
+class PairIndex:
+    """
+    Memory-mapped view of the merged IoU pair index
+    Indexing returns (scene_name, image_idx1, image_idx2) like the in-memory pair lists of the datasets,
+    without materializing millions of python tuples in every dataloader worker.
+    """
+    def __init__(self, root, scene_names=None, min_iou=0.0, index_prefix=None, rebuild=False):
+        index_prefix = index_prefix or osp.join(root, PAIR_INDEX_PREFIX)
+        if rebuild or not osp.isfile(f"{index_prefix}_meta.json"):
+            build_pair_index(root, index_prefix=index_prefix)
+        with open(f"{index_prefix}_meta.json", 'r') as f:
+            self.scenes = json.load(f)['scenes']
+        self.pairs = np.load(f"{index_prefix}_pairs.npy", mmap_mode='r')
+        self.images = np.load(f"{index_prefix}_images.npy", mmap_mode='r')
+        pair_offsets = np.load(f"{index_prefix}_pair_offsets.npy")
+        image_offsets = np.load(f"{index_prefix}_image_offsets.npy")
+
+        # restrict to the requested scenes (pairs of a scene are contiguous)
+        if scene_names is not None:
+            scene_names = set(scene_names)
+            missing = scene_names.difference(self.scenes)
+            if missing:
+                print(f"{len(missing)} scenes have no precomputed pairs and are ignored")
+        selected = [i for i, name in enumerate(self.scenes) if scene_names is None or name in scene_names]
+        ranges = [np.arange(pair_offsets[i], pair_offsets[i + 1]) for i in selected]
+        self.pair_ids = np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+        if min_iou > 0:
+            self.pair_ids = self.pair_ids[self.pairs['iou'][self.pair_ids] >= min_iou]
+        if len(self.pair_ids) == 0:
+            requested = len(self.scenes) if scene_names is None else len(scene_names)
+            raise ValueError(f"No precomputed pairs (min_iou={min_iou}) for the {requested} requested scenes of {root} "
+                             f"({len(selected)} of them have a {SCENE_PAIRS_FILE}), run datasets_preprocess on this root "
+                             f"or delete {index_prefix}_* if it is stale")
+
+        self.scene_images = SceneImages({self.scenes[i]: i for i in selected}, self.images, image_offsets)
+        self._iou_cdf = None
+
+    def __len__(self):
+        return len(self.pair_ids)
+
+    def __getitem__(self, idx):
+        pair = self.pairs[self.pair_ids[idx]]
+        return self.scenes[pair['scene']], int(pair['idx1']), int(pair['idx2'])
+
+    def get_iou(self, idx):
+        return float(self.pairs['iou'][self.pair_ids[idx]])
+
+    def sample(self, rng):
+        """
+        Draw a pair index with probability proportional to its IoU
+        """
+        if self._iou_cdf is None:
+            self._iou_cdf = np.cumsum(self.pairs['iou'][self.pair_ids], dtype=np.float64)
+        return int(np.searchsorted(self._iou_cdf, rng.random() * self._iou_cdf[-1], side='right'))
+
+
+def load_iou_pairs(root, scene_names, min_iou=0.0):
+    """
+    Pairs and image ids of a dataset with pair_source='iou', served from the merged memory-mapped index
+    Args:
+        root: dataset root containing one folder per scene
+        scene_names: scenes of the dataset split
+        min_iou: drop the pairs with a lower IoU
+    Returns:
+        pairs: PairIndex, indexed like the (scene_name, image_idx1, image_idx2) pair lists of the datasets
+        images: scene_name -> image ids
+    """
+    pairs = PairIndex(root, scene_names, min_iou=min_iou)
+    return pairs, pairs.scene_images
@@ -5,10 +5,15 @@ import numpy as np
 import cv2
 from dust3r.utils.image import imread_cv2
 import itertools
+from large_spatial_model.datasets.pair_index import PAIR_SOURCES, load_iou_pairs
 
 class Scannet(BaseStereoViewDataset):
-    def __init__(self, *args, ROOT, **kwargs):
+    def __init__(self, *args, ROOT, pair_source='gap', min_iou=0.0, iou_weighted=False, **kwargs):
         self.ROOT = ROOT
+        assert pair_source in PAIR_SOURCES
+        self.pair_source = pair_source
+        self.min_iou = min_iou
+        self.iou_weighted = iou_weighted and pair_source == 'iou'
         super().__init__(*args, **kwargs)
         self.num_views = 3 # render third view
         self._load_data()
@@ -21,6 +26,9 @@ class Scannet(BaseStereoViewDataset):
             scene_names = scene_names[:-150]
         else:
             scene_names = scene_names[-150:]
+        if self.pair_source == 'iou':
+            self.pairs, self.images = load_iou_pairs(self.ROOT, scene_names, self.min_iou)
+            return
         # merge all pairs and images
         pairs = [] # (scene_name, image_idx1, image_idx2)
         images = {} # scene_name -> list of image_paths
@@ -37,10 +45,29 @@ class Scannet(BaseStereoViewDataset):
         self.pairs = pairs
         self.images = images
         
+    def _load_scene_poses(self, scene_name):
+        # consolidated poses.npz written by data_process, cached per scene; None for per-frame pose files only
+        if not hasattr(self, '_scene_poses'):
+            self._scene_poses = {}
+        if scene_name not in self._scene_poses:
+            poses_path = osp.join(self.ROOT, scene_name, 'poses.npz')
+            scene_poses = None
+            if osp.isfile(poses_path):
+                with np.load(poses_path) as data:
+                    scene_poses = dict(
+                        camera_intrinsics=data['camera_intrinsics'],
+                        camera_poses=data['camera_poses'],
+                        frame_to_row={str(frame_id): row for row, frame_id in enumerate(data['frame_ids'])},
+                    )
+            self._scene_poses[scene_name] = scene_poses
+        return self._scene_poses[scene_name]
+
     def __len__(self):
         return len(self.pairs)
     
     def _get_views(self, idx, resolution, rng):
+        if self.iou_weighted:
+            idx = self.pairs.sample(rng)
         scene_name, image_idx1, image_idx2 = self.pairs[idx]
         image_idx1 = int(image_idx1)
         image_idx2 = int(image_idx2)
@@ -57,10 +84,15 @@ class Scannet(BaseStereoViewDataset):
             depthmap = depthmap.astype(np.float32) / 1000
             depthmap[~np.isfinite(depthmap)] = 0  # invalid
             # Load camera parameters
-            meta_path = osp.join(self.ROOT, scene_name, 'pose', f'{basename}.npz')
-            meta = np.load(meta_path)
-            intrinsics = meta['camera_intrinsics']
-            camera_pose = meta['camera_pose']
+            scene_poses = self._load_scene_poses(scene_name)
+            if scene_poses is not None:
+                intrinsics = scene_poses['camera_intrinsics']
+                camera_pose = scene_poses['camera_poses'][scene_poses['frame_to_row'][basename]]
+            else:
+                meta_path = osp.join(self.ROOT, scene_name, 'pose', f'{basename}.npz')
+                meta = np.load(meta_path)
+                intrinsics = meta['camera_intrinsics']
+                camera_pose = meta['camera_pose']
             # crop if necessary
             rgb_image, depthmap, intrinsics = self._crop_resize_if_necessary(
                 rgb_image, depthmap, intrinsics, resolution, rng=rng, info=view_idx)
@@ -5,10 +5,15 @@ import numpy as np
 import cv2
 from dust3r.utils.image import imread_cv2
 import itertools
+from large_spatial_model.datasets.pair_index import PAIR_SOURCES, load_iou_pairs
 
 class Scannetpp(BaseStereoViewDataset):
-    def __init__(self, *args, ROOT, **kwargs):
+    def __init__(self, *args, ROOT, pair_source='gap', min_iou=0.0, iou_weighted=False, **kwargs):
         self.ROOT = ROOT
+        assert pair_source in PAIR_SOURCES
+        self.pair_source = pair_source
+        self.min_iou = min_iou
+        self.iou_weighted = iou_weighted and pair_source == 'iou'
         super().__init__(*args, **kwargs)
         assert self.split == 'train' # just for training
         self.num_views = 3 # render third view
@@ -20,6 +25,9 @@ class Scannetpp(BaseStereoViewDataset):
         scene_names = [folder for folder in os.listdir(self.ROOT) if os.path.isdir(os.path.join(self.ROOT, folder))]
         scene_names.sort()
 
+        if self.pair_source == 'iou':
+            self.pairs, self.images = load_iou_pairs(self.ROOT, scene_names, self.min_iou)
+            return
         # merge all pairs and images
         pairs = [] # (scene_name, image_idx1, image_idx2)
         images = {} # scene_name -> list of image_paths
@@ -43,6 +51,8 @@ class Scannetpp(BaseStereoViewDataset):
         return len(self.pairs)
     
     def _get_views(self, idx, resolution, rng):
+        if self.iou_weighted:
+            idx = self.pairs.sample(rng)
         scene_name, image_idx1, image_idx2 = self.pairs[idx]
         image_idx1 = int(image_idx1)
         image_idx2 = int(image_idx2)
@@ -1,209 +1,290 @@
 import os
+import os.path as osp
+import argparse
 import numpy as np
 import cv2
 import torch
-import torch.multiprocessing as mp
 
-def process_scene_on_gpu(gpu_id, scene_names, data_root, output_queue):
-    torch.cuda.set_device(gpu_id)
-    local_pairs = {}
-    local_images = {}
-
-    for scene_name in scene_names:
-        save_path = os.path.join(data_root, scene_name, "scene_data.npz")
-        if os.path.exists(save_path):
-            print(f"Scene {scene_name} already processed, skipping")
-            continue
-        pairs, images = process_scene(data_root, scene_name)
-        np.savez_compressed(save_path, pairs=pairs, images=images)
-
-    output_queue.put((local_pairs, local_images))
-
-def preprocess_scannet(data_root, threads_per_gpu=4):
-    scene_names = [folder for folder in os.listdir(data_root) if os.path.isdir(os.path.join(data_root, folder))]
-    num_gpus = torch.cuda.device_count()
-    total_threads = num_gpus * threads_per_gpu
-    
-    # Evenly distribute scenes across all threads
-    scenes_per_thread = [scene_names[i::total_threads] for i in range(total_threads)]
-    
-    output_queue = mp.Queue()
-    processes = []
-    
-    # Create multiple processes for each GPU
-    for gpu_id in range(num_gpus):
-        for thread_id in range(threads_per_gpu):
-            process_id = gpu_id * threads_per_gpu + thread_id
-            p = mp.Process(
-                target=process_scene_on_gpu, 
-                args=(gpu_id, scenes_per_thread[process_id], data_root, output_queue)
-            )
-            p.start()
-            processes.append(p)
-
-    # Collect results from all processes
-    all_pairs = {}
-    all_images = {}
-    for _ in range(total_threads):
-        local_pairs, local_images = output_queue.get()
-        all_pairs.update(local_pairs)
-        all_images.update(local_images)
-
-    # Wait for all processes to complete
-    for p in processes:
-        p.join()
-
-    # Save to npz file
-    np.savez_compressed(os.path.join(data_root, "scannet_image_pairs.npz"), **all_pairs)
-    np.savez_compressed(os.path.join(data_root, "scannet_images.npz"), **all_images)
-
-    # print the number of image pairs
-    # sum up the number of image pairs for all scenes
-    total_pairs = sum(len(pairs) for pairs in all_pairs.values())
-    print(f"Total number of image pairs: {total_pairs}")
-    return all_pairs, all_images
-
-def process_scene(data_root, scene_name):
-    pairs = []
-    images_dir = os.path.join(data_root, scene_name, "images")
-    images = [os.path.splitext(file)[0] for file in os.listdir(images_dir) if file.endswith(".jpg")]
-    images.sort()
-
-    # Check validity of c2w for each image
-    valid_images = []
-    for image in images:
-        _, c2w, _ = load_image(data_root, scene_name, image)
-        if is_valid_c2w(c2w):
-            valid_images.append(image)
-        else:
+from large_spatial_model.datasets_preprocess.scheduler import run_scene_jobs
+
+class SceneLayout:
+    """
+    Files of a processed scene, as read by the training dataset of the same layout.
+    The ids written to scene_data.npz are the image file names without extension.
+    Args:
+        image_dir, image_ext: frames are <scene>/<image_dir>/<id><image_ext>
+        depth_dir: 16-bit depth maps (depth * 1000), <scene>/<depth_dir>/<id>.png
+        camera_dir, pose_key, intrinsics_key: per-frame <scene>/<camera_dir>/<id>.npz with the camera-to-world
+            pose and the 3x3 intrinsics under these keys
+        poses_file: optional consolidated <scene>/<poses_file> (frame_ids, camera_poses, camera_intrinsics),
+            used instead of the per-frame files when present
+    """
+    def __init__(self, image_dir, image_ext, depth_dir, camera_dir, pose_key, intrinsics_key, poses_file=None):
+        self.image_dir = image_dir
+        self.image_ext = image_ext
+        self.depth_dir = depth_dir
+        self.camera_dir = camera_dir
+        self.pose_key = pose_key
+        self.intrinsics_key = intrinsics_key
+        self.poses_file = poses_file
+
+    def has_scene(self, data_root, scene_name):
+        return osp.isdir(osp.join(data_root, scene_name, self.image_dir))
+
+    def list_images(self, data_root, scene_name):
+        images_dir = osp.join(data_root, scene_name, self.image_dir)
+        return sorted(osp.splitext(file)[0] for file in os.listdir(images_dir) if file.endswith(self.image_ext))
+
+    def load_depth(self, data_root, scene_name, image_id):
+        depth_path = osp.join(data_root, scene_name, self.depth_dir, f"{image_id}.png")
+        depth = cv2.imread(depth_path, cv2.IMREAD_UNCHANGED)
+        if depth is None:
+            raise FileNotFoundError(f"Missing depth map {depth_path}")
+        return torch.from_numpy(depth.astype(np.float32) / 1000.0)
+
+    def load_cameras(self, data_root, scene_name, image_ids):
+        """
+        Returns:
+            c2w: (n, 4, 4) camera-to-world poses
+            K: (n, 3, 3) intrinsics
+        """
+        poses_path = osp.join(data_root, scene_name, self.poses_file) if self.poses_file else None
+        if poses_path is not None and osp.isfile(poses_path):
+            with np.load(poses_path) as data:
+                frame_to_row = {str(frame_id): row for row, frame_id in enumerate(data['frame_ids'])}
+                rows = [frame_to_row[image_id] for image_id in image_ids]
+                c2w = data['camera_poses'][rows]
+                K = np.broadcast_to(data['camera_intrinsics'], (len(rows), 3, 3))
+            return c2w.astype(np.float64), K.astype(np.float64)
+        c2w, K = [], []
+        for image_id in image_ids:
+            with np.load(osp.join(data_root, scene_name, self.camera_dir, f"{image_id}.npz")) as meta:
+                c2w.append(meta[self.pose_key])
+                K.append(meta[self.intrinsics_key])
+        return np.stack(c2w).astype(np.float64).reshape(-1, 4, 4), np.stack(K).astype(np.float64).reshape(-1, 3, 3)
+
+# layout written by data_process and read by datasets.Scannet
+SCANNET_LAYOUT = SceneLayout(image_dir='color', image_ext='.png', depth_dir='depth', camera_dir='pose',
+                             pose_key='camera_pose', intrinsics_key='camera_intrinsics', poses_file='poses.npz')
+
+def find_scenes(data_root, layout):
+    """
+    Scenes of data_root in the given layout, raises when there are none
+    """
+    scene_names = sorted(folder for folder in os.listdir(data_root) if layout.has_scene(data_root, folder))
+    if not scene_names:
+        raise ValueError(f"No scenes with a {layout.image_dir}/ folder found in {data_root}")
+    return scene_names
+
+def count_scene_images(data_root, scene_name, layout=SCANNET_LAYOUT):
+    images_dir = osp.join(data_root, scene_name, layout.image_dir)
+    return sum(1 for file in os.listdir(images_dir) if file.endswith(layout.image_ext))
+
+def preprocess_scannet(data_root, threads_per_gpu=4, cpu_workers=None, coarse_factor=None, force=False):
+    scene_names = find_scenes(data_root, SCANNET_LAYOUT)
+    # Scenes are dispatched dynamically to GPU and/or CPU workers, largest first
+    result = run_scene_jobs(data_root, scene_names, process_scene,
+                            process_kwargs={'coarse_factor': coarse_factor, 'layout': SCANNET_LAYOUT},
+                            workers_per_gpu=threads_per_gpu, cpu_workers=cpu_workers,
+                            cost_fn=lambda scene_name: count_scene_images(data_root, scene_name, SCANNET_LAYOUT), force=force)
+    return result
+
+def process_scene(data_root, scene_name, device=None, coarse_factor=None, layout=SCANNET_LAYOUT):
+    images = layout.list_images(data_root, scene_name)
+    if not images:
+        raise ValueError(f"No {layout.image_ext} images in {osp.join(data_root, scene_name, layout.image_dir)}")
+
+    # Check validity of c2w for each image (only the metadata is needed here)
+    c2w, K = layout.load_cameras(data_root, scene_name, images)
+    valid = np.array([is_valid_c2w(pose) for pose in c2w], dtype=bool)
+    for image, ok in zip(images, valid):
+        if not ok:
             print(f"Invalid c2w for image {image} in scene {scene_name}")
+    valid_images = [image for image, ok in zip(images, valid) if ok]
 
     # generate image pairs
     slide_window = 50
     num_sub_intervals = 5
     
-    pairs = generate_image_pairs(data_root, scene_name, valid_images, slide_window, num_sub_intervals)
+    pairs = generate_image_pairs(data_root, scene_name, valid_images, slide_window, num_sub_intervals,
+                                 device=device, coarse_factor=coarse_factor, layout=layout,
+                                 cameras=(c2w[valid], K[valid]))
     print(f"Scene {scene_name} has {len(pairs)} image pairs and {len(valid_images)} valid images out of {len(images)} total images")
     return pairs, valid_images
 
 def is_valid_c2w(c2w):
     return not np.any(np.isinf(c2w)) and not np.any(np.isnan(c2w))
 
-def generate_image_pairs(data_root, scene_name, images, slide_window, num_sub_intervals=3):
+def generate_image_pairs(data_root, scene_name, images, slide_window, num_sub_intervals=3,
+                         device=None, pair_batch_size=32, coarse_factor=None, coarse_margin=0.1,
+                         layout=SCANNET_LAYOUT, cameras=None):
+    """
+    Select overlap-stratified image pairs inside a sliding window
+    Every frame is read once. Overlaps of all candidate pairs (i, j), i < j < i + slide_window, are computed
+    in batches on `device`, then pairs are selected in the same (i, j) order as a sequential scan.
+    Args:
+        coarse_factor: if set, first estimate the IoUs on depth maps subsampled by this factor and only
+            recompute at full resolution the pairs whose estimate lies within coarse_margin of the IoU band
+        layout: SceneLayout the frames are read with
+        cameras: optional (c2w, K) of images, already loaded by the caller
+    """
     pairs = []
     n = len(images)
+    if n < 2:
+        return pairs
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
     
     # Define IOU sub-intervals
     iou_range = (0.3, 0.8)
     sub_interval_size = (iou_range[1] - iou_range[0]) / num_sub_intervals
     sub_intervals = [(iou_range[0] + i * sub_interval_size, iou_range[0] + (i + 1) * sub_interval_size) 
                      for i in range(num_sub_intervals)]
-    
-    for i in range(n):
-        # Keep track of whether a pair has been added for each sub-interval
-        interval_selected = [False] * num_sub_intervals
+
+    # Cameras of the whole scene, inverted once
+    if cameras is None:
+        cameras = layout.load_cameras(data_root, scene_name, images)
+    c2w = torch.from_numpy(np.asarray(cameras[0])).float().to(device)
+    K = torch.from_numpy(np.asarray(cameras[1])).float().to(device)
+    K_inv = torch.linalg.inv(K)
+    R_inv, info = torch.linalg.inv_ex(c2w[:, :3, :3])
+    w2c = torch.eye(4, device=device).repeat(n, 1, 1)
+    w2c[:, :3, :3] = R_inv
+    w2c[:, :3, 3:4] = -R_inv @ c2w[:, :3, 3:4]
+    w2c[info != 0] = float('nan')  # singular rotation, any overlap into this frame is 0
+
+    # Candidate pairs in the order of the sequential scan: i ascending, then j ascending,
+    # generated from the window offsets so only O(n * slide_window) pairs are allocated
+    offsets = np.arange(1, slide_window)
+    ii = np.repeat(np.arange(n), len(offsets))
+    jj = ii + np.tile(offsets, n)
+    in_scene = jj < n
+    ii, jj = ii[in_scene], jj[in_scene]
+    ious = np.zeros(len(ii), dtype=np.float64)
+
+    # Walk over blocks of source frames, keeping only the depth maps of the block and its window resident
+    depth_cache = {}
+    pixels = {}
+    for block_start in range(0, n, slide_window):
+        block_end = min(block_start + slide_window, n)
+        frame_end = min(block_end + slide_window, n)
+        for k in list(depth_cache):
+            if k < block_start:
+                del depth_cache[k]
+        for k in range(block_start, frame_end):
+            if k not in depth_cache:
+                depth_cache[k] = layout.load_depth(data_root, scene_name, images[k]).to(device)
+        depths = torch.stack([depth_cache[k] for k in range(block_start, frame_end)])
+
+        # ii is sorted, the pairs of the block are contiguous
+        pair_start, pair_end = np.searchsorted(ii, [block_start, block_end])
+        pair_ids = np.arange(pair_start, pair_end)
+        src, tgt = ii[pair_ids] - block_start, jj[pair_ids] - block_start
+        frames = np.arange(block_start, frame_end)
+
+        if coarse_factor is not None and coarse_factor > 1:
+            scale = torch.tensor([1.0 / coarse_factor, 1.0 / coarse_factor, 1.0], device=device)
+            K_coarse = K[frames] * scale[:, None]
+            coarse_depths = depths[:, ::coarse_factor, ::coarse_factor]
+            coarse_ious = calculate_mean_iou(coarse_depths, c2w[frames], w2c[frames], K_coarse, torch.linalg.inv(K_coarse),
+                                             src, tgt, pixels, pair_batch_size * coarse_factor ** 2)
+            ious[pair_ids] = coarse_ious
+            # pairs far outside the band can never be selected, skip their full resolution pass
+            refine = (coarse_ious >= iou_range[0] - coarse_margin) & (coarse_ious <= iou_range[1] + coarse_margin)
+            pair_ids, src, tgt = pair_ids[refine], src[refine], tgt[refine]
+
+        ious[pair_ids] = calculate_mean_iou(depths, c2w[frames], w2c[frames], K[frames], K_inv[frames],
+                                            src, tgt, pixels, pair_batch_size)
+
+    # Select at most one pair per sub-interval for every source frame
+    interval_selected = None
+    current_i = -1
+    for i, j, mean_iou in zip(ii.tolist(), jj.tolist(), ious.tolist()):
+        if i != current_i:
+            # Keep track of whether a pair has been added for each sub-interval
+            interval_selected = [False] * num_sub_intervals
+            current_i = i
+        if all(interval_selected):
+            continue
         
-        for j in range(i+1, min(i + slide_window, n)):
-            # Break early if all sub-intervals have been selected
-            if all(interval_selected):
-                break
-            
-            # Load image pair
-            depth1, c2w1, K1 = load_image(data_root, scene_name, images[i])
-            depth2, c2w2, K2 = load_image(data_root, scene_name, images[j])
-            
-            # Calculate mean IoU
-            try:
-                iou_1 = calculate_iou(depth1, c2w1, K1, depth2, c2w2, K2)
-                iou_2 = calculate_iou(depth2, c2w2, K2, depth1, c2w1, K1)
-            except Exception as e:
-                print(f"Error calculating IoU for images {images[i]} and {images[j]} in scene {scene_name}: {str(e)}")
-                continue
-            
-            mean_iou = (iou_1 + iou_2) / 2
-            
-            # Check which sub-interval the mean IoU falls into
-            for idx, (lower, upper) in enumerate(sub_intervals):
-                if lower <= mean_iou <= upper and not interval_selected[idx]:
-                    pairs.append((i, j, mean_iou))
-                    interval_selected[idx] = True  # Mark this interval as selected
-                    break  # Move to the next pair after adding one in the current sub-interval
+        # Check which sub-interval the mean IoU falls into
+        for idx, (lower, upper) in enumerate(sub_intervals):
+            if lower <= mean_iou <= upper and not interval_selected[idx]:
+                pairs.append((i, j, mean_iou))
+                interval_selected[idx] = True  # Mark this interval as selected
+                break  # Move to the next pair after adding one in the current sub-interval
 
     return pairs
 
 
-def load_image(data_root, scene_name, image_id):
-    # load depthmap
-    depth_path = f"{data_root}/{scene_name}/depths/{image_id}.png"
-    depth = cv2.imread(depth_path, cv2.IMREAD_UNCHANGED).astype(np.float32) / 1000.0
-    # load camera parameters
-    meta_path = f"{data_root}/{scene_name}/images/{image_id}.npz"
-    meta = np.load(meta_path)
-    c2w = meta['camera_pose']
-    K = meta['camera_intrinsics']
-    return depth, c2w, K
-
-# Unproject depthmap to point cloud and project to another camera
-def calculate_iou(depth1, c2w1, K1, depth2, c2w2, K2):
-    # Move data to GPU and ensure float32 dtype
-    depth1 = torch.from_numpy(depth1).cuda().float()
-    depth2 = torch.from_numpy(depth2).cuda().float()
-    c2w1 = torch.from_numpy(c2w1).cuda().float()
-    c2w2 = torch.from_numpy(c2w2).cuda().float()
-    K1 = torch.from_numpy(K1).cuda().float()
-    K2 = torch.from_numpy(K2).cuda().float()
-
-    # Get image dimensions
-    h, w = depth1.shape
-
-    # Create pixel coordinates
-    y, x = torch.meshgrid(torch.arange(h, device='cuda', dtype=torch.float32),
-                            torch.arange(w, device='cuda', dtype=torch.float32))
-    pixels = torch.stack((x.flatten(), y.flatten(), torch.ones_like(x.flatten())), dim=-1).T
-
-    # Unproject pixels to 3D points
-    pixels_3d = torch.linalg.inv(K1) @ pixels
-    pixels_3d *= depth1.flatten().unsqueeze(0)
-
-    # Transform 3D points to world coordinates
-    pixels_world = c2w1[:3, :3] @ pixels_3d + c2w1[:3, 3:4]
-
-    # Check if c2w2[:3, :3] is invertible
-    if torch.det(c2w2[:3, :3]) == 0:
-        return 0, False  # Calculation failed
-
-    # Project world points to second camera
-    pixels_cam2 = torch.linalg.inv(c2w2[:3, :3]) @ (pixels_world - c2w2[:3, 3:4])
-    pixels_img2 = K2 @ pixels_cam2
+def calculate_mean_iou(depths, c2w, w2c, K, K_inv, src, tgt, pixels, batch_size):
+    """
+    Symmetric overlap (iou(src->tgt) + iou(tgt->src)) / 2 for index arrays src, tgt into depths
+    """
+    ious = np.zeros(len(src), dtype=np.float64)
+    if len(src) == 0:
+        return ious
+    src = torch.from_numpy(src).to(depths.device)
+    tgt = torch.from_numpy(tgt).to(depths.device)
+    half = max(1, batch_size // 2)
+    results = []
+    for start in range(0, len(src), half):
+        s, t = src[start:start + half], tgt[start:start + half]
+        iou = calculate_iou(depths, c2w, w2c, K, K_inv, torch.cat([s, t]), torch.cat([t, s]), pixels)
+        results.append((iou[:len(s)] + iou[len(s):]) / 2)
+    # single device sync for the whole block
+    ious[:] = torch.cat(results).cpu().numpy()
+    return ious
+
+# Unproject depthmaps to point clouds and project them to other cameras, for a batch of (src, tgt) frame pairs
+def calculate_iou(depths, c2w, w2c, K, K_inv, src, tgt, pixels, depth_threshold=0.1):
+    b = len(src)
+    h, w = depths.shape[-2:]
+
+    # Pixel coordinates are shared by all pairs of the same resolution
+    key = (h, w)
+    if key not in pixels:
+        y, x = torch.meshgrid(torch.arange(h, device=depths.device, dtype=torch.float32),
+                              torch.arange(w, device=depths.device, dtype=torch.float32), indexing='ij')
+        pixels[key] = torch.stack((x.flatten(), y.flatten(), torch.ones_like(x.flatten())), dim=0)
+    grid = pixels[key]
+
+    depth_src = depths[src].reshape(b, 1, h * w)
+    depth_tgt = depths[tgt].reshape(b, h * w)
+
+    # Unproject pixels to 3D points in the source camera
+    points = (K_inv[src] @ grid) * depth_src
+
+    # Transform 3D points to world coordinates, then to the target camera
+    points = c2w[src, :3, :3] @ points + c2w[src, :3, 3:4]
+    points = w2c[tgt, :3, :3] @ (points - c2w[tgt, :3, 3:4])
+    pixels_img = K[tgt] @ points
 
     # Normalize homogeneous coordinates
-    pixels_img2 = pixels_img2[:2] / pixels_img2[2]
-    pixels_img2 = pixels_img2.T
+    u = pixels_img[:, 0] / pixels_img[:, 2]
+    v = pixels_img[:, 1] / pixels_img[:, 2]
 
     # Filter valid pixels
-    valid_mask = (pixels_img2[:, 0] >= 0) & (pixels_img2[:, 0] < w) & \
-                    (pixels_img2[:, 1] >= 0) & (pixels_img2[:, 1] < h)
-    
-    pixels_img2 = pixels_img2[valid_mask].long()
+    valid_mask = (u >= 0) & (u < w) & (v >= 0) & (v < h)
+    u = torch.where(valid_mask, u, 0.0).long()
+    v = torch.where(valid_mask, v, 0.0).long()
 
     # Compare depths
-    projected_depth = pixels_cam2[2, valid_mask]
-    actual_depth = depth2[pixels_img2[:, 1], pixels_img2[:, 0]]
-
-    depth_diff = torch.abs(projected_depth - actual_depth)
-    depth_threshold = 0.1  # 10cm threshold
-
-    overlap_mask = depth_diff < depth_threshold
+    actual_depth = torch.gather(depth_tgt, 1, v * w + u)
+    overlap_mask = valid_mask & (torch.abs(points[:, 2] - actual_depth) < depth_threshold)
 
     # Calculate IoU
-    intersection = torch.sum(overlap_mask)
-    union = torch.sum(valid_mask) + torch.sum(depth2 > 0) - intersection
-
-    iou = intersection.float() / union.float() if union > 0 else torch.tensor(0.0, device='cuda')
-
-    return iou.item()
+    intersection = overlap_mask.sum(dim=1)
+    union = valid_mask.sum(dim=1) + (depth_tgt > 0).sum(dim=1) - intersection
+    return torch.where(union > 0, intersection.float() / union.clamp(min=1).float(), torch.zeros_like(union, dtype=torch.float32))
 
 if __name__ == "__main__":
-    data_root = "data/scannet_processed"
-    # Number of threads per GPU can be specified through parameters
-    preprocess_scannet(data_root, threads_per_gpu=12)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_root", type=str, default="data/scannet_processed")
+    parser.add_argument("--threads_per_gpu", type=int, default=12, help="worker processes per GPU")
+    parser.add_argument("--cpu_workers", type=int, default=None, help="CPU worker processes (default: all cores when no GPU is visible)")
+    parser.add_argument("--coarse_factor", type=int, default=None, help="depth subsampling factor of the coarse IoU pass")
+    parser.add_argument("--force", action="store_true", help="reprocess scenes that are already complete")
+    args = parser.parse_args()
+    preprocess_scannet(args.data_root, threads_per_gpu=args.threads_per_gpu, cpu_workers=args.cpu_workers,
+                       coarse_factor=args.coarse_factor, force=args.force)
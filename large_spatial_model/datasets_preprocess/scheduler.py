@@ -0,0 +1,154 @@
+import os
+import os.path as osp
+import json
+import time
+import queue
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import tqdm
+
+from large_spatial_model.datasets.pair_index import SCENE_PAIRS_FILE, build_pair_index
+
+DONE_MARKER = 'scene_data.done'  # written after scene_data.npz, marks a scene as complete
+
+
+def is_scene_done(data_root, scene_name):
+    return osp.isfile(osp.join(data_root, scene_name, DONE_MARKER))
+
+
+def save_scene_result(data_root, scene_name, pairs, images, stats):
+    """
+    Atomically write scene_data.npz, then the completion marker
+    A worker killed mid-scene leaves neither file behind, so the scene is simply redone on the next run.
+    """
+    scene_dir = osp.join(data_root, scene_name)
+    tmp_path = osp.join(scene_dir, f"scene_data.tmp{os.getpid()}.npz")
+    np.savez_compressed(tmp_path, pairs=pairs, images=images)
+    os.replace(tmp_path, osp.join(scene_dir, SCENE_PAIRS_FILE))
+
+    tmp_path = osp.join(scene_dir, f"{DONE_MARKER}.tmp{os.getpid()}")
+    with open(tmp_path, 'w') as f:
+        json.dump(stats, f)
+    os.replace(tmp_path, osp.join(scene_dir, DONE_MARKER))
+
+
+def _scene_worker(device, process_fn, process_kwargs, data_root, num_threads, task_queue, result_queue):
+    if device.startswith('cuda'):
+        torch.cuda.set_device(device)
+    torch.set_num_threads(num_threads)
+
+    while True:
+        scene_name = task_queue.get()
+        if scene_name is None:
+            break
+        start = time.time()
+        try:
+            pairs, images = process_fn(data_root, scene_name, device=device, **process_kwargs)
+            elapsed = time.time() - start
+            save_scene_result(data_root, scene_name, pairs, images,
+                              {'num_pairs': len(pairs), 'num_images': len(images), 'seconds': elapsed, 'device': device})
+            result_queue.put((scene_name, True, len(pairs), elapsed))
+        except Exception as e:
+            print(f"Error processing scene {scene_name} on {device}: {e}")
+            result_queue.put((scene_name, False, 0, time.time() - start))
+        finally:
+            if device.startswith('cuda'):
+                torch.cuda.empty_cache()
+
+
+def run_scene_jobs(data_root, scene_names, process_fn, process_kwargs=None, workers_per_gpu=4, cpu_workers=None,
+                   threads_per_cpu_worker=None, cost_fn=None, force=False, build_index=True):
+    """
+    Run process_fn over scenes with dynamic dispatch on GPU and CPU workers
+    Args:
+        data_root: dataset root, results are written to data_root/scene_name/scene_data.npz
+        scene_names: scenes to process
+        process_fn: picklable fn(data_root, scene_name, device=..., **process_kwargs) -> (pairs, images)
+        workers_per_gpu: worker processes per visible GPU
+        cpu_workers: CPU worker processes, defaults to 0 with GPUs and to all cores otherwise
+        threads_per_cpu_worker: torch intra-op threads of each CPU worker
+        cost_fn: optional fn(scene_name) -> cost, scenes are dispatched most expensive first to shorten the tail
+        force: reprocess scenes that already have a completion marker
+        build_index: merge all scene results into the global pair index at the end
+    Returns:
+        dict: counts of processed, skipped and failed scenes and the pair index prefix
+    """
+    if not scene_names:
+        raise ValueError(f"No scenes to process in {data_root}")
+    process_kwargs = process_kwargs or {}
+    todo = [scene for scene in scene_names if force or not is_scene_done(data_root, scene)]
+    skipped = len(scene_names) - len(todo)
+    if skipped:
+        print(f"Skipping {skipped} already processed scenes")
+    if cost_fn is not None:
+        todo.sort(key=cost_fn, reverse=True)
+
+    num_gpus = torch.cuda.device_count()
+    num_cores = os.cpu_count() or 1
+    if cpu_workers is None:
+        cpu_workers = 0 if num_gpus > 0 else max(1, num_cores // (threads_per_cpu_worker or 4))
+    threads_per_cpu_worker = threads_per_cpu_worker or max(1, num_cores // max(1, cpu_workers))
+    devices = [f"cuda:{gpu_id}" for gpu_id in range(num_gpus) for _ in range(workers_per_gpu)] + ['cpu'] * cpu_workers
+    if not devices:
+        raise RuntimeError("No workers configured, set workers_per_gpu or cpu_workers")
+
+    processed, failed, total_pairs = 0, [], 0
+    if todo:
+        print(f"Processing {len(todo)} scenes with {len(devices)} workers "
+              f"({num_gpus} GPUs x {workers_per_gpu}, {cpu_workers} CPU workers x {threads_per_cpu_worker} threads)")
+        ctx = mp.get_context('spawn')
+        task_queue = ctx.Queue()
+        result_queue = ctx.Queue()
+        # a single shared queue: every idle worker takes the next scene, so slow scenes never stall a static shard
+        for scene_name in todo:
+            task_queue.put(scene_name)
+        for _ in devices:
+            task_queue.put(None)
+
+        workers = []
+        for device in devices:
+            num_threads = threads_per_cpu_worker if device == 'cpu' else 1
+            p = ctx.Process(target=_scene_worker,
+                            args=(device, process_fn, process_kwargs, data_root, num_threads, task_queue, result_queue))
+            p.start()
+            workers.append(p)
+
+        start = time.time()
+        pbar = tqdm.tqdm(total=len(todo), desc="Scenes")
+        remaining = len(todo)
+        while remaining > 0:
+            try:
+                scene_name, ok, num_pairs, _ = result_queue.get(timeout=10)
+            except queue.Empty:
+                if not any(p.is_alive() for p in workers):
+                    print(f"All workers exited with {remaining} scenes unreported")
+                    break
+                continue
+            remaining -= 1
+            if ok:
+                processed += 1
+                total_pairs += num_pairs
+            else:
+                failed.append(scene_name)
+            pbar.update(1)
+            pbar.set_postfix(scenes_per_min=f"{(processed + len(failed)) / max(time.time() - start, 1e-6) * 60:.1f}",
+                             failed=len(failed))
+        pbar.close()
+        for p in workers:
+            p.join()
+
+        elapsed = time.time() - start
+        print(f"Processed {processed} scenes ({total_pairs} pairs) in {elapsed / 60:.1f} min, "
+              f"{processed / max(elapsed, 1e-6) * 60:.1f} scenes/min, {len(failed)} failed")
+        if failed:
+            print(f"Failed scenes: {failed}")
+
+    index_prefix = None
+    if build_index:
+        done_scenes = [scene for scene in scene_names if is_scene_done(data_root, scene)]
+        if not done_scenes:
+            raise RuntimeError(f"None of the {len(scene_names)} scenes of {data_root} was processed successfully")
+        index_prefix = build_pair_index(data_root, done_scenes)
+
+    return {'processed': processed, 'skipped': skipped, 'failed': failed, 'index_prefix': index_prefix}
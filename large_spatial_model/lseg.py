@@ -1,9 +1,10 @@
 import torch
 import torch.nn as nn
+from collections import OrderedDict
 from submodules.lang_seg.modules.models.lseg_net import LSegNet, clip
 
 class LSegFeatureExtractor(LSegNet):
-    def __init__(self, half_res=True):
+    def __init__(self, half_res=True, text_cache_size=16):
         super().__init__(
             labels='', 
             backbone='clip_vitl16_384', 
@@ -15,6 +16,9 @@ class LSegFeatureExtractor(LSegNet):
         )
 
         self.half_res = half_res
+        # normalized text embeddings, keyed by (labelset, device), least recently used first
+        self.text_cache_size = text_cache_size
+        self._text_cache = OrderedDict()
 
     @torch.no_grad()
     def extract_features(self, x):
@@ -79,20 +83,13 @@ class LSegFeatureExtractor(LSegNet):
         # image_features = self.scratch.head1(path_1)
         imshape = image_features.shape
         
-        # encode text
-        if labelset == '':
-            text = self.text
-        else:
-            text = clip.tokenize(labelset)
-        
+        # encode text (cached per labelset)
         self.logit_scale = self.logit_scale.to(image_features.device)
-        text = text.to(image_features.device)
-        text_features = self.clip_pretrained.encode_text(text)
+        text_features = self.get_text_features(labelset, image_features.device)
         image_features = image_features.permute(0,2,3,1).reshape(-1, self.out_c)
         
         # normalized features
         image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
         
         logits_per_image = self.logit_scale * image_features.half() @ text_features.t()
         out = logits_per_image.float().view(imshape[0], imshape[2], imshape[3], -1).permute(0,3,1,2)
@@ -107,6 +104,58 @@ class LSegFeatureExtractor(LSegNet):
             
         return out
 
+    @torch.no_grad()
+    def get_text_features(self, labelset='', device=None):
+        """
+        Normalized CLIP text embeddings of a labelset, encoded once and then served from the cache
+        Args:
+            labelset: list of labels, '' for the labels of the model
+            device: device of the embeddings (default: device of the model)
+        Returns:
+            text_features: (num_labels, 512)
+        """
+        device = torch.device(device) if device is not None else next(self.clip_pretrained.parameters()).device
+        key = (labelset if isinstance(labelset, str) else tuple(labelset), str(device))
+        if key in self._text_cache:
+            self._text_cache.move_to_end(key)
+            return self._text_cache[key]
+
+        if labelset == '':
+            text = self.text
+        else:
+            text = clip.tokenize(labelset)
+        text_features = self.clip_pretrained.encode_text(text.to(device))
+        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+
+        if self.text_cache_size > 0:
+            self._text_cache[key] = text_features
+            while len(self._text_cache) > self.text_cache_size:
+                self._text_cache.popitem(last=False)
+        return text_features
+
+    def precompute_text_features(self, labelsets, device=None):
+        """
+        Fill the text embedding cache for known vocabularies, e.g. before rendering a video
+        Args:
+            labelsets: list of labelsets
+            device: device the features will be decoded on
+        """
+        for labelset in labelsets:
+            self.get_text_features(labelset, device)
+
+    def clear_text_cache(self):
+        if hasattr(self, '_text_cache'):
+            self._text_cache.clear()
+
+    def _apply(self, fn, *args, **kwargs):
+        # cached embeddings belong to the old weights/device after .to(), .half(), ...
+        self.clear_text_cache()
+        return super()._apply(fn, *args, **kwargs)
+
+    def load_state_dict(self, *args, **kwargs):
+        self.clear_text_cache()
+        return super().load_state_dict(*args, **kwargs)
+
     @classmethod
     def from_pretrained(cls, pretrained_model_name_or_path, *args, **kwargs):
         print(f"Loading checkpoint from: {pretrained_model_name_or_path}")
@@ -72,6 +72,24 @@ class LSM_Dust3R(nn.Module):
         lseg_res_feature = self.feature_reduction(lseg_features)
         return lseg_token_feature, lseg_res_feature
 
+    @torch.no_grad()
+    def semantic_logit_head(self, labelset=''):
+        """
+        Fold feature_expansion (1x1 conv) and the LSeg text decoder into one linear map of the Gaussian features,
+        so class logits can be computed per Gaussian and rasterized as num_labels channels.
+        The per-pixel normalization of decode_feature is dropped, it does not change the argmax over classes.
+        Args:
+            labelset: list of labels, '' for the labels of LSeg
+        Returns:
+            weight (num_labels, d_gs_feats), bias (num_labels,)
+        """
+        conv = self.feature_expansion[1]
+        text_features = self.lseg_feature_extractor.get_text_features(labelset, conv.weight.device).float()
+        logit_scale = self.lseg_feature_extractor.logit_scale.to(conv.weight.device)
+        weight = logit_scale * text_features @ conv.weight[:, :, 0, 0]
+        bias = logit_scale * text_features @ conv.bias
+        return weight, bias
+
     @classmethod
     def from_pretrained(cls, checkpoint_path: str, use_pretrained_lseg: bool = True, use_pretrained_dust3r: bool = True, device: str = 'cuda'):
         ckpt = torch.load(checkpoint_path, map_location='cpu') # load checkpoint to cpu for saving memory
@@ -1,6 +1,9 @@
 import math
+import numpy as np
+import cv2
 import torch
 from dust3r.utils.geometry import inv
+from dust3r.post_process import estimate_focal_knowing_depth
 from .cuda_splatting import DummyCamera
 
 def get_scaled_camera(ref_camera_extrinsics, target_camera_extrinsics, target_camera_intrinsics, scale, image_shape):
@@ -24,37 +27,152 @@ def get_scaled_camera(ref_camera_extrinsics, target_camera_extrinsics, target_ca
     image_shape = image_shape.cpu().numpy()
     return DummyCamera(R, T, fovx, fovy, image_shape[1], image_shape[0])
 
-def move_c2w_along_z(extrinsics: torch.Tensor, distance: float) -> torch.Tensor:
+def move_c2w_along_z(extrinsics: torch.Tensor, distance) -> torch.Tensor:
     """
     Move multiple Camera-to-World (C2W) matrices backward, making cameras move away from origin along their respective Z axes.
 
     Args:
         extrinsics (torch.Tensor): Tensor of shape [N, 4, 4] containing N C2W matrices.
-        distance (float): Distance to move backward.
+        distance (float or sequence of V floats): Distance(s) to move backward.
 
     Returns:
-        torch.Tensor: Updated C2W matrices with same shape as input.
+        torch.Tensor: Updated C2W matrices, [N, 4, 4] for a single distance, [V, N, 4, 4] for a sequence.
     """
     # Ensure input is a 4D matrix with last dimension being 4x4
     assert extrinsics.dim() == 3 and extrinsics.shape[1:] == (4, 4), \
         "Input extrinsics must be a tensor of shape [N, 4, 4]"
 
-    # Create a copy to avoid modifying the original matrix
-    updated_extrinsics = extrinsics.clone()
+    distances = torch.as_tensor(distance, dtype=extrinsics.dtype, device=extrinsics.device)
+    updated_extrinsics = extrinsics.expand(*distances.shape, *extrinsics.shape).clone()
+    # t_new = t - distance * z_axis, the camera Z axis being the third column of R
+    updated_extrinsics[..., :3, 3] -= distances[..., None, None] * extrinsics[:, :3, 2]
 
-    # Iterate through each C2W matrix
-    for i in range(updated_extrinsics.shape[0]):
-        # Extract rotation matrix R and translation vector t
-        R = updated_extrinsics[i, :3, :3]  # shape [3, 3]
-        t = updated_extrinsics[i, :3, 3]   # shape [3]
+    return updated_extrinsics
+
+def _pixel_grid(H, W, device):
+    # (H, W, 2) pixel coordinates (x, y), as in the PairViewer of dust3r
+    y, x = torch.meshgrid(torch.arange(H, device=device, dtype=torch.float32),
+                          torch.arange(W, device=device, dtype=torch.float32), indexing='ij')
+    return torch.stack([x, y], dim=-1)
 
-        # Get camera's Z axis direction (third column)
-        z_axis = R[:, 2]  # shape [3]
 
-        # Calculate new translation vector, moving backward along Z axis
-        t_new = t - distance * z_axis
+def estimate_camera_dlt(pts3d, pixels, pp):
+    """
+    Focal length and world-to-camera pose of a pinhole camera (square pixels, principal point pp)
+    from 2D-3D correspondences: normalized DLT, then the rotation is projected onto SO(3) (orthogonal Procrustes)
+    Args:
+        pts3d: (B, N, 3) world points
+        pixels: (B, N, 2) their pixel coordinates
+        pp: (B, 2) principal points
+    Returns:
+        focal: (B,)
+        R: (B, 3, 3), t: (B, 3) world-to-camera
+    """
+    B, N, _ = pts3d.shape
+    pts3d = pts3d.double()
+    uv = pixels.double() - pp.double()[:, None]
+    # Hartley normalization of both point sets
+    center = pts3d.mean(dim=1, keepdim=True)
+    scale3d = (pts3d - center).norm(dim=-1).mean(dim=1).clamp(min=1e-8) / math.sqrt(3)
+    scale2d = uv.norm(dim=-1).mean(dim=1).clamp(min=1e-8) / math.sqrt(2)
+    X = torch.cat([(pts3d - center) / scale3d[:, None, None], pts3d.new_ones(B, N, 1)], dim=-1)
+    u, v = (uv / scale2d[:, None, None]).unbind(-1)
+    zeros = torch.zeros_like(X)
+    A = torch.cat([torch.cat([X, zeros, -u[..., None] * X], dim=-1),
+                   torch.cat([zeros, X, -v[..., None] * X], dim=-1)], dim=1)  # (B, 2N, 12)
+    # the solution is the eigenvector of the smallest eigenvalue of A^T A
+    P = torch.linalg.eigh(A.transpose(1, 2) @ A)[1][..., 0].reshape(B, 3, 4)
+    # undo the normalization: P = T2^-1 @ Pn @ T3
+    T3 = torch.eye(4, dtype=P.dtype, device=P.device).repeat(B, 1, 1)
+    T3[:, :3, :3] /= scale3d[:, None, None]
+    T3[:, :3, 3] = -center[:, 0] / scale3d[:, None]
+    P = P @ T3
+    P[:, :2] *= scale2d[:, None, None]
+
+    # P ~ diag(f, f, 1) [R | t]
+    M = P[:, :, :3]
+    scale = M[:, 2].norm(dim=-1)
+    focal = (M[:, 0].norm(dim=-1) + M[:, 1].norm(dim=-1)) / (2 * scale)
+    K_inv = torch.stack([1 / focal, 1 / focal, torch.ones_like(focal)], dim=-1)[..., None]
+    R = K_inv * M / scale[:, None, None]
+    t = K_inv[..., 0] * P[:, :, 3] / scale[:, None]
+    # the sign of P is arbitrary, keep the points in front of the camera
+    depth = (pts3d @ R[:, 2:].transpose(1, 2))[..., 0] + t[:, 2:]
+    sign = torch.where((depth > 0).double().mean(dim=1) >= 0.5, 1.0, -1.0).to(P.dtype)
+    R, t = R * sign[:, None, None], t * sign[:, None]
+    U, _, Vh = torch.linalg.svd(R)
+    D = torch.ones_like(R[:, 0])
+    D[:, 2] = torch.det(U @ Vh).sign()
+    R = U @ (D[..., None] * Vh)
+    return focal.float(), R.float(), t.float()
 
-        # Update translation part of C2W matrix
-        updated_extrinsics[i, :3, 3] = t_new
 
-    return updated_extrinsics
+@torch.no_grad()
+def estimate_pair_cameras(pred1, pred2, min_conf_thr=3, max_points=8192, use_pnp=True):
+    """
+    Cameras of an image pair from a single LSM_Dust3R forward, in place of a second symmetrized
+    dust3r inference and the PairViewer global aligner.
+    View 1 is the reference camera, its focal comes from its own pointmap (Weiszfeld).
+    View 2 only has points in the frame of view 1 (pts3d_in_other_view), so its focal and pose are solved
+    together with a DLT on the confident pixels, the pose is then refined with PnP-RANSAC like PairViewer does.
+    Args:
+        pred1: dict with pts3d (B, H, W, 3) and conf (B, H, W)
+        pred2: dict with pts3d_in_other_view (B, H, W, 3) and conf (B, H, W)
+        min_conf_thr: confidence threshold of the pixels used (the global_aligner default)
+        max_points: confident pixels sampled per view for the DLT
+    Returns:
+        extrinsics: (B, 2, 4, 4) camera-to-world
+        intrinsics: (B, 2, 3, 3)
+    """
+    pts1 = pred1['pts3d'].float()
+    pts2 = pred2['pts3d_in_other_view'].float()
+    conf2 = pred2['conf'].float()
+    B, H, W, _ = pts1.shape
+    device = pts1.device
+    pp = torch.tensor([W / 2, H / 2], device=device).expand(B, 2)
+    focal1 = estimate_focal_knowing_depth(pts1, pp, focal_mode='weiszfeld').view(B)
+
+    # same number of pixels for every batch item: a random subset of the confident ones,
+    # or the most confident ones when too few pass the threshold
+    pixels = _pixel_grid(H, W, device).view(-1, 2)
+    valid = conf2.view(B, -1) > min_conf_thr
+    num_valid = int(valid.sum(dim=1).min())
+    if num_valid >= 6:
+        generator = torch.Generator(device='cpu').manual_seed(0)
+        score = valid.float() + torch.rand(B, H * W, generator=generator).to(device)
+        num_points = min(max_points, num_valid)
+    else:
+        score = conf2.view(B, -1)
+        num_points = min(max_points, H * W)
+    select = torch.topk(score, num_points, dim=1).indices
+    focal2, R, t = estimate_camera_dlt(torch.gather(pts2.view(B, -1, 3), 1, select[..., None].expand(-1, -1, 3)),
+                                       pixels[select], pp)
+
+    w2c = torch.eye(4, device=device).repeat(B, 1, 1)
+    w2c[:, :3, :3] = R
+    w2c[:, :3, 3] = t
+    if use_pnp:
+        pixels_np = pixels.view(H, W, 2).cpu().numpy()
+        focal2_np = focal2.cpu().numpy()
+        for b in range(B):
+            msk = (conf2[b] > min_conf_thr).cpu().numpy()
+            if msk.sum() < 6:
+                continue
+            K = np.float32([(focal2_np[b], 0, W / 2), (0, focal2_np[b], H / 2), (0, 0, 1)])
+            try:
+                success, rvec, tvec, _ = cv2.solvePnPRansac(pts2[b].cpu().numpy()[msk], pixels_np[msk], K, None,
+                                                            iterationsCount=100, reprojectionError=5, flags=cv2.SOLVEPNP_SQPNP)
+            except cv2.error:
+                success = False
+            if success:
+                w2c[b, :3, :3] = torch.from_numpy(cv2.Rodrigues(rvec)[0]).float().to(device)
+                w2c[b, :3, 3] = torch.from_numpy(tvec[:, 0]).float().to(device)
+
+    extrinsics = torch.eye(4, device=device).repeat(B, 2, 1, 1)
+    extrinsics[:, 1] = inv(w2c)
+    intrinsics = torch.zeros(B, 2, 3, 3, device=device)
+    intrinsics[:, :, 0, 0] = intrinsics[:, :, 1, 1] = torch.stack([focal1, focal2], dim=1)
+    intrinsics[:, :, 0, 2] = W / 2
+    intrinsics[:, :, 1, 2] = H / 2
+    intrinsics[:, :, 2, 2] = 1
+    return extrinsics, intrinsics
@@ -43,12 +43,38 @@ def calculate_fov(output_width, output_height, focal_length, aspect_ratio=1.0, i
     
     return fovx, fovy
 
-def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
+def prepare_gaussians(pc : GaussianModel, pipe, scaling_modifier = 1.0, projection_weight = None):
+    """
+    View-independent rasterizer inputs of pc, computed once and shared by all the frames of a camera path.
+    
+    Args:
+        projection_weight: (C, d_feats) optional projection of the semantic features, see render_projected_features
+    
+    Returns:
+        dict passed as gaussian_inputs to render / render_projected_features
+    """
+    inputs = {'means3D': pc.get_xyz, 'opacities': pc.get_opacity, 'semantic_feature': pc.get_semantic_feature,
+              'scales': None, 'rotations': None, 'cov3D_precomp': None, 'shs': None}
+    if pipe.compute_cov3D_python:
+        inputs['cov3D_precomp'] = pc.get_covariance(scaling_modifier)
+    else:
+        inputs['scales'] = pc.get_scaling
+        inputs['rotations'] = pc.get_rotation
+    if not pipe.convert_SHs_python:
+        inputs['shs'] = pc.get_features
+    if projection_weight is not None:
+        inputs['projected_features'] = project_semantic_features(pc, projection_weight)
+    return inputs
+
+def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None, override_semantic_feature = None, gaussian_inputs = None):
     """
     Render the scene. 
     
     Background tensor (bg_color) must be on GPU!
+    gaussian_inputs: output of prepare_gaussians (same pipe and scaling_modifier), skips reading them from pc
     """
+    if gaussian_inputs is None:
+        gaussian_inputs = prepare_gaussians(pc, pipe, scaling_modifier)
  
     # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
     screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device="cuda") + 0
@@ -78,20 +104,15 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
 
     rasterizer = GaussianRasterizer(raster_settings=raster_settings)
 
-    means3D = pc.get_xyz
+    means3D = gaussian_inputs['means3D']
     means2D = screenspace_points
-    opacity = pc.get_opacity
+    opacity = gaussian_inputs['opacities']
 
     # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
     # scaling / rotation by the rasterizer.
-    scales = None
-    rotations = None
-    cov3D_precomp = None
-    if pipe.compute_cov3D_python:
-        cov3D_precomp = pc.get_covariance(scaling_modifier)
-    else:
-        scales = pc.get_scaling
-        rotations = pc.get_rotation
+    scales = gaussian_inputs['scales']
+    rotations = gaussian_inputs['rotations']
+    cov3D_precomp = gaussian_inputs['cov3D_precomp']
 
     # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
     # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
@@ -105,10 +126,10 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
             sh2rgb = eval_sh(pc.active_sh_degree, shs_view, dir_pp_normalized)
             colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
         else:
-            shs = pc.get_features
+            shs = gaussian_inputs['shs']
     else:
         colors_precomp = override_color
-    semantic_feature = pc.get_semantic_feature
+    semantic_feature = gaussian_inputs['semantic_feature'] if override_semantic_feature is None else override_semantic_feature
 
     # Rasterize visible Gaussians to image, obtain their radii (on screen). 
     rendered_image, feature_map, radii, depth = rasterizer(
@@ -129,4 +150,54 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
             "visibility_filter" : radii > 0,
             "radii": radii,
             'feature_map': feature_map,
-            "depth": depth} ###d
\ No newline at end of file
+            "depth": depth} ###d
+
+def project_semantic_features(pc : GaussianModel, weight : torch.Tensor):
+    """
+    Per-Gaussian projection of the semantic features, split into (N, 1, d_feats) zero padded chunks
+    
+    Returns:
+        list of (chunk, num_channels) pairs
+    """
+    semantic_feature = pc.get_semantic_feature
+    num_channels = semantic_feature.shape[-1]
+    projected = semantic_feature[:, 0] @ weight.t().to(semantic_feature.dtype) # (N, C)
+    
+    chunks = []
+    for start in range(0, projected.shape[1], num_channels):
+        chunk = projected[:, start:start + num_channels]
+        padded = torch.nn.functional.pad(chunk, (0, num_channels - chunk.shape[1]))[:, None].contiguous()
+        chunks.append((padded, chunk.shape[1]))
+    return chunks
+
+def render_projected_features(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, weight : torch.Tensor, bias = None, scaling_modifier = 1.0, gaussian_inputs = None):
+    """
+    Render a linear projection of the semantic features (e.g. class logits), applied per Gaussian before rasterization.
+    The rasterizer has a fixed number of feature channels (d_feats): projections are zero padded to it,
+    wider projections take several passes.
+    
+    Args:
+        weight: (C, d_feats) projection
+        bias: (C,) added to every pixel after rasterization
+        gaussian_inputs: output of prepare_gaussians, with the projection of weight precomputed
+    
+    Returns:
+        Output of render, with feature_map replaced by the (C, H, W) projected map
+    """
+    if gaussian_inputs is None or 'projected_features' not in gaussian_inputs:
+        gaussian_inputs = prepare_gaussians(pc, pipe, scaling_modifier, projection_weight=weight)
+    
+    output = None
+    feature_maps = []
+    for padded, num_channels in gaussian_inputs['projected_features']:
+        chunk_output = render(viewpoint_camera, pc, pipe, bg_color, scaling_modifier, override_semantic_feature=padded,
+                              gaussian_inputs=gaussian_inputs)
+        if output is None:
+            output = chunk_output
+        feature_maps.append(chunk_output['feature_map'][:num_channels])
+    
+    feature_map = torch.cat(feature_maps, dim=0)
+    if bias is not None:
+        feature_map = feature_map + bias[:, None, None].to(feature_map.dtype)
+    output['feature_map'] = feature_map
+    return output
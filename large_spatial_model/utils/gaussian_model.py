@@ -5,6 +5,7 @@ import numpy as np
 from plyfile import PlyData, PlyElement
 from os import makedirs, path
 from errno import EEXIST
+from .semantic_index import SemanticIndex
 
 def mkdir_p(folder_path):
     # Creates a directory. equivalent to using mkdir -p on the command line
@@ -138,6 +139,61 @@ class GaussianModel:
         gaussians._semantic_feature = pred['gs_feats'][:, None, :] # N, 1, d_feats
         return gaussians
 
+    @staticmethod
+    def load_ply(path, sh_degree=3):
+        """
+        Load a point cloud written by save_ply
+        """
+        vertex = PlyData.read(path)['vertex']
+        names = [p.name for p in vertex.properties]
+        def stack(columns):
+            if not columns:
+                return torch.zeros(len(vertex.data), 0)
+            return torch.from_numpy(np.stack([np.asarray(vertex[n]) for n in columns], axis=1).astype(np.float32))
+        def stack_prefix(prefix):
+            return stack(sorted([n for n in names if n.startswith(prefix)], key=lambda n: int(n.split('_')[-1])))
+        
+        gaussians = GaussianModel(sh_degree=sh_degree)
+        gaussians._xyz = stack(['x', 'y', 'z'])
+        f_dc = stack_prefix('f_dc_')
+        f_rest = stack_prefix('f_rest_')
+        # save_ply stores (N, d_sh, C) transposed and flattened
+        gaussians._features_dc = f_dc.view(len(f_dc), -1, 1).transpose(1, 2).contiguous()
+        gaussians._features_rest = f_rest.view(len(f_rest), f_dc.shape[1], -1).transpose(1, 2).contiguous()
+        gaussians._opacity = torch.sigmoid(torch.from_numpy(np.asarray(vertex['opacity']).astype(np.float32)))[:, None]
+        gaussians._scaling = torch.exp(stack_prefix('scale_'))
+        gaussians._rotation = stack_prefix('rot_')
+        gaussians._semantic_feature = stack_prefix('semantic_')[:, None, :]
+        return gaussians
+
+    @torch.no_grad()
+    def get_expanded_semantic_feature(self, feature_expansion):
+        """
+        Normalized 512-d LSeg features of every Gaussian, the 1x1 conv of feature_expansion applied per Gaussian
+        Returns:
+            (N, 512)
+        """
+        conv = feature_expansion[1]
+        features = self._semantic_feature[:, 0].to(conv.weight.device)
+        features = torch.nn.functional.linear(features, conv.weight[:, :, 0, 0], conv.bias)
+        return features / features.norm(dim=-1, keepdim=True)
+
+    @torch.no_grad()
+    def build_query_index(self, feature_expansion, min_opacity=0.0, scene_name='scene', **index_kwargs):
+        """
+        Open-vocabulary query index over the Gaussians of this scene
+        Args:
+            feature_expansion: feature_expansion of the LSM model
+            min_opacity: Gaussians below this opacity are not indexed
+            index_kwargs: IVF/PQ options of SemanticIndex.build
+        Returns:
+            SemanticIndex
+        """
+        gaussian_ids = (self._opacity[:, 0] >= min_opacity).nonzero()[:, 0]
+        features = self.get_expanded_semantic_feature(feature_expansion)[gaussian_ids.to(feature_expansion[1].weight.device)]
+        xyz = self._xyz[gaussian_ids].to(features.device)
+        return SemanticIndex.build(features, xyz, scene_name, gaussian_ids.to(features.device), **index_kwargs)
+
     def save_ply(self, path):
         mkdir_p(os.path.dirname(path))
 
@@ -0,0 +1,248 @@
+import numpy as np
+import torch
+
+# rows scored at once, bounds the memory of the (rows, queries) score blocks
+CHUNK_SIZE = 65536
+
+
+def _assign(x, centroids, spherical, chunk_size=CHUNK_SIZE):
+    """
+    Nearest centroid of every row, by inner product (spherical) or euclidean distance
+    """
+    assign = torch.empty(len(x), dtype=torch.long, device=x.device)
+    centroids_sq = (centroids.float() ** 2).sum(dim=1)
+    for start in range(0, len(x), chunk_size):
+        scores = x[start:start + chunk_size].float() @ centroids.float().t()
+        if not spherical:
+            scores = 2 * scores - centroids_sq
+        assign[start:start + chunk_size] = scores.argmax(dim=1)
+    return assign
+
+
+def kmeans(x, k, iters=20, spherical=False, seed=0):
+    """
+    Lloyd k-means in torch, on the device of x
+    Args:
+        x: (n, d) data
+        k: number of centroids
+        spherical: cluster unit vectors by cosine similarity, centroids are renormalized
+    Returns:
+        centroids: (k, d) float32
+    """
+    generator = torch.Generator(device='cpu').manual_seed(seed)
+    x = x.float()
+    k = min(k, len(x))
+    centroids = x[torch.randperm(len(x), generator=generator)[:k].to(x.device)].clone()
+    for _ in range(iters):
+        assign = _assign(x, centroids, spherical)
+        counts = torch.bincount(assign, minlength=k)
+        sums = torch.zeros_like(centroids).index_add_(0, assign, x)
+        centroids = sums / counts.clamp(min=1)[:, None].float()
+        # re-seed empty clusters with random points
+        empty = (counts == 0).nonzero()[:, 0]
+        if len(empty) > 0:
+            centroids[empty] = x[torch.randint(len(x), (len(empty),), generator=generator).to(x.device)]
+        if spherical:
+            centroids = torch.nn.functional.normalize(centroids, dim=1)
+    return centroids
+
+
+class SemanticIndex:
+    """
+    Open-vocabulary search over the normalized 512-d semantic features of Gaussians, of one or many scenes.
+    Scores are cosine similarities with CLIP text embeddings:
+    - exact: one matmul over all Gaussians
+    - IVF (nlist > 0): only the Gaussians of the nprobe lists closest to the query are scored
+    - PQ (pq_m > 0): features are stored as pq_m uint8 codes and scored with lookup tables,
+      the full features are dropped unless keep_features
+    Large collections are built with train() on a sample of features, then add() scene by scene.
+    """
+    def __init__(self, keep_features=True):
+        self.keep_features = keep_features
+        self.features = None # (N, 512) half, normalized
+        self.xyz = None # (N, 3)
+        self.scene_ids = None # (N,) scene of every Gaussian
+        self.gaussian_ids = None # (N,) index of every Gaussian within its scene
+        self.scene_names = []
+        self.ivf_centroids = None # (nlist, 512)
+        self.ivf_lists = None # (N,) list of every Gaussian
+        self.pq_codebooks = None # (pq_m, 256, 512 // pq_m)
+        self.pq_codes = None # (N, pq_m) uint8
+        self._ivf_order = None # rows sorted by list, rebuilt after add()
+        self._ivf_offsets = None
+
+    def __len__(self):
+        return 0 if self.xyz is None else len(self.xyz)
+
+    @property
+    def device(self):
+        return self.xyz.device
+
+    @classmethod
+    def train(cls, features, nlist=0, pq_m=0, keep_features=True, iters=20, seed=0):
+        """
+        Empty index with the IVF centroids and PQ codebooks trained on a sample of features
+        Args:
+            features: (n, d) normalized training features
+            nlist: number of IVF lists, 0 for exact search
+            pq_m: number of PQ sub-vectors (must divide d), 0 to keep float features only
+            keep_features: keep the full features next to the PQ codes (exact scores, more memory)
+        """
+        index = cls(keep_features=keep_features or pq_m == 0)
+        if nlist > 0:
+            index.ivf_centroids = kmeans(features, nlist, iters, spherical=True, seed=seed)
+        if pq_m > 0:
+            dim = features.shape[1]
+            if dim % pq_m != 0:
+                raise ValueError(f"pq_m={pq_m} must divide the feature dimension {dim}")
+            sub_dim = dim // pq_m
+            index.pq_codebooks = torch.stack([kmeans(features[:, m * sub_dim:(m + 1) * sub_dim], 256, iters, seed=seed + m)
+                                              for m in range(pq_m)])
+        return index
+
+    def add(self, features, xyz, scene_name='scene', gaussian_ids=None):
+        """
+        Add the Gaussians of one scene
+        Args:
+            features: (n, d) normalized semantic features
+            xyz: (n, 3) Gaussian centers
+            gaussian_ids: (n,) index of every Gaussian within its scene (default: arange)
+        """
+        device = features.device
+        columns = {
+            'xyz': xyz.float().to(device),
+            'scene_ids': torch.full((len(xyz),), len(self.scene_names), dtype=torch.int32, device=device),
+            'gaussian_ids': torch.arange(len(xyz), device=device) if gaussian_ids is None else gaussian_ids.long().to(device),
+        }
+        if self.keep_features:
+            columns['features'] = features.half()
+        if self.ivf_centroids is not None:
+            columns['ivf_lists'] = _assign(features, self.ivf_centroids.to(device), spherical=True)
+        if self.pq_codebooks is not None:
+            sub_dim = self.pq_codebooks.shape[2]
+            columns['pq_codes'] = torch.stack([_assign(features[:, m * sub_dim:(m + 1) * sub_dim], codebook.to(device), spherical=False)
+                                               for m, codebook in enumerate(self.pq_codebooks)], dim=1).to(torch.uint8)
+        for name, column in columns.items():
+            current = getattr(self, name)
+            setattr(self, name, column if current is None else torch.cat([current, column.to(current.device)]))
+        self.scene_names.append(scene_name)
+        self._ivf_order = None
+        return self
+
+    @classmethod
+    def build(cls, features, xyz, scene_name='scene', gaussian_ids=None, nlist=0, pq_m=0, keep_features=True,
+              train_size=262144, iters=20, seed=0):
+        """
+        Index of a single scene, train() on up to train_size of its features then add()
+        """
+        generator = torch.Generator(device='cpu').manual_seed(seed)
+        sample = features[torch.randperm(len(features), generator=generator)[:train_size].to(features.device)]
+        index = cls.train(sample, nlist, pq_m, keep_features, iters, seed)
+        return index.add(features, xyz, scene_name, gaussian_ids)
+
+    def _scores(self, text_features, rows=None):
+        """
+        Cosine similarities (n, Q) of the Gaussians in rows (default: all) with normalized text features (Q, d)
+        """
+        if self.features is not None:
+            features = self.features if rows is None else self.features[rows]
+            return torch.cat([features[start:start + CHUNK_SIZE].float() @ text_features.t()
+                              for start in range(0, len(features), CHUNK_SIZE)] or [text_features.new_zeros(0, len(text_features))])
+        # asymmetric distance: lookup table of every sub-vector centroid with every query
+        pq_m, _, sub_dim = self.pq_codebooks.shape
+        tables = torch.einsum('mcs,qms->mcq', self.pq_codebooks.to(text_features.device), text_features.view(len(text_features), pq_m, sub_dim))
+        codes = self.pq_codes if rows is None else self.pq_codes[rows]
+        scores = []
+        for start in range(0, len(codes), CHUNK_SIZE):
+            block = codes[start:start + CHUNK_SIZE].long()
+            scores.append(sum(tables[m][block[:, m]] for m in range(pq_m)))
+        return torch.cat(scores) if scores else text_features.new_zeros(0, len(text_features))
+
+    def _candidates(self, text_feature, nprobe):
+        if self._ivf_order is None:
+            self._ivf_order = torch.argsort(self.ivf_lists)
+            counts = torch.bincount(self.ivf_lists, minlength=len(self.ivf_centroids))
+            self._ivf_offsets = torch.cat([counts.new_zeros(1), torch.cumsum(counts, dim=0)]).tolist()
+        # rows of the lists closest to the query
+        lists = torch.topk(self.ivf_centroids.to(text_feature.device) @ text_feature, min(nprobe, len(self.ivf_centroids))).indices.tolist()
+        return torch.cat([self._ivf_order[self._ivf_offsets[l]:self._ivf_offsets[l + 1]] for l in lists])
+
+    @torch.no_grad()
+    def search(self, text_features, top_k=1000, threshold=None, nprobe=8):
+        """
+        Args:
+            text_features: (Q, d) normalized text embeddings
+            top_k: maximum number of matches per query, None for all matches above threshold
+            threshold: minimum cosine similarity
+            nprobe: IVF lists scored per query
+        Returns:
+            list of Q results, see group_matches
+        """
+        text_features = text_features.float().to(self.device)
+        results = []
+        for text_feature in text_features:
+            rows = self._candidates(text_feature, nprobe) if self.ivf_centroids is not None else None
+            scores = self._scores(text_feature[None], rows)[:, 0]
+            if rows is None:
+                rows = torch.arange(len(scores), device=scores.device)
+            if threshold is not None:
+                keep = scores >= threshold
+                rows, scores = rows[keep], scores[keep]
+            if top_k is not None and len(scores) > top_k:
+                scores, order = torch.topk(scores, top_k)
+                rows = rows[order]
+            else:
+                scores, order = torch.sort(scores, descending=True)
+                rows = rows[order]
+            results.append(self.group_matches(rows, scores))
+        return results
+
+    def group_matches(self, rows, scores):
+        """
+        Matches of one query, grouped by scene and best scene first
+        Returns:
+            list of dict: scene, score (best match), gaussian_ids, scores, xyz,
+            bbox (2, 3) axis-aligned min/max corners of the matched centers
+        """
+        matches = []
+        scene_ids = self.scene_ids[rows]
+        for scene_id in torch.unique(scene_ids).tolist():
+            mask = scene_ids == scene_id
+            xyz = self.xyz[rows[mask]]
+            matches.append({
+                'scene': self.scene_names[scene_id],
+                'score': scores[mask].max().item(),
+                'gaussian_ids': self.gaussian_ids[rows[mask]],
+                'scores': scores[mask],
+                'xyz': xyz,
+                'bbox': torch.stack([xyz.min(dim=0).values, xyz.max(dim=0).values]),
+            })
+        return sorted(matches, key=lambda match: match['score'], reverse=True)
+
+    def query(self, model, text, **kwargs):
+        """
+        Search with CLIP text queries, encoded by the LSeg text tower of an LSM_Dust3R model
+        Args:
+            text: query string or list of query strings
+        """
+        texts = [text] if isinstance(text, str) else list(text)
+        text_features = model.lseg_feature_extractor.get_text_features(texts, self.device)
+        results = self.search(text_features, **kwargs)
+        return results[0] if isinstance(text, str) else results
+
+    def save(self, path):
+        arrays = {'scene_names': np.array(self.scene_names), 'keep_features': self.keep_features}
+        for name in ['features', 'xyz', 'scene_ids', 'gaussian_ids', 'ivf_centroids', 'ivf_lists', 'pq_codebooks', 'pq_codes']:
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name).cpu().numpy()
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path, device='cpu'):
+        with np.load(path) as data:
+            index = cls(keep_features=bool(data['keep_features']))
+            index.scene_names = data['scene_names'].tolist()
+            for name in data.files:
+                if name not in ('scene_names', 'keep_features'):
+                    setattr(index, name, torch.from_numpy(data[name]).to(device))
+        return index
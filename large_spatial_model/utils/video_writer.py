@@ -0,0 +1,192 @@
+import os
+import time
+import queue
+import shutil
+import threading
+import subprocess
+import numpy as np
+import torch
+import cv2
+
+
+class VideoStream:
+    """
+    One output video encoded on its own thread
+    Frames are queued as (H, W, 3) RGB uint8 arrays, at most queue_size of them, write blocks beyond that.
+    ffmpeg backend: raw frames piped to ffmpeg (codec/crf/preset), opencv backend: cv2.VideoWriter with mp4v
+    """
+    def __init__(self, video_path, fps, backend='opencv', codec='libx264', crf=18, preset='veryfast',
+                 ffmpeg_path='ffmpeg', queue_size=32):
+        self.video_path = video_path
+        self.fps = fps
+        self.backend = backend
+        self.codec = codec
+        self.crf = crf
+        self.preset = preset
+        self.ffmpeg_path = ffmpeg_path
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.num_frames = 0
+        self.seconds = 0.0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _open(self, h, w):
+        if self.backend == 'ffmpeg':
+            cmd = [self.ffmpeg_path, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{w}x{h}', '-r', str(self.fps), '-i', '-',
+                   # yuv420p needs even sizes
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                   '-c:v', self.codec, '-crf', str(self.crf), '-preset', self.preset, '-pix_fmt', 'yuv420p',
+                   self.video_path]
+            return subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        return cv2.VideoWriter(self.video_path, fourcc, self.fps, (w, h))
+
+    def _run(self):
+        writer = None
+        try:
+            while True:
+                frame = self.queue.get()
+                if frame is None:
+                    break
+                if self.error is not None:
+                    continue  # drain the queue so producers never block
+                start = time.time()
+                if writer is None:
+                    writer = self._open(*frame.shape[:2])
+                if self.backend == 'ffmpeg':
+                    writer.stdin.write(np.ascontiguousarray(frame).tobytes())
+                else:
+                    # Convert RGB to BGR for OpenCV
+                    writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+                self.num_frames += 1
+                self.seconds += time.time() - start
+        except Exception as e:
+            self.error = e
+            if isinstance(e, BrokenPipeError) and writer is not None:
+                # ffmpeg exited, report its own message
+                stderr = writer.stderr.read().decode(errors='replace')
+                self.error = RuntimeError(f"ffmpeg failed on {self.video_path}: {stderr.strip()}")
+            # keep consuming until close
+            while self.queue.get() is not None:
+                pass
+        finally:
+            start = time.time()
+            if writer is not None:
+                if self.backend == 'ffmpeg':
+                    try:
+                        writer.stdin.close()
+                    except BrokenPipeError:
+                        pass
+                    stderr = writer.stderr.read().decode(errors='replace')
+                    if writer.wait() != 0 and self.error is None:
+                        self.error = RuntimeError(f"ffmpeg failed on {self.video_path}: {stderr.strip()}")
+                else:
+                    writer.release()
+            self.seconds += time.time() - start
+
+    def write(self, frame):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(frame)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class VideoWriterService:
+    """
+    Encode several output videos at once, one thread per stream
+    Frames can be written incrementally, as batches of (B, 3, H, W) tensors in [0, 1] or (B, H, W, 3) uint8 arrays.
+    backend 'auto' uses ffmpeg when it is installed and OpenCV otherwise.
+
+    Usage:
+        with VideoWriterService(video_dir, fps=30) as writer:
+            writer.write('images', rendered_images)
+            writer.write('depth', depth_vis)
+    """
+    def __init__(self, video_dir, fps=24, backend='auto', codec='libx264', crf=18, preset='veryfast',
+                 ffmpeg_path=None, queue_size=32, verbose=True):
+        self.video_dir = video_dir
+        self.fps = fps
+        self.ffmpeg_path = ffmpeg_path or shutil.which('ffmpeg')
+        if backend == 'auto':
+            backend = 'ffmpeg' if self.ffmpeg_path else 'opencv'
+        if backend == 'ffmpeg' and not self.ffmpeg_path:
+            raise RuntimeError("ffmpeg backend requested but ffmpeg was not found")
+        self.backend = backend
+        self.stream_options = dict(backend=backend, codec=codec, crf=crf, preset=preset,
+                                   ffmpeg_path=self.ffmpeg_path, queue_size=queue_size)
+        self.verbose = verbose
+        self.streams = {}
+        self.start_time = None
+        os.makedirs(video_dir, exist_ok=True)
+
+    def add_stream(self, name, filename=None):
+        """
+        Open the stream name, written to video_dir/filename (default: output_{name}_video.mp4)
+        """
+        filename = filename or f'output_{name}_video.mp4'
+        self.streams[name] = VideoStream(os.path.join(self.video_dir, filename), self.fps, **self.stream_options)
+        return self.streams[name]
+
+    @staticmethod
+    def to_uint8(frames):
+        """
+        (B, 3, H, W) float tensor in [0, 1] or (H, W, 3) / (B, H, W, 3) uint8 array -> list of (H, W, 3) uint8 arrays
+        """
+        if isinstance(frames, torch.Tensor):
+            # convert on the source device, one copy to the host per batch
+            frames = (frames.detach() * 255).to(torch.uint8).permute(0, 2, 3, 1).cpu().numpy()
+        frames = np.asarray(frames)
+        return [frames] if frames.ndim == 3 else list(frames)
+
+    def write(self, name, frames):
+        if self.start_time is None:
+            self.start_time = time.time()
+        stream = self.streams.get(name) or self.add_stream(name)
+        for frame in self.to_uint8(frames):
+            stream.write(frame)
+
+    def close(self):
+        """
+        Wait for all streams to finish encoding
+        Returns:
+            dict: name -> (num_frames, encoded fps of the stream)
+        """
+        errors = []
+        for stream in self.streams.values():
+            try:
+                stream.close()
+            except Exception as e:
+                errors.append(e)
+        report = {name: (stream.num_frames, stream.num_frames / max(stream.seconds, 1e-6))
+                  for name, stream in self.streams.items()}
+        if self.verbose and self.streams:
+            wall = time.time() - (self.start_time or time.time())
+            total_frames = sum(num_frames for num_frames, _ in report.values())
+            details = ', '.join(f'{name} {fps:.0f} fps' for name, (_, fps) in report.items())
+            print(f'Encoded {total_frames} frames of {len(self.streams)} streams ({self.backend}) in {wall:.1f}s, '
+                  f'{total_frames / max(wall, 1e-6):.0f} fps overall ({details})')
+        self.streams = {}
+        if errors:
+            raise errors[0]
+        return report
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't mask the original error with a secondary encoding failure
+            try:
+                self.close()
+            except Exception:
+                pass
+        return False
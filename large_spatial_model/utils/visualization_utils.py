@@ -1,12 +1,14 @@
 import sys
 import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import scipy.interpolate
 import PIL
 import torch
 import matplotlib.pyplot as plt
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
 import cv2
 
 from dust3r.utils.image import heif_support_enabled, exif_transpose, _resize_pil_image, ImgNorm
@@ -14,21 +16,96 @@ from dust3r.image_pairs import make_pairs
 from dust3r.inference import inference
 from dust3r.cloud_opt import global_aligner, GlobalAlignerMode
 
-from .cuda_splatting import render, DummyPipeline
+from .cuda_splatting import render, render_projected_features, prepare_gaussians, DummyPipeline
 from .gaussian_model import GaussianModel
-from .camera_utils import get_scaled_camera
+from .camera_utils import get_scaled_camera, estimate_pair_cameras
 from ..loss import merge_and_split_predictions
 from .camera_utils import move_c2w_along_z
+from .video_writer import VideoWriterService
 
-from einops import rearrange
 LABELS = ['wall', 'floor', 'ceiling', 'chair', 'table', 'sofa', 'bed', 'other']
 NUM_LABELS = len(LABELS) + 1
-PALLETE = plt.cm.get_cmap('tab10', NUM_LABELS)
+PALLETE = plt.get_cmap('tab10', NUM_LABELS)
 COLORS_LIST = [PALLETE(i)[:3] for i in range(NUM_LABELS)]
 COLORS = torch.tensor(COLORS_LIST, dtype=torch.float32)
-
-def load_images(folder_or_list, size, square_ok=False, verbose=True, save_dir=None):
+# colormap lookup tables, keyed by (name, num_colors, device)
+_COLORMAP_LUTS = {}
+# preprocessed images of load_images, least recently used first
+IMAGE_CACHE_SIZE = 256
+_IMAGE_CACHE = OrderedDict()
+_IMAGE_CACHE_LOCK = threading.Lock()
+
+def preprocess_image(image_path, size, square_ok=False):
+    """ open, EXIF-transpose, resize and crop one image as DUSt3R expects
+    
+    Returns:
+        img: processed RGB PIL image
+        original_size: (W1, H1) before resizing
+    """
+    img = exif_transpose(PIL.Image.open(image_path)).convert('RGB')
+    W1, H1 = img.size
+    if (size == 224) or (size == 256):
+        # resize short side to 224 (then crop)
+        img = _resize_pil_image(img, round(size * max(W1/H1, H1/W1)))
+    else:
+        # resize long side to 512
+        img = _resize_pil_image(img, size)
+    W, H = img.size
+    cx, cy = W//2, H//2
+    if (size == 224) or (size == 256):
+        half = min(cx, cy)
+        img = img.crop((cx-half, cy-half, cx+half, cy+half))
+    else:
+        halfw, halfh = ((2*cx)//32)*16, ((2*cy)//32)*16
+        if not (square_ok) and W == H:
+            halfh = 3*halfw/4
+        img = img.crop((cx-halfw, cy-halfh, cx+halfw, cy+halfh))
+    return img, (W1, H1)
+
+def _image_cache_key(image_path, size, square_ok):
+    # the file identity (path, mtime, size in bytes) and the crop mode
+    stat = os.stat(image_path)
+    key = f'{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}|{size}|{square_ok}'
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def load_preprocessed_image(image_path, size, square_ok=False, cache_dir=None):
+    """ preprocess_image through the in-memory and on-disk caches
+    
+    Returns:
+        img: (H, W, 3) uint8 RGB array
+        original_size: (W1, H1)
+        cached: whether decoding was skipped
+    """
+    key = _image_cache_key(image_path, size, square_ok)
+    with _IMAGE_CACHE_LOCK:
+        if key in _IMAGE_CACHE:
+            _IMAGE_CACHE.move_to_end(key)
+            return (*_IMAGE_CACHE[key], True)
+
+    cache_path = os.path.join(cache_dir, f'{key}.npz') if cache_dir else None
+    cached = cache_path is not None and os.path.isfile(cache_path)
+    if cached:
+        with np.load(cache_path) as data:
+            entry = (data['img'], tuple(data['original_size'].tolist()))
+    else:
+        img, original_size = preprocess_image(image_path, size, square_ok)
+        entry = (np.asarray(img), original_size)
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f'{cache_path}.tmp{os.getpid()}_{threading.get_ident()}.npz'
+            np.savez(tmp_path, img=entry[0], original_size=np.int32(original_size))
+            os.replace(tmp_path, cache_path)
+
+    with _IMAGE_CACHE_LOCK:
+        _IMAGE_CACHE[key] = entry
+        while len(_IMAGE_CACHE) > IMAGE_CACHE_SIZE:
+            _IMAGE_CACHE.popitem(last=False)
+    return (*entry, cached)
+
+def load_images(folder_or_list, size, square_ok=False, verbose=True, save_dir=None, num_workers=8, cache_dir=None):
     """ open and convert all images in a list or folder to proper input format for DUSt3R
+    Images are decoded on a thread pool. Preprocessed images are kept in memory (last IMAGE_CACHE_SIZE) and,
+    with cache_dir, on disk, keyed by path, mtime, file size and crop mode: repeated loads skip decoding.
     """
     if isinstance(folder_or_list, str):
         if verbose:
@@ -48,43 +125,30 @@ def load_images(folder_or_list, size, square_ok=False, verbose=True, save_dir=No
         supported_images_extensions += ['.heic', '.heif']
     supported_images_extensions = tuple(supported_images_extensions)
 
-    imgs = []
-    for path in folder_content:
-        if not path.lower().endswith(supported_images_extensions):
-            continue
-        img = exif_transpose(PIL.Image.open(os.path.join(root, path))).convert('RGB')
-        W1, H1 = img.size
-        if (size == 224) or (size == 256):
-            # resize short side to 224 (then crop)
-            img = _resize_pil_image(img, round(size * max(W1/H1, H1/W1)))
-        else:
-            # resize long side to 512
-            img = _resize_pil_image(img, size)
-        W, H = img.size
-        cx, cy = W//2, H//2
-        if (size == 224) or (size == 256):
-            half = min(cx, cy)
-            img = img.crop((cx-half, cy-half, cx+half, cy+half))
-        else:
-            halfw, halfh = ((2*cx)//32)*16, ((2*cy)//32)*16
-            if not (square_ok) and W == H:
-                halfh = 3*halfw/4
-            img = img.crop((cx-halfw, cy-halfh, cx+halfw, cy+halfh))
+    paths = [path for path in folder_content if path.lower().endswith(supported_images_extensions)]
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        loaded = list(executor.map(lambda path: load_preprocessed_image(os.path.join(root, path), size, square_ok, cache_dir), paths))
 
-        W2, H2 = img.size
-        if verbose:
-            print(f' - adding {path} with resolution {W1}x{H1} --> {W2}x{H2}')
-        
-        # Save the processed image if save_dir is provided
-        if save_dir:
-            os.makedirs(save_dir, exist_ok=True)
-            save_path = os.path.join(save_dir, f"processed_{len(imgs):03d}.png")
-            img.save(save_path)
+        imgs = []
+        save_futures = []
+        for path, (img_array, (W1, H1), cached) in zip(paths, loaded):
+            img = PIL.Image.fromarray(img_array)
+            W2, H2 = img.size
             if verbose:
-                print(f' - saved processed image to {save_path}')
-        
-        imgs.append(dict(img=ImgNorm(img)[None], true_shape=np.int32(
-            [img.size[::-1]]), idx=len(imgs), instance=str(len(imgs))))
+                print(f' - adding {path} with resolution {W1}x{H1} --> {W2}x{H2}' + (' (cached)' if cached else ''))
+            
+            # Save the processed image if save_dir is provided
+            if save_dir:
+                os.makedirs(save_dir, exist_ok=True)
+                save_path = os.path.join(save_dir, f"processed_{len(imgs):03d}.png")
+                save_futures.append(executor.submit(img.save, save_path))
+                if verbose:
+                    print(f' - saved processed image to {save_path}')
+            
+            imgs.append(dict(img=ImgNorm(img)[None], true_shape=np.int32(
+                [img.size[::-1]]), idx=len(imgs), instance=str(len(imgs))))
+        for future in save_futures:
+            future.result()
 
     assert imgs, 'no images foud at '+root
     if verbose:
@@ -149,48 +213,186 @@ def generate_interpolated_path(poses, n_interp, spline_degree=5,
                         s=smoothness)
     return points_to_poses(new_points) 
 
-def batch_visualize_tensor_global_pca(tensor_batch, num_components=3):
-    B, C, H, W = tensor_batch.shape
-
-    tensor_flat_all = tensor_batch.reshape(B, C, -1).permute(1, 0, 2).reshape(C, -1).T
-
-    tensor_flat_all_np = tensor_flat_all.cpu().numpy()
-
-    scaler = StandardScaler()
-    tensor_flat_all_np = scaler.fit_transform(tensor_flat_all_np)
-
-    pca = PCA(n_components=num_components)
-    tensor_reduced_all_np = pca.fit_transform(tensor_flat_all_np)
-
-    tensor_reduced_all = torch.tensor(tensor_reduced_all_np, dtype=tensor_batch.dtype).T.reshape(num_components, B, H * W).permute(1, 0, 2)
-
-    output_tensor = torch.zeros((B, 3, H, W))
-
-    for i in range(B):
-        tensor_reduced = tensor_reduced_all[i].reshape(num_components, H, W)
-        tensor_reduced -= tensor_reduced.min()
-        tensor_reduced /= tensor_reduced.max()
-        output_tensor[i] = tensor_reduced[:3]
-
-    return output_tensor
+class FeaturePCA:
+    """
+    Standardized PCA of (B, C, H, W) feature maps in torch, on the device of the features.
+    The components are fitted with randomized PCA (torch.pca_lowrank) on a random subsample of pixels,
+    frames are then projected chunk by chunk and min-max normalized per frame for visualization.
+    """
+    def __init__(self, num_components=3, max_samples=65536, niter=4, seed=0):
+        self.num_components = num_components
+        self.max_samples = max_samples
+        self.niter = niter
+        self.seed = seed
+        self.mean = None
+        self.std = None
+        self.components = None # (C, num_components)
+
+    @torch.no_grad()
+    def fit(self, tensor_batch):
+        B, C, H, W = tensor_batch.shape
+        generator = torch.Generator(device='cpu').manual_seed(self.seed)
+        # subsample pixels over all frames
+        num_samples = min(self.max_samples, B * H * W)
+        sample_idx = torch.randperm(B * H * W, generator=generator)[:num_samples].to(tensor_batch.device)
+        samples = tensor_batch.permute(0, 2, 3, 1).reshape(-1, C)[sample_idx].float()
+
+        # same as StandardScaler: population std, constant channels left unscaled
+        self.mean = samples.mean(dim=0)
+        self.std = samples.std(dim=0, unbiased=False)
+        self.std[self.std == 0] = 1.0
+        samples = (samples - self.mean) / self.std
+
+        q = min(C, num_samples, self.num_components + 5)
+        torch.manual_seed(self.seed)
+        _, _, V = torch.pca_lowrank(samples, q=q, center=True, niter=self.niter)
+        components = V[:, :self.num_components]
+        # deterministic signs as sklearn: largest absolute loading of each component is positive
+        signs = torch.sign(components.gather(0, components.abs().argmax(dim=0, keepdim=True)))
+        self.components = components * signs
+        return self
+
+    @torch.no_grad()
+    def transform(self, tensor_batch, chunk_size=16):
+        """
+        Returns:
+            (B, num_components, H, W) projections, each frame normalized to [0, 1]
+        """
+        outputs = []
+        for start in range(0, len(tensor_batch), chunk_size):
+            chunk = tensor_batch[start:start + chunk_size].float()
+            chunk = (chunk - self.mean[None, :, None, None]) / self.std[None, :, None, None]
+            reduced = torch.einsum('bchw,ck->bkhw', chunk, self.components)
+            # normalize every frame over all its components
+            frame_min = reduced.flatten(1).min(dim=1).values[:, None, None, None]
+            frame_max = reduced.flatten(1).max(dim=1).values[:, None, None, None]
+            outputs.append((reduced - frame_min) / (frame_max - frame_min).clamp(min=1e-12))
+        return torch.cat(outputs, dim=0)
+
+
+def batch_visualize_tensor_global_pca(tensor_batch, num_components=3, fit_frames=None, max_samples=65536, chunk_size=16):
+    """
+    Visualize feature maps with a PCA shared by all frames
+    
+    Args:
+        tensor_batch: (B, C, H, W) feature maps
+        num_components: PCA components, the first 3 are shown as RGB
+        fit_frames: fit on the first fit_frames frames only (None: all frames)
+        max_samples: pixels the PCA is fitted on
+        chunk_size: frames projected at once
+    
+    Returns:
+        (B, 3, H, W) visualization in [0, 1], on the device of tensor_batch
+    """
+    fit_batch = tensor_batch if fit_frames is None else tensor_batch[:fit_frames]
+    pca = FeaturePCA(num_components, max_samples).fit(fit_batch)
+    return pca.transform(tensor_batch, chunk_size)[:, :3]
 
-def depth_to_colormap(depth_tensor, colormap='jet'):
-    B, _, _, _ = depth_tensor.shape
 
-    depth_tensor = (depth_tensor - depth_tensor.min()) / (depth_tensor.max() - depth_tensor.min())
+def stream_visualize_tensor_global_pca(frames, fit_frames=16, num_components=3, max_samples=65536):
+    """
+    Streaming variant of batch_visualize_tensor_global_pca: the PCA is fitted once fit_frames frames
+    have arrived, the buffered frames are then projected and later frames are projected as they arrive
+    
+    Args:
+        frames: iterable of (C, H, W) feature maps
+    
+    Yields:
+        (3, H, W) visualizations, in the order of the frames
+    """
+    pca = None
+    buffer = []
+    for frame in frames:
+        if pca is not None:
+            yield pca.transform(frame[None])[0, :3]
+            continue
+        buffer.append(frame)
+        if len(buffer) == fit_frames:
+            pca = FeaturePCA(num_components, max_samples).fit(torch.stack(buffer))
+            for vis in pca.transform(torch.stack(buffer)):
+                yield vis[:3]
+            buffer = []
+    if buffer:
+        # fewer frames than fit_frames
+        pca = FeaturePCA(num_components, max_samples).fit(torch.stack(buffer))
+        for vis in pca.transform(torch.stack(buffer)):
+            yield vis[:3]
+
+def colormap_lut(name, num_colors=256, device='cpu'):
+    """
+    Lookup table of a matplotlib colormap ('jet', 'turbo', 'tab10', ...), built once per device
+    
+    Returns:
+        (num_colors, 3) float32 RGB in [0, 1]
+    """
+    key = (name, num_colors, str(device))
+    if key not in _COLORMAP_LUTS:
+        cmap = plt.get_cmap(name, num_colors)
+        _COLORMAP_LUTS[key] = torch.tensor(cmap(np.arange(num_colors))[:, :3], dtype=torch.float32, device=device)
+    return _COLORMAP_LUTS[key]
 
-    depth_np = depth_tensor.squeeze(1).cpu().numpy()
+def apply_colormap(values, colormap='jet', num_colors=256):
+    """
+    Colorize values in [0, 1] with one indexing op on their device (same bins as matplotlib)
+    
+    Args:
+        values: (...) tensor
+    
+    Returns:
+        (..., 3) RGB
+    """
+    lut = colormap_lut(colormap, num_colors, values.device)
+    idx = (values.clamp(0, 1) * num_colors).long().clamp(max=num_colors - 1)
+    return lut[idx]
 
-    cmap = plt.get_cmap(colormap)
-    colored_images = []
+def colorize_labels(labels, palette=COLORS):
+    """
+    Colorize a batch of label maps on their device
+    
+    Args:
+        labels: (B, H, W) integer labels
+        palette: (num_labels, 3) colors
+    
+    Returns:
+        (B, 3, H, W) RGB
+    """
+    return palette.to(labels.device)[labels].permute(0, 3, 1, 2)
 
-    for i in range(B):
-        colored_image = cmap(depth_np[i])
-        colored_images.append(colored_image[..., :3])
+def depth_percentiles(depth_tensor, percentiles=(0, 100), per_frame=False):
+    """
+    Low/high depth percentiles, over the whole batch or per frame (nearest rank, no size limit unlike torch.quantile)
+    
+    Returns:
+        low, high: tensors broadcastable to (B, 1, H, W)
+    """
+    values = depth_tensor.reshape(depth_tensor.shape[0], -1) if per_frame else depth_tensor.reshape(1, -1)
+    bounds = []
+    for q in percentiles:
+        if q <= 0:
+            bound = values.min(dim=1).values
+        elif q >= 100:
+            bound = values.max(dim=1).values
+        else:
+            bound = values.kthvalue(int(round(q / 100 * (values.shape[1] - 1))) + 1, dim=1).values
+        bounds.append(bound.view(-1, 1, 1, 1))
+    return bounds
 
-    colored_tensor = torch.tensor(np.array(colored_images), dtype=torch.float32).permute(0, 3, 1, 2)
+def depth_to_colormap(depth_tensor, colormap='jet', per_frame=False, percentiles=(0, 100)):
+    """
+    Colorize a batch of depth maps on their device
     
-    return colored_tensor
+    Args:
+        depth_tensor: (B, 1, H, W) depth
+        colormap: matplotlib colormap name, e.g. 'jet' or 'turbo'
+        per_frame: normalize every frame with its own percentiles instead of the global ones
+        percentiles: (low, high) percentiles mapped to the ends of the colormap, e.g. (2, 98) to ignore outliers
+    
+    Returns:
+        (B, 3, H, W) RGB in [0, 1]
+    """
+    low, high = depth_percentiles(depth_tensor, percentiles, per_frame)
+    depth_tensor = (depth_tensor - low) / (high - low).clamp(min=1e-12)
+    return apply_colormap(depth_tensor.squeeze(1), colormap).permute(0, 3, 1, 2)
 
 def save_video(frames, video_path, fps=24):
     """Save video using OpenCV
@@ -219,22 +421,27 @@ def save_video(frames, video_path, fps=24):
         # Ensure proper cleanup of video writer
         out.release()
 
-def tensors_to_videos(all_images, all_depth_vis, all_fmap_vis, all_sems_vis, video_dir='videos', fps=24):
+def tensors_to_videos(all_images, all_depth_vis, all_fmap_vis, all_sems_vis, video_dir='videos', fps=24,
+                      backend='auto', codec='libx264', crf=18, chunk_size=16):
+    """Encode the four output streams concurrently with VideoWriterService
+    
+    Args:
+        all_images, all_depth_vis, all_fmap_vis, all_sems_vis: (B, 3, H, W) tensors in [0, 1]
+        backend: 'auto' (ffmpeg if installed), 'ffmpeg' or 'opencv'
+        codec, crf: ffmpeg encoder settings
+        chunk_size: frames converted and queued per stream at once
+    """
     B, C, H, W = all_images.shape
     assert all_depth_vis.shape == (B, C, H, W)
     assert all_fmap_vis.shape == (B, C, H, W)
     assert all_sems_vis.shape == (B, C, H, W)
-    os.makedirs(video_dir, exist_ok=True)
 
-    all_images = (all_images.permute(0, 2, 3, 1).cpu().numpy() * 255).astype(np.uint8)
-    all_depth_vis = (all_depth_vis.permute(0, 2, 3, 1).cpu().numpy() * 255).astype(np.uint8)
-    all_fmap_vis = (all_fmap_vis.permute(0, 2, 3, 1).cpu().numpy() * 255).astype(np.uint8)
-    all_sems_vis = (all_sems_vis.permute(0, 2, 3, 1).cpu().numpy() * 255).astype(np.uint8)
-
-    save_video(all_images, os.path.join(video_dir, 'output_images_video.mp4'), fps=fps)
-    save_video(all_depth_vis, os.path.join(video_dir, 'output_depth_video.mp4'), fps=fps)
-    save_video(all_fmap_vis, os.path.join(video_dir, 'output_fmap_video.mp4'), fps=fps)
-    save_video(all_sems_vis, os.path.join(video_dir, 'output_sems_video.mp4'), fps=fps)
+    streams = {'images': all_images, 'depth': all_depth_vis, 'fmap': all_fmap_vis, 'sems': all_sems_vis}
+    with VideoWriterService(video_dir, fps=fps, backend=backend, codec=codec, crf=crf) as writer:
+        # interleave the streams so all encoders are busy
+        for start in range(0, B, chunk_size):
+            for name, frames in streams.items():
+                writer.write(name, frames[start:start + chunk_size])
 
     print(f'Videos saved to {video_dir}')
 
@@ -260,7 +467,7 @@ def transfer_images_to_device(images, device):
         transferred_images.append(transferred_dict)
     return transferred_images
 
-def render_camera_path(video_poses, camera_params, gaussians, model, device, pipeline, bg_color, image_shape):
+def render_camera_path(video_poses, camera_params, gaussians, model, device, pipeline, bg_color, image_shape, semantic_mode='feature'):
     """Helper function to render camera path
     
     Args:
@@ -272,6 +479,8 @@ def render_camera_path(video_poses, camera_params, gaussians, model, device, pip
         pipeline: Rendering pipeline
         bg_color: Background color
         image_shape: Image dimensions
+        semantic_mode: 'feature' decodes the expanded 512-d feature map of every frame,
+            'logits' projects class logits (and the feature video channels) per Gaussian and rasterizes only those
     
     Returns:
         rendered_images: Rendered images
@@ -284,6 +493,19 @@ def render_camera_path(video_poses, camera_params, gaussians, model, device, pip
     rendered_feats = []
     rendered_depths = []
     rendered_sems = []
+    if semantic_mode == 'logits':
+        # logits and the feature video channels (every 16th expanded channel) are linear in the Gaussian features
+        logit_weight, logit_bias = model.semantic_logit_head(LABELS)
+        expansion = model.feature_expansion[1]
+        projection_weight = torch.cat([logit_weight, expansion.weight[::16, :, 0, 0]], dim=0)
+        projection_bias = torch.cat([logit_bias, expansion.bias[::16]], dim=0)
+        gaussian_inputs = prepare_gaussians(gaussians, pipeline, projection_weight=projection_weight)
+    elif semantic_mode == 'feature':
+        # encode the labels once for the whole path
+        model.lseg_feature_extractor.precompute_text_features([LABELS], device)
+        gaussian_inputs = prepare_gaussians(gaussians, pipeline)
+    else:
+        raise ValueError(f"Unknown semantic mode {semantic_mode}")
     
     for i in range(len(video_poses)):
         target_extrinsics = torch.zeros(4, 4).to(device)
@@ -291,23 +513,29 @@ def render_camera_path(video_poses, camera_params, gaussians, model, device, pip
         target_extrinsics[:3, :4] = torch.tensor(video_poses[i], device=device)
         camera = get_scaled_camera(extrinsics[0], target_extrinsics, intrinsics[0], 1.0, image_shape)
         
-        rendered_output = render(camera, gaussians, pipeline, bg_color)
+        if semantic_mode == 'logits':
+            rendered_output = render_projected_features(camera, gaussians, pipeline, bg_color, projection_weight, projection_bias,
+                                                        gaussian_inputs=gaussian_inputs)
+            logits, feature_map = rendered_output['feature_map'][None].split([len(LABELS), projection_weight.shape[0] - len(LABELS)], dim=1)
+        else:
+            rendered_output = render(camera, gaussians, pipeline, bg_color, gaussian_inputs=gaussian_inputs)
+            
+            # Process feature map
+            feature_map = rendered_output['feature_map']
+            feature_map = model.feature_expansion(feature_map[None, ...])
+            
+            # Process semantic map
+            logits = model.lseg_feature_extractor.decode_feature(feature_map, labelset=LABELS)
+            
+            # Downsample and upsample feature map
+            feature_map = feature_map[:, ::16, ...]
+            feature_map = torch.nn.functional.interpolate(feature_map, scale_factor=2, mode='bilinear', align_corners=True)
         rendered_images.append(rendered_output['render'])
         
-        # Process feature map
-        feature_map = rendered_output['feature_map']
-        feature_map = model.feature_expansion(feature_map[None, ...])
-        
-        # Process semantic map
-        logits = model.lseg_feature_extractor.decode_feature(feature_map, labelset=LABELS)
         semantic_map = torch.argmax(logits, dim=1) + 1
-        mask = COLORS[semantic_map.cpu()]
-        mask = rearrange(mask, 'b h w c -> b c h w')
+        mask = colorize_labels(semantic_map)
         rendered_sems.append(mask.squeeze(0))
-            
-        # Downsample and upsample feature map
-        feature_map = feature_map[:, ::16, ...]
-        feature_map = torch.nn.functional.interpolate(feature_map, scale_factor=2, mode='bilinear', align_corners=True)
+        
         rendered_feats.append(feature_map[0])
         del feature_map
         
@@ -322,57 +550,90 @@ def render_camera_path(video_poses, camera_params, gaussians, model, device, pip
     return rendered_images, rendered_feats, rendered_depths, rendered_sems
 
 @torch.no_grad()
-def render_video_from_file(file_list, model, output_path, device='cuda', resolution=224, n_interp=90, fps=30, path_type='default'):
-    # 1. Load images
-    images = load_images(file_list, resolution, save_dir=os.path.join(output_path, 'processed_images'))
-    images = transfer_images_to_device(images, device)  # Transfer images to the specified device
-    image_shape = images[0]['true_shape'][0]
+def predict_scene(images, model, device='cuda', pose_mode='pairviewer'):
+    """
+    Gaussians and input cameras of an image pair
     
-    # 2. Get camera pose    
-    pairs = make_pairs(images, prefilter=None, symmetrize=True)
-    output = inference(pairs, model.dust3r.dust3r, device, batch_size=1)
-    mode = GlobalAlignerMode.PairViewer
-    scene = global_aligner(output, device=device, mode=mode)
-    extrinsics = scene.get_im_poses()
-    intrinsics = scene.get_intrinsics()
-    video_poses = generate_interpolated_path(extrinsics[:, :3, :].cpu().numpy(), n_interp=n_interp)
+    Args:
+        images: output of load_images, on device
+        pose_mode: 'forward' estimates the cameras from the pointmaps of the LSM forward pass,
+            'pairviewer' runs a second symmetrized dust3r inference and the PairViewer global aligner
     
-    # 3. Get gaussians
+    Returns:
+        gaussians: GaussianModel
+        extrinsics: (2, 4, 4) camera-to-world
+        intrinsics: (2, 3, 3)
+    """
     pred1, pred2 = model(*images)
     pred = merge_and_split_predictions(pred1, pred2)
     gaussians = GaussianModel.from_predictions(pred[0], sh_degree=3)
     
-    # 4. Render original viewpoint
+    if pose_mode == 'forward':
+        extrinsics, intrinsics = estimate_pair_cameras(pred1, pred2)
+        extrinsics, intrinsics = extrinsics[0], intrinsics[0]
+    elif pose_mode == 'pairviewer':
+        pairs = make_pairs(images, prefilter=None, symmetrize=True)
+        output = inference(pairs, model.dust3r.dust3r, device, batch_size=1)
+        mode = GlobalAlignerMode.PairViewer
+        scene = global_aligner(output, device=device, mode=mode)
+        extrinsics = scene.get_im_poses()
+        intrinsics = scene.get_intrinsics()
+    else:
+        raise ValueError(f"Unknown pose_mode {pose_mode}, expected 'forward' or 'pairviewer'")
+    return gaussians, extrinsics, intrinsics
+
+@torch.no_grad()
+def render_scene_videos(gaussians, extrinsics, intrinsics, image_shape, model, output_path, device='cuda', n_interp=90, fps=30,
+                        semantic_mode='feature', path_variants=(('', 0.0), ('moved', 2.0))):
+    """
+    Render, encode and save the videos of every camera path, then the Gaussians (gaussians.ply is written last)
+    
+    Args:
+        path_variants: (subdirectory of output_path, distance) of every rendered camera path, the input cameras
+            are moved backward along their Z axes by distance. All paths are rendered in one pass and share the feature PCA.
+    """
+    variant_extrinsics = move_c2w_along_z(extrinsics, [distance for _, distance in path_variants])
+    video_poses = [generate_interpolated_path(variant[:, :3, :].detach().cpu().numpy(), n_interp=n_interp)
+                   for variant in variant_extrinsics]
+    
+    # Render all camera paths
     pipeline = DummyPipeline()
     bg_color = torch.tensor([0.0, 0.0, 0.0]).to(device)
     camera_params = (extrinsics, intrinsics)
     
     rendered_images, rendered_feats, rendered_depths, rendered_sems = render_camera_path(
-        video_poses, camera_params, gaussians, model, device, pipeline, bg_color, image_shape)
+        np.concatenate(video_poses), camera_params, gaussians, model, device, pipeline, bg_color, image_shape, semantic_mode)
     
-    # 5. Visualization
-    all_fmap_vis = batch_visualize_tensor_global_pca(rendered_feats)
-    all_depth_vis = depth_to_colormap(rendered_depths)
-    all_sems_vis = rendered_sems
+    # Visualization, one PCA basis so the feature colors match across paths
+    pca = FeaturePCA().fit(rendered_feats)
+    lengths = [len(poses) for poses in video_poses]
+    for (subdir, _), variant_images, feats, depths, sems in zip(path_variants, rendered_images.split(lengths), rendered_feats.split(lengths),
+                                                                rendered_depths.split(lengths), rendered_sems.split(lengths)):
+        fmap_vis = pca.transform(feats)[:, :3]
+        depth_vis = depth_to_colormap(depths)
+        
+        # Save videos
+        variant_output_path = os.path.join(output_path, subdir)
+        os.makedirs(variant_output_path, exist_ok=True)
+        tensors_to_videos(variant_images, depth_vis, fmap_vis, sems, variant_output_path, fps=fps)
     
-    # 6. Save videos and gaussian point cloud
-    tensors_to_videos(rendered_images, all_depth_vis, all_fmap_vis, all_sems_vis, output_path, fps=fps)
+    # Save gaussian point cloud
     gaussians.save_ply(os.path.join(output_path, 'gaussians.ply'))
+
+@torch.no_grad()
+def render_video_from_file(file_list, model, output_path, device='cuda', resolution=224, n_interp=90, fps=30, path_type='default', semantic_mode='feature', image_cache_dir=None, pose_mode='pairviewer',
+                           path_variants=(('', 0.0), ('moved', 2.0))):
+    """
+    Load an image pair, predict its Gaussians and cameras (predict_scene) and render its videos (render_scene_videos)
+    """
+    # 1. Load images
+    images = load_images(file_list, resolution, save_dir=os.path.join(output_path, 'processed_images'), cache_dir=image_cache_dir)
+    images = transfer_images_to_device(images, device)  # Transfer images to the specified device
+    image_shape = images[0]['true_shape'][0]
     
-    # 7. Render moved viewpoint
-    moved_extrinsics = move_c2w_along_z(extrinsics, 2.0)
-    moved_video_poses = generate_interpolated_path(moved_extrinsics[:, :3, :].cpu().numpy(), n_interp=n_interp)
-    camera_params = (extrinsics, intrinsics)
-    
-    moved_rendered_images, moved_rendered_feats, moved_rendered_depths, moved_rendered_sems = render_camera_path(
-        moved_video_poses, camera_params, gaussians, model, device, pipeline, bg_color, image_shape)
-    
-    # 8. Visualize and save moved results
-    moved_all_fmap_vis = batch_visualize_tensor_global_pca(moved_rendered_feats)
-    moved_all_depth_vis = depth_to_colormap(moved_rendered_depths)
-    moved_all_sems_vis = moved_rendered_sems
+    # 2. Get gaussians and camera pose
+    gaussians, extrinsics, intrinsics = predict_scene(images, model, device, pose_mode)
     
-    moved_output_path = os.path.join(output_path, 'moved')
-    os.makedirs(moved_output_path, exist_ok=True)
-    tensors_to_videos(moved_rendered_images, moved_all_depth_vis, moved_all_fmap_vis, moved_all_sems_vis, 
-                     moved_output_path, fps=fps)
+    # 3. Render and save
+    render_scene_videos(gaussians, extrinsics, intrinsics, image_shape, model, output_path, device, n_interp, fps,
+                        semantic_mode, path_variants)
@@ -10,71 +10,63 @@ import numpy as np
 import argparse
 from tqdm import tqdm
 import json
+import time
 import torch
 import cv2
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+from data_process.base_processor import compute_resize_params, resize_and_crop_frames, _init_cpu_worker
+from data_process.frame_writer import FrameWriter
 
 
 def resize_and_crop_images(color_data, depth_data, target_height=448, target_width=448, device='cpu'):
     """
-    Resize and center crop using EXACT same logic as LSM (base_processor.py lines 91-113).
+    Resize and center crop a batch of frames with the shared LSM kernel (data_process/base_processor.py).
     But only return images, no intrinsics adjustment.
     
     Args:
-        color_data: numpy array (H, W, 3)
-        depth_data: numpy array (H, W)
+        color_data: numpy array (N, H, W, 3)
+        depth_data: numpy array (N, H, W)
         target_height: target height after processing
         target_width: target width after processing
         device: torch device
     
     Returns:
-        Tuple of (processed_image, processed_depth)
+        Tuple of (processed_images (N, target_height, target_width, 3), processed_depths (N, target_height, target_width))
     """
     # Convert to torch tensors (same as LSM)
     color_data = torch.from_numpy(color_data.astype(np.float32)).to(device)
     depth_data = torch.from_numpy(depth_data.astype(np.float32)).to(device)
     
-    # Add batch dimension
-    color_data = color_data.unsqueeze(0)  # (1, H, W, 3)
-    depth_data = depth_data.unsqueeze(0)  # (1, H, W)
-    
-    # Get original dimensions (EXACT same as LSM line 92)
-    batch_size, original_h, original_w = depth_data.shape
-    
-    # Calculate resize ratio (EXACT same as LSM lines 93-95)
-    h_ratio = target_height / original_h
-    w_ratio = target_width / original_w
-    ratio = max(h_ratio, w_ratio)
-    new_h, new_w = int(original_h * ratio), int(original_w * ratio)
-    
-    # Ensure dimensions are at least target size (handle rounding)
-    if new_h < target_height:
-        new_h = target_height
-    if new_w < target_width:
-        new_w = target_width
-    
-    # Calculate crop offsets (same as LSM lines 102-103)
-    start_x = (new_w - target_width) // 2
-    start_y = (new_h - target_height) // 2
-    
-    # Resize images (EXACT same as LSM lines 107-109)
-    depth_data = torch.nn.functional.interpolate(depth_data.unsqueeze(1), size=(new_h, new_w), mode='nearest')
-    color_data = torch.nn.functional.interpolate(color_data.permute(0, 3, 1, 2), size=(new_h, new_w), mode='bilinear')
-    
-    # Crop images (EXACT same as LSM lines 111-113)
-    depth_data = depth_data[:, :, start_y:start_y + target_height, start_x:start_x + target_width]
-    color_data = color_data[:, :, start_y:start_y + target_height, start_x:start_x + target_width]
+    _, original_h, original_w = depth_data.shape
+    resize_params = compute_resize_params(original_h, original_w, target_height, target_width)
+    color_data, depth_data = resize_and_crop_frames(color_data, depth_data, resize_params, target_height, target_width)
     
-    # Convert back to numpy (remove batch dimension)
-    color_data = color_data[0].permute(1, 2, 0).cpu().numpy()
-    depth_data = depth_data[0, 0].cpu().numpy()
+    # Convert back to numpy, one device to host copy per batch
+    color_data = color_data.permute(0, 2, 3, 1).contiguous().cpu().numpy()
+    depth_data = depth_data[:, 0].contiguous().cpu().numpy()
     
     return color_data, depth_data
 
 
-def process_scene(scene_path, output_path, selected_frames, target_height=448, target_width=448, device='cpu'):
+def load_frame(images_dir, depths_dir, frame_id):
+    # Load image and depth using cv2 (same as LSM), BGR color
+    color_data = cv2.imread(os.path.join(images_dir, f'{frame_id}.jpg'))
+    depth_data = cv2.imread(os.path.join(depths_dir, f'{frame_id}.png'), cv2.IMREAD_UNCHANGED)
+    if color_data is None:
+        raise IOError(f"missing image for frame {frame_id} in {images_dir}")
+    if depth_data is None:
+        raise IOError(f"missing depth for frame {frame_id} in {depths_dir}")
+    return color_data, depth_data
+
+
+def process_scene(scene_path, output_path, selected_frames, target_height=448, target_width=448, device='cpu',
+                  io_threads=8):
     """
     Process a single scene - IMAGES ONLY (no intrinsics/poses).
     Only processes frames specified in selected_seqs_test.json (30 frames per scene).
+    Frames are read and written by a thread pool and resized in one batch per frame size.
     
     Args:
         scene_path: path to the scene folder
@@ -83,6 +75,7 @@ def process_scene(scene_path, output_path, selected_frames, target_height=448, t
         target_height: target height for processed images
         target_width: target width for processed images
         device: torch device
+        io_threads: threads decoding and encoding images
     """
     scene_name = os.path.basename(scene_path)
     
@@ -95,47 +88,50 @@ def process_scene(scene_path, output_path, selected_frames, target_height=448, t
     images_dir = os.path.join(scene_path, 'images')
     depths_dir = os.path.join(scene_path, 'depths')
     
-    # Use frame IDs from JSON (LSM selects 30 frames per scene)
-    frame_ids = selected_frames
+    # Load all selected frames in parallel, cv2 releases the GIL while decoding
+    frames = {}
+    with ThreadPoolExecutor(max_workers=io_threads) as executor:
+        futures = {executor.submit(load_frame, images_dir, depths_dir, frame_id): frame_id for frame_id in selected_frames}
+        for future in as_completed(futures):
+            try:
+                frames[futures[future]] = future.result()
+            except Exception as e:
+                print(f"  Error processing {futures[future]}: {e}")
+    
+    # Batch frames of the same size (a scene normally has a single size)
+    groups = {}
+    for frame_id in selected_frames:
+        if frame_id in frames:
+            groups.setdefault(frames[frame_id][1].shape, []).append(frame_id)
     
     processed_count = 0
-    
-    for frame_id in tqdm(frame_ids, desc=f"Processing {scene_name}"):
-        try:
-            # Load image using cv2 (same as LSM)
-            image_path = os.path.join(images_dir, f'{frame_id}.jpg')
-            color_data = cv2.imread(image_path)  # BGR format
-            
-            # Load depth using cv2 (same as LSM)
-            depth_path = os.path.join(depths_dir, f'{frame_id}.png')
-            depth_data = cv2.imread(depth_path, cv2.IMREAD_UNCHANGED)
-            
-            # Process using EXACT same resize logic as LSM
+    with FrameWriter(num_threads=io_threads, max_pending=2 * len(selected_frames) + 2) as writer:
+        for frame_ids in groups.values():
             color_processed, depth_processed = resize_and_crop_images(
-                color_data, depth_data, target_height, target_width, device
+                np.stack([frames[frame_id][0] for frame_id in frame_ids]),
+                np.stack([frames[frame_id][1] for frame_id in frame_ids]),
+                target_height, target_width, device
             )
-            
-            # Save processed image
-            color_save_path = os.path.join(output_scene_path, 'color', f'{frame_id}.png')
             color_processed = color_processed.astype(np.uint8)
-            cv2.imwrite(color_save_path, color_processed)
-            
-            # Save processed depth
-            depth_save_path = os.path.join(output_scene_path, 'depth', f'{frame_id}.png')
             depth_processed = depth_processed.astype(np.uint16)
-            cv2.imwrite(depth_save_path, depth_processed)
-            
-            processed_count += 1
             
-        except Exception as e:
-            print(f"  Error processing {frame_id}: {e}")
-            continue
+            for frame_id, color, depth in zip(frame_ids, color_processed, depth_processed):
+                writer.write_color(os.path.join(output_scene_path, 'color', f'{frame_id}.png'), color)
+                writer.write_depth(os.path.join(output_scene_path, 'depth', f'{frame_id}.png'), depth)
+                processed_count += 1
     
-    print(f"  Processed {processed_count} frames")
-    torch.cuda.empty_cache()
+    print(f"  Processed {processed_count} frames of {scene_name}")
     return processed_count
 
 
+def _process_scene_task(scene_path, output_path, selected_frames, target_height, target_width, device, io_threads):
+    try:
+        return process_scene(scene_path, output_path, selected_frames, target_height, target_width, device, io_threads)
+    except Exception as e:
+        print(f"Error processing scene {os.path.basename(scene_path)}: {e}")
+        return 0
+
+
 def main():
     parser = argparse.ArgumentParser(description='Preprocess ScanNet test images using LSM resize logic')
     parser.add_argument('--input_dir', type=str, 
@@ -152,12 +148,15 @@ def main():
                         help='Process only a specific scene (for testing)')
     parser.add_argument('--device', type=str, default='cpu',
                         help='Device to use (cpu or cuda)')
+    parser.add_argument('--num_workers', type=int, default=8,
+                        help='Scenes processed in parallel by a process pool')
+    parser.add_argument('--threads_per_worker', type=int, default=1,
+                        help='Torch/OpenCV threads of each worker process')
+    parser.add_argument('--io_threads', type=int, default=8,
+                        help='Threads reading and writing images in each worker')
     
     args = parser.parse_args()
     
-    # Setup device
-    device = torch.device(args.device)
-    
     # Create output directory
     os.makedirs(args.output_dir, exist_ok=True)
     
@@ -182,8 +181,7 @@ def main():
     print(f"Using selected_seqs_test.json (30 frames per scene)")
     print()
     
-    total_processed = 0
-    
+    scene_tasks = []
     for scene_name, frame_list in selected_seqs.items():
         scene_path = os.path.join(args.input_dir, scene_name)
         
@@ -197,15 +195,24 @@ def main():
         if not os.path.isdir(os.path.join(scene_path, 'depths')):
             print(f"Skipping {scene_name}: no depths folder")
             continue
-        
-        processed = process_scene(scene_path, args.output_dir, frame_list,
-                                  args.target_height, args.target_width, device)
-        total_processed += processed
+        scene_tasks.append((scene_path, args.output_dir, frame_list, args.target_height, args.target_width,
+                            args.device, args.io_threads))
+    
+    # Scenes are independent, distribute them over a process pool
+    start = time.time()
+    total_processed = 0
+    num_workers = max(1, min(args.num_workers, len(scene_tasks)))
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('spawn'),
+                             initializer=_init_cpu_worker, initargs=(args.threads_per_worker,)) as executor:
+        futures = [executor.submit(_process_scene_task, *task) for task in scene_tasks]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Scenes"):
+            total_processed += future.result()
+    elapsed = time.time() - start
     
     print()
     print("=" * 60)
     print(f"Preprocessing complete!")
-    print(f"Total frames processed: {total_processed}")
+    print(f"Total frames processed: {total_processed} in {elapsed:.1f}s ({total_processed / max(elapsed, 1e-6):.1f} frames/s)")
     print(f"Output saved to: {args.output_dir}")
     print("=" * 60)
 
@@ -0,0 +1,107 @@
+"""
+Open-vocabulary search over exported LSM scenes (gaussians.ply written by render_video_from_file / demo.py)
+
+Usage:
+    python scene_search.py build --ply_dir outputs --model_path checkpoints/lsm.pth --index_path scenes_index.npz --nlist 1024 --pq_m 64
+    python scene_search.py query --index_path scenes_index.npz --model_path checkpoints/lsm.pth --text chair sofa
+"""
+import os
+import time
+import argparse
+import torch
+
+from large_spatial_model.utils.path_manager import init_all_submodules
+init_all_submodules()
+
+from large_spatial_model.model import LSM_Dust3R
+from large_spatial_model.utils.gaussian_model import GaussianModel
+from large_spatial_model.utils.semantic_index import SemanticIndex
+
+
+def find_scenes(ply_dir, ply_name):
+    scenes = []
+    for root, _, files in os.walk(ply_dir):
+        if ply_name in files:
+            scenes.append((os.path.relpath(root, ply_dir), os.path.join(root, ply_name)))
+    return sorted(scenes)
+
+
+def build(args, model):
+    scenes = find_scenes(args.ply_dir, args.ply_name)
+    print(f"Found {len(scenes)} scenes in {args.ply_dir}")
+    if not scenes:
+        return
+    start = time.time()
+
+    def scene_features(ply_path):
+        gaussians = GaussianModel.load_ply(ply_path)
+        keep = (gaussians.get_opacity[:, 0] >= args.min_opacity).nonzero()[:, 0]
+        features = gaussians.get_expanded_semantic_feature(model.feature_expansion)[keep.to(args.device)]
+        return features, gaussians.get_xyz[keep], keep
+
+    index = SemanticIndex()
+    if args.nlist > 0 or args.pq_m > 0:
+        # IVF centroids / PQ codebooks are trained on a sample spread over the scenes
+        train_scenes = scenes[::max(1, len(scenes) // args.train_scenes)]
+        per_scene = max(1, args.train_size // len(train_scenes))
+        sample = []
+        for _, ply_path in train_scenes:
+            features = scene_features(ply_path)[0]
+            sample.append(features[torch.randperm(len(features))[:per_scene].to(features.device)])
+        index = SemanticIndex.train(torch.cat(sample), args.nlist, args.pq_m, keep_features=not args.drop_features)
+        print(f"Trained on {sum(len(features) for features in sample)} features of {len(train_scenes)} scenes")
+
+    for i, (scene_name, ply_path) in enumerate(scenes, 1):
+        features, xyz, keep = scene_features(ply_path)
+        index.add(features, xyz.to(args.device), scene_name, keep)
+        if i % 100 == 0 or i == len(scenes):
+            print(f"[{i}/{len(scenes)}] {len(index)} Gaussians indexed, {time.time() - start:.1f}s")
+
+    index.save(args.index_path)
+    print(f"Saved index of {len(index.scene_names)} scenes to {args.index_path}")
+
+
+def query(args, model):
+    index = SemanticIndex.load(args.index_path, device=args.device)
+    print(f"Loaded index of {len(index.scene_names)} scenes, {len(index)} Gaussians")
+    start = time.time()
+    results = index.query(model, args.text, top_k=args.top_k, threshold=args.threshold, nprobe=args.nprobe)
+    print(f"{len(args.text)} queries in {(time.time() - start) * 1000:.1f} ms")
+    for text, matches in zip(args.text, results):
+        print(f"\n'{text}': {len(matches)} scenes")
+        for match in matches[:args.num_scenes]:
+            bbox = match['bbox'].cpu().numpy().round(3)
+            print(f"  {match['scene']}: score {match['score']:.3f}, {len(match['gaussian_ids'])} Gaussians, "
+                  f"bbox {bbox[0].tolist()} - {bbox[1].tolist()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='index the Gaussians of exported scenes')
+    build_parser.add_argument('--ply_dir', type=str, required=True, help='directory searched recursively for scenes')
+    build_parser.add_argument('--ply_name', type=str, default='gaussians.ply')
+    build_parser.add_argument('--min_opacity', type=float, default=0.1, help='Gaussians below this opacity are not indexed')
+    build_parser.add_argument('--nlist', type=int, default=0, help='IVF lists, 0 for exact search')
+    build_parser.add_argument('--pq_m', type=int, default=0, help='PQ sub-vectors (divides 512), 0 to disable')
+    build_parser.add_argument('--drop_features', action='store_true', help='keep only the PQ codes')
+    build_parser.add_argument('--train_size', type=int, default=262144, help='features the IVF/PQ k-means are trained on')
+    build_parser.add_argument('--train_scenes', type=int, default=256, help='scenes the training features are sampled from')
+    query_parser = subparsers.add_parser('query', help='search the index with text queries')
+    query_parser.add_argument('--text', type=str, nargs='+', required=True)
+    query_parser.add_argument('--top_k', type=int, default=1000, help='matched Gaussians per query')
+    query_parser.add_argument('--threshold', type=float, default=None, help='minimum cosine similarity')
+    query_parser.add_argument('--nprobe', type=int, default=8, help='IVF lists scored per query')
+    query_parser.add_argument('--num_scenes', type=int, default=10, help='scenes printed per query')
+    for sub in (build_parser, query_parser):
+        sub.add_argument('--model_path', type=str, required=True)
+        sub.add_argument('--index_path', type=str, required=True)
+        sub.add_argument('--device', type=str, default='cuda')
+    args = parser.parse_args()
+
+    model = LSM_Dust3R.from_pretrained(args.model_path, device=args.device)
+    model.eval()
+    if args.command == 'build':
+        build(args, model)
+    else:
+        query(args, model)